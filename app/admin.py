@@ -1,12 +1,333 @@
 """SQLAdmin configuration and model views for database administration"""
 
-from sqladmin import Admin, ModelView
+import asyncio
+import logging
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import ClassVar, Dict, Optional
 
-from app.database import engine
-from app.models import Conversation, LeadData, Message, PTPreferences
+from fastapi import HTTPException
+from sqladmin import Admin, BaseView, ModelView, expose
+from sqladmin.pagination import Pagination
+from sqlalchemy import and_, func, or_, select, text, tuple_
+from sqlalchemy.orm import object_session, selectinload
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.datastructures import URL
+from starlette.requests import Request
 
+from app.analytics import (
+    forget_lead,
+    forget_score,
+    pt_summary,
+    record_new_lead,
+    record_score,
+    record_status_change,
+)
+from app.database import AdminSessionLocal, ReadSessionLocal
+from app.exports import record_deletions
+from app.models import (
+    Conversation,
+    LeadDailyStats,
+    LeadData,
+    LeadScoreBucket,
+    Message,
+    PTPreferences,
+)
 
-class ConversationAdmin(ModelView, model=Conversation):
+from app.search import FullTextIndex, lead_search_index, message_search_index
+
+logger = logging.getLogger(__name__)
+
+TEMPLATES_DIR = Path(__file__).parent / "templates"
+
+
+class KeysetPagination(Pagination):
+    """
+    Pagination whose "next" link carries a cursor (`after`) so the next page
+    is read with a range condition on the sort key instead of an OFFSET.
+    Jumping to an arbitrary page number still falls back to OFFSET.
+    """
+
+    def __init__(self, *args, next_cursor: Optional[str] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.next_cursor = next_cursor
+
+    def add_pagination_urls(self, base_url: URL) -> None:
+        super().add_pagination_urls(base_url.remove_query_params("after"))
+        for page_control in self.page_controls:
+            if page_control.number == self.page + 1 and self.next_cursor:
+                page_control.url = str(
+                    URL(page_control.url).include_query_params(after=self.next_cursor)
+                )
+
+
+class FullTextSearchMixin:
+    """
+    Search a ModelView through a full-text index instead of LIKE scans.
+
+    Results are ranked by relevance, paginated by (rank, id) cursors, and
+    the searched column shows a highlighted snippet. Falls back to the
+    default LIKE search when the index is not available.
+    """
+
+    search_index: ClassVar[Optional[FullTextIndex]] = None
+    search_snippet_column: ClassVar[Optional[str]] = None
+
+    def _full_text_enabled(self) -> bool:
+        return self.search_index is not None and self.search_index.available
+
+    def search_query(self, stmt, term: str):
+        if not self._full_text_enabled():
+            return super().search_query(stmt, term)
+        return self.search_index.filter(stmt, self.pk_columns[0], term)
+
+    @staticmethod
+    def _parse_rank_cursor(cursor: str) -> tuple[float, int]:
+        try:
+            rank, last_id = cursor.rsplit("|", 1)
+            return float(rank), int(last_id)
+        except ValueError as exc:
+            raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+
+    async def list(self, request: Request) -> Pagination:
+        term = request.query_params.get("search")
+        if not term or not self._full_text_enabled():
+            return await super().list(request)
+
+        page = self.validate_page_number(request.query_params.get("page"), 1)
+        page_size = self.validate_page_number(
+            request.query_params.get("pageSize"), self.page_size
+        )
+        page_size = min(max(page_size, 1), max(self.page_size_options))
+
+        pk = self.pk_columns[0]
+        hits = self.search_index.hits(term)
+        stmt = select(self.model, hits.c.rank).join(hits, hits.c.id == pk)
+        for relation in self._list_relations:
+            stmt = stmt.options(selectinload(relation))
+
+        count = await self.count(request, select(func.count()).select_from(hits))
+        page = min(max(page, 1), Pagination.max_page(count, page_size))
+
+        cursor = request.query_params.get("after")
+        if cursor:
+            rank, last_id = self._parse_rank_cursor(cursor)
+            stmt = stmt.where(
+                or_(hits.c.rank > rank, and_(hits.c.rank == rank, pk < last_id))
+            )
+        else:
+            stmt = stmt.offset((page - 1) * page_size)
+        stmt = stmt.order_by(hits.c.rank, pk.desc()).limit(page_size)
+
+        rows = await self._run_arbitrary_query(stmt)
+        objects = [obj for obj, _ in rows]
+
+        if self.search_snippet_column:
+
+            def load_snippets():
+                with self.session_maker() as session:
+                    return self.search_index.snippets(
+                        session,
+                        term,
+                        [getattr(obj, pk.name) for obj in objects],
+                        column_name=self.search_snippet_column,
+                    )
+
+            snippets = await run_in_threadpool(load_snippets)
+            for obj in objects:
+                obj.search_snippet = snippets.get(getattr(obj, pk.name))
+
+        next_cursor = None
+        if len(rows) == page_size:
+            last_obj, last_rank = rows[-1]
+            next_cursor = f"{last_rank!r}|{getattr(last_obj, pk.name)}"
+
+        return KeysetPagination(
+            rows=objects,
+            page=page,
+            page_size=page_size,
+            count=count,
+            next_cursor=next_cursor,
+        )
+
+
+class RowCountCache:
+    """
+    Cached table row counts for unfiltered admin listings.
+
+    A stale count is served immediately while a refresh runs in the
+    background, so list pages never wait on COUNT(*) after the first load.
+    On Postgres the planner's estimate (pg_class.reltuples) is used for
+    large tables instead of an exact count.
+    """
+
+    def __init__(self, ttl_seconds: float = 60.0, exact_below: int = 100_000):
+        self.ttl_seconds = ttl_seconds
+        self.exact_below = exact_below
+        self._counts: Dict[str, tuple[int, float]] = {}
+        self._refreshing: set[str] = set()
+        # Background refreshes, kept so they are not garbage collected mid-run
+        self._tasks: set[asyncio.Task] = set()
+
+    def _count(self, session_maker, model) -> int:
+        table_name = model.__table__.name
+        with session_maker() as session:
+            if session.get_bind().dialect.name == "postgresql":
+                estimate = session.execute(
+                    text("SELECT reltuples::bigint FROM pg_class WHERE relname = :name"),
+                    {"name": table_name},
+                ).scalar()
+                if estimate is not None and estimate >= self.exact_below:
+                    return int(estimate)
+            return session.execute(select(func.count()).select_from(model)).scalar()
+
+    async def _refresh(self, session_maker, model) -> int:
+        table_name = model.__table__.name
+        self._refreshing.add(table_name)
+        try:
+            count = await run_in_threadpool(self._count, session_maker, model)
+            self._counts[table_name] = (count, time.monotonic())
+            return count
+        except Exception as e:
+            logger.error(f"Failed to refresh row count for {table_name}: {e}")
+            raise
+        finally:
+            self._refreshing.discard(table_name)
+
+    async def get(self, session_maker, model) -> int:
+        table_name = model.__table__.name
+        cached = self._counts.get(table_name)
+        if cached is None:
+            return await self._refresh(session_maker, model)
+
+        count, refreshed_at = cached
+        stale = time.monotonic() - refreshed_at > self.ttl_seconds
+        if stale and table_name not in self._refreshing:
+            self._refreshing.add(table_name)
+            task = asyncio.get_running_loop().create_task(self._refresh(session_maker, model))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return count
+
+
+row_counts = RowCountCache()
+
+
+class KeysetListMixin:
+    """
+    List a ModelView with keyset pagination on its default sort column.
+
+    Unfiltered listings in the default order read the next page with a
+    range condition on (sort column, primary key) carried in the `after`
+    cursor, and use a cached row count. Only the "next" link carries a
+    cursor: a page reached any other way (page links, a typed page number,
+    the last page) is still read with OFFSET, as is any page when searching,
+    filtering or sorting by another column.
+    """
+
+    def _keyset_applicable(self, request: Request) -> bool:
+        params = request.query_params
+        if params.get("search") or params.get("sortBy"):
+            return False
+        filter_names = {filter_.parameter_name for filter_ in self.get_filters()}
+        return not filter_names.intersection(params.keys())
+
+    def _keyset_columns(self):
+        """(sort column, descending) of the default sort plus the primary key"""
+        pk = self.pk_columns[0]
+        sort_field, is_desc = self._get_default_sort()[0]
+        sort_column = getattr(self.model, self._get_prop_name(sort_field))
+        if sort_column.key == pk.key:
+            return None, pk, is_desc
+        return sort_column, pk, is_desc
+
+    @staticmethod
+    def _encode_cursor(value) -> str:
+        if isinstance(value, datetime):
+            return value.isoformat()
+        return str(value)
+
+    def _decode_cursor(self, cursor: str, sort_column):
+        try:
+            if sort_column is None:
+                return None, int(cursor)
+            value, last_id = cursor.rsplit("|", 1)
+            python_type = sort_column.type.python_type
+            if python_type is datetime:
+                return datetime.fromisoformat(value), int(last_id)
+            return python_type(value), int(last_id)
+        except (ValueError, NotImplementedError) as exc:
+            raise HTTPException(status_code=400, detail="Invalid cursor") from exc
+
+    async def list(self, request: Request) -> Pagination:
+        if not self._keyset_applicable(request):
+            return await super().list(request)
+
+        page = self.validate_page_number(request.query_params.get("page"), 1)
+        page_size = self.validate_page_number(
+            request.query_params.get("pageSize"), self.page_size
+        )
+        page_size = min(max(page_size, 1), max(self.page_size_options))
+
+        count = await row_counts.get(self.session_maker, self.model)
+        page = min(max(page, 1), Pagination.max_page(count, page_size))
+
+        sort_column, pk, is_desc = self._keyset_columns()
+        stmt = self.list_query(request)
+        for relation in self._list_relations:
+            stmt = stmt.options(selectinload(relation))
+
+        cursor = request.query_params.get("after")
+        if cursor:
+            value, last_id = self._decode_cursor(cursor, sort_column)
+            if sort_column is None:
+                stmt = stmt.where(pk < last_id if is_desc else pk > last_id)
+            else:
+                # Row-value comparison so the (sort column, pk) index is used
+                # as a single range scan
+                key, bound = tuple_(sort_column, pk), tuple_(value, last_id)
+                stmt = stmt.where(key < bound if is_desc else key > bound)
+        else:
+            stmt = stmt.offset((page - 1) * page_size)
+
+        order = [pk.desc() if is_desc else pk.asc()]
+        if sort_column is not None:
+            order.insert(0, sort_column.desc() if is_desc else sort_column.asc())
+        stmt = stmt.order_by(*order).limit(page_size)
+
+        rows = await self._run_query(stmt)
+
+        next_cursor = None
+        if len(rows) == page_size:
+            last = rows[-1]
+            last_id = getattr(last, pk.key)
+            if sort_column is None:
+                next_cursor = str(last_id)
+            elif getattr(last, sort_column.key) is not None:
+                value = self._encode_cursor(getattr(last, sort_column.key))
+                next_cursor = f"{value}|{last_id}"
+
+        return KeysetPagination(
+            rows=rows,
+            page=page,
+            page_size=page_size,
+            count=count,
+            next_cursor=next_cursor,
+        )
+
+
+def _snippet_or_value(attribute: str):
+    """List formatter showing the search snippet when there is one"""
+
+    def formatter(model, _attribute):
+        return getattr(model, "search_snippet", None) or getattr(model, attribute)
+
+    return formatter
+
+
+class ConversationAdmin(KeysetListMixin, ModelView, model=Conversation):
     """Admin view for Conversation model"""
 
     name = "Conversation"
@@ -41,6 +362,10 @@ class ConversationAdmin(ModelView, model=Conversation):
         Conversation.updated_at,
     ]
 
+    # Conversations start with a lead's first message (webhook), which also
+    # creates their lead data and counts them in the analytics aggregates
+    can_create = False
+
     # Form configuration
     form_columns = [
         Conversation.phone_number,
@@ -48,14 +373,49 @@ class ConversationAdmin(ModelView, model=Conversation):
         Conversation.pt_id,
     ]
 
+    async def on_model_change(self, data, model, is_created, request) -> None:
+        """Move an edited conversation between aggregate buckets, in the same commit"""
+        db = object_session(model)
+        status = data.get("status", model.status)
+        pt_id = data.get("pt_id", model.pt_id)
+        if pt_id != model.pt_id:
+            lead_data = db.query(LeadData).filter_by(conversation_id=model.id).first()
+            forget_lead(db, model, lead_data)
+            model.pt_id, model.status = pt_id, status
+            record_new_lead(db, model)
+            if lead_data is not None and lead_data.qualification_score is not None:
+                record_score(db, model, lead_data.qualification_score)
+        elif status != model.status:
+            record_status_change(db, model, status)
+
+    async def on_model_delete(self, model, request) -> None:
+        """Remove the conversation from the aggregates and record tombstones
+        for it and its cascaded messages and lead data, in the same commit"""
+        db = object_session(model)
+        lead_data = db.query(LeadData).filter_by(conversation_id=model.id).first()
+        forget_lead(db, model, lead_data)
+        message_ids = [
+            message_id
+            for (message_id,) in db.query(Message.id).filter_by(conversation_id=model.id)
+        ]
+        record_deletions(db, "messages", message_ids)
+        if lead_data is not None:
+            record_deletions(db, "leads", [lead_data.id])
+        record_deletions(db, "conversations", [model.id])
+
 
-class MessageAdmin(ModelView, model=Message):
+class MessageAdmin(FullTextSearchMixin, KeysetListMixin, ModelView, model=Message):
     """Admin view for Message model"""
 
     name = "Message"
     name_plural = "Messages"
     icon = "fa-solid fa-message"
 
+    # Full-text search (FTS5 / tsvector) instead of LIKE scans
+    search_index = message_search_index
+    search_snippet_column = "content"
+    column_formatters = {Message.content: _snippet_or_value("content")}
+
     # List view configuration
     column_list = [
         Message.id,
@@ -91,14 +451,23 @@ class MessageAdmin(ModelView, model=Message):
         Message.twilio_message_sid,
     ]
 
+    async def on_model_delete(self, model, request) -> None:
+        """Tombstone for incremental exports, in the same commit"""
+        record_deletions(object_session(model), "messages", [model.id])
+
 
-class LeadDataAdmin(ModelView, model=LeadData):
+class LeadDataAdmin(FullTextSearchMixin, KeysetListMixin, ModelView, model=LeadData):
     """Admin view for LeadData model"""
 
     name = "Lead"
     name_plural = "Leads"
     icon = "fa-solid fa-user"
 
+    # Full-text search over goals and location
+    search_index = lead_search_index
+    search_snippet_column = "goals"
+    column_formatters = {LeadData.goals: _snippet_or_value("goals")}
+
     # List view configuration
     column_list = [
         LeadData.id,
@@ -130,25 +499,52 @@ class LeadDataAdmin(ModelView, model=LeadData):
         LeadData.budget_range,
         LeadData.commitment_level,
         LeadData.availability,
+        LeadData.name,
+        LeadData.email,
         LeadData.qualification_score,
         LeadData.is_qualified,
         LeadData.reasoning,
     ]
 
-    # Form configuration
+    # Created with their conversation by the webhook
+    can_create = False
+
+    # Form configuration (the conversation is fixed: scores are counted
+    # under its PT and day)
     form_columns = [
-        LeadData.conversation_id,
         LeadData.goals,
         LeadData.age,
         LeadData.location,
         LeadData.budget_range,
         LeadData.commitment_level,
         LeadData.availability,
+        LeadData.name,
+        LeadData.email,
         LeadData.qualification_score,
         LeadData.is_qualified,
         LeadData.reasoning,
     ]
 
+    async def on_model_change(self, data, model, is_created, request) -> None:
+        """Move an edited score between aggregate buckets, in the same commit"""
+        score = data.get("qualification_score", model.qualification_score)
+        if score == model.qualification_score:
+            return
+        db = object_session(model)
+        conversation = db.get(Conversation, model.conversation_id)
+        if model.qualification_score is not None:
+            forget_score(db, conversation, model.qualification_score)
+        if score is not None:
+            record_score(db, conversation, score)
+
+    async def on_model_delete(self, model, request) -> None:
+        """Remove the score from the aggregates and record a tombstone, in the
+        same commit"""
+        db = object_session(model)
+        if model.qualification_score is not None:
+            forget_score(db, db.get(Conversation, model.conversation_id), model.qualification_score)
+        record_deletions(db, "leads", [model.id])
+
 
 class PTPreferencesAdmin(ModelView, model=PTPreferences):
     """Admin view for PTPreferences model"""
@@ -161,18 +557,24 @@ class PTPreferencesAdmin(ModelView, model=PTPreferences):
     column_list = [
         PTPreferences.id,
         PTPreferences.name,
+        PTPreferences.whatsapp_number,
         PTPreferences.specialty,
         PTPreferences.preferred_location,
         PTPreferences.min_budget,
         PTPreferences.required_commitment,
     ]
-    column_searchable_list = [PTPreferences.name, PTPreferences.specialty]
+    column_searchable_list = [
+        PTPreferences.name,
+        PTPreferences.specialty,
+        PTPreferences.whatsapp_number,
+    ]
     column_sortable_list = [PTPreferences.id, PTPreferences.name]
 
     # Detail view configuration
     column_details_list = [
         PTPreferences.id,
         PTPreferences.name,
+        PTPreferences.whatsapp_number,
         PTPreferences.bio,
         PTPreferences.specialty,
         PTPreferences.target_goals,
@@ -189,11 +591,14 @@ class PTPreferencesAdmin(ModelView, model=PTPreferences):
         PTPreferences.booking_confirmation_override,
         PTPreferences.prompt_version,
         PTPreferences.prompts_last_updated,
+        PTPreferences.llm_weight,
+        PTPreferences.llm_min_share,
     ]
 
     # Form configuration
     form_columns = [
         PTPreferences.name,
+        PTPreferences.whatsapp_number,
         PTPreferences.bio,
         PTPreferences.specialty,
         PTPreferences.target_goals,
@@ -209,17 +614,118 @@ class PTPreferencesAdmin(ModelView, model=PTPreferences):
         PTPreferences.rejection_email_override,
         PTPreferences.booking_confirmation_override,
         PTPreferences.prompt_version,
+        PTPreferences.llm_weight,
+        PTPreferences.llm_min_share,
     ]
 
 
+class LeadDailyStatsAdmin(ModelView, model=LeadDailyStats):
+    """Read-only admin view for daily lead aggregates"""
+
+    name = "Daily Lead Stats"
+    name_plural = "Daily Lead Stats"
+    icon = "fa-solid fa-calendar-day"
+    category = "Analytics"
+
+    can_create = False
+    can_edit = False
+    can_delete = False
+
+    # List view configuration
+    column_list = [
+        LeadDailyStats.pt_id,
+        LeadDailyStats.day,
+        LeadDailyStats.status,
+        LeadDailyStats.lead_count,
+        LeadDailyStats.time_to_qualify_seconds,
+        LeadDailyStats.time_to_qualify_samples,
+    ]
+    column_sortable_list = [
+        LeadDailyStats.pt_id,
+        LeadDailyStats.day,
+        LeadDailyStats.status,
+        LeadDailyStats.lead_count,
+    ]
+    column_default_sort = [(LeadDailyStats.day, True)]
+
+
+class LeadScoreBucketAdmin(ModelView, model=LeadScoreBucket):
+    """Read-only admin view for the lead score distribution"""
+
+    name = "Score Bucket"
+    name_plural = "Score Distribution"
+    icon = "fa-solid fa-chart-column"
+    category = "Analytics"
+
+    can_create = False
+    can_edit = False
+    can_delete = False
+
+    # List view configuration
+    column_list = [
+        LeadScoreBucket.pt_id,
+        LeadScoreBucket.day,
+        LeadScoreBucket.bucket,
+        LeadScoreBucket.lead_count,
+        LeadScoreBucket.score_sum,
+    ]
+    column_sortable_list = [
+        LeadScoreBucket.pt_id,
+        LeadScoreBucket.day,
+        LeadScoreBucket.bucket,
+    ]
+    column_default_sort = [(LeadScoreBucket.day, True)]
+
+
+class AnalyticsDashboard(BaseView):
+    """Read-only per-PT funnel dashboard built from the aggregate tables"""
+
+    name = "Dashboard"
+    icon = "fa-solid fa-chart-line"
+    category = "Analytics"
+
+    @expose("/analytics", methods=["GET"])
+    async def dashboard(self, request: Request):
+        def load_summary():
+            db = ReadSessionLocal()
+            try:
+                return pt_summary(db)
+            finally:
+                db.close()
+
+        summary = await run_in_threadpool(load_summary)
+        return await self.templates.TemplateResponse(
+            request, "analytics.html", {"summary": summary}
+        )
+
+
 def setup_admin(app) -> Admin:
     """Initialize and configure SQLAdmin for the FastAPI application"""
-    admin = Admin(app, engine, title="PT Lead Qualification Admin")
+    # Admin browsing runs on the read engine; edits go to the primary
+    admin = Admin(
+        app,
+        session_maker=AdminSessionLocal,
+        title="PT Lead Qualification Admin",
+        templates_dir=str(TEMPLATES_DIR),
+    )
 
     # Register model views
     admin.add_view(ConversationAdmin)
     admin.add_view(MessageAdmin)
     admin.add_view(LeadDataAdmin)
     admin.add_view(PTPreferencesAdmin)
+    admin.add_view(LeadDailyStatsAdmin)
+    admin.add_view(LeadScoreBucketAdmin)
+    admin.add_base_view(AnalyticsDashboard)
+
+    return admin
+
+
+def create_admin_app() -> Starlette:
+    """
+    Build the admin as a standalone ASGI app, to be mounted at /admin.
 
-    return admin
\ No newline at end of file
+    main.py mounts it through LazyASGIApp so SQLAdmin is only imported and
+    configured on the first admin request.
+    """
+    return setup_admin(Starlette()).admin
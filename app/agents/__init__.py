@@ -1,5 +1,11 @@
 from app.agents.discovery import DiscoveryAgent
 from app.agents.extraction import ExtractionAgent
+from app.agents.hedging import Hedger, hedging_stats, run_agent
+from app.agents.limiter import LLMLimiter, LLMOverloaded, llm_limiter
 from app.agents.scoring import ScoringAgent
 
-__all__ = ["DiscoveryAgent", "ExtractionAgent", "ScoringAgent"]
+__all__ = [
+    "DiscoveryAgent", "ExtractionAgent", "ScoringAgent",
+    "LLMLimiter", "LLMOverloaded", "llm_limiter",
+    "Hedger", "hedging_stats", "run_agent",
+]
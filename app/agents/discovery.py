@@ -1,6 +1,6 @@
 """Discovery Agent - Conducts natural conversation to extract lead information"""
 import logging
-from pydantic_ai import Agent
+from app.agents.hedging import run_agent
 from app.config import get_settings
 from app.models import PTPreferences
 from app.prompts import PromptManager
@@ -44,6 +44,9 @@ class DiscoveryAgent:
         """
         system_prompt = self._create_system_prompt(pt)
 
+        # Imported here: pydantic_ai is slow to import and only needed per call
+        from pydantic_ai import Agent
+
         # Create agent with system prompt
         agent = Agent(
             'claude-sonnet-4-5-20250929',
@@ -65,7 +68,7 @@ class DiscoveryAgent:
         # Combine context with current message
         prompt = f"{context}\n\nUser: {user_message}" if context else user_message
 
-        # Run the agent
-        result = await agent.run(prompt)
+        # Run the agent (under the LLM concurrency limit, hedged if enabled)
+        result = await run_agent("discovery", agent, prompt, pt_id=pt.id)
 
         return result.output
@@ -1,6 +1,8 @@
 """Extraction Agent - Extracts structured data from conversation"""
-from pydantic_ai import Agent
+from typing import Optional
+
 from app.schemas.lead import ExtractedLeadData
+from app.agents.hedging import run_agent
 from app.config import get_settings
 
 
@@ -24,19 +26,26 @@ To set has_all_info = true, the user must have CONFIRMED all of these:
 5. **Location** - Location confirmed or online preference stated
 6. **Availability** - Days/times they can train
 
+The user's name and email address are optional: extract them if the user shared them, but never wait for them before setting has_all_info.
+
 CRITICAL: If the assistant just ASKED about budget but the user hasn't RESPONDED yet, budget is null and has_all_info = false.
 Do NOT mark has_all_info = true if any question is still awaiting a response."""
 
-    async def extract_data(self, conversation_history: list[dict]) -> ExtractedLeadData:
+    async def extract_data(
+        self, conversation_history: list[dict], pt_id: Optional[int] = None
+    ) -> ExtractedLeadData:
         """
         Extract structured data from conversation history
 
         Args:
             conversation_history: List of dicts with 'role' and 'content' keys
+            pt_id: PT whose LLM capacity the call uses
 
         Returns:
             ExtractedLeadData with structured information
         """
+        from pydantic_ai import Agent
+
         # Create agent with structured output
         agent = Agent(
             'claude-sonnet-4-5-20250929',
@@ -56,7 +65,7 @@ Do NOT mark has_all_info = true if any question is still awaiting a response."""
 
 Extract all available information and determine if we have enough to score this lead."""
 
-        # Run the agent
-        result = await agent.run(prompt)
+        # Run the agent (under the LLM concurrency limit, hedged if enabled)
+        result = await run_agent("extraction", agent, prompt, pt_id=pt_id)
 
         return result.output
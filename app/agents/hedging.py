@@ -0,0 +1,216 @@
+"""
+Hedged agent calls, to cut tail latency.
+
+With LLM_HEDGING_ENABLED, an agent call that has not returned after the
+LLM_HEDGE_PERCENTILE latency of that agent's recent calls is sent a second
+time. Whichever attempt succeeds first wins and the other is cancelled.
+
+- the hedge delay adapts: it is the percentile of the agent's last
+  HEDGE_WINDOW successful attempts, and hedging waits for
+  LLM_HEDGE_MIN_SAMPLES of them. A first attempt cancelled because its
+  hedge won counts at the time it had run (a lower bound), so the slow
+  tail hedging cuts off still shapes the delay
+- hedges are capped at LLM_HEDGE_BUDGET of calls (e.g. 0.1 = at most one
+  extra request per ten calls), and only sent while the LLM limiter has an
+  idle slot, so hedging never competes with first attempts for capacity
+- when a hedge wins, the time saved is estimated from the agent's latency
+  history: the expected remaining time of a call that has already run as
+  long as the cancelled one had
+
+Per-agent latency histograms, hedge counts and estimated savings are under
+`llm.hedging` on /health.
+"""
+
+import asyncio
+import logging
+import time
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional
+
+from app.agents.limiter import LLMOverloaded, llm_limiter
+from app.config import get_settings
+from app.metrics import agent_call_seconds, agent_calls_in_flight
+from app.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+HEDGE_WINDOW = 500
+MAX_CREDIT = 10.0
+# Upper bounds (seconds) of the reported latency histogram buckets
+BUCKETS = [0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, float("inf")]
+
+
+def _percentile(ordered: List[float], percentile: float) -> Optional[float]:
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, int(len(ordered) * percentile / 100))
+    return ordered[index]
+
+
+class LatencyHistogram:
+    """Recent latencies (for percentiles) plus all-time bucket counts"""
+
+    def __init__(self, window: int = HEDGE_WINDOW):
+        self.recent: Deque[float] = deque(maxlen=window)
+        self.counts = [0] * len(BUCKETS)
+
+    def add(self, seconds: float) -> None:
+        self.recent.append(seconds)
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        return _percentile(sorted(self.recent), percentile)
+
+    def expected_remaining(self, elapsed: float) -> float:
+        """Expected further latency of a call still running after `elapsed`"""
+        tail = [seconds for seconds in self.recent if seconds > elapsed]
+        return sum(tail) / len(tail) - elapsed if tail else 0.0
+
+    def stats(self) -> dict:
+        ordered = sorted(self.recent)
+        return {
+            "p50": _percentile(ordered, 50),
+            "p95": _percentile(ordered, 95),
+            "p99": _percentile(ordered, 99),
+            "buckets": {
+                ("+Inf" if bound == float("inf") else str(bound)): count
+                for bound, count in zip(BUCKETS, self.counts)
+            },
+        }
+
+
+class Hedger:
+    """Hedging policy and statistics for one agent"""
+
+    def __init__(self, name: str):
+        self.settings = get_settings()
+        self.name = name
+        # Single attempts that succeeded, or first attempts cut short by a hedge
+        self.attempts = LatencyHistogram()
+        self.observed: Deque[float] = deque(maxlen=HEDGE_WINDOW)  # What callers waited
+        self._credit = MAX_CREDIT
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.saved_seconds = 0.0
+
+    def hedge_delay(self) -> Optional[float]:
+        if not self.settings.llm_hedging_enabled:
+            return None
+        if len(self.attempts.recent) < self.settings.llm_hedge_min_samples:
+            return None
+        return self.attempts.percentile(self.settings.llm_hedge_percentile)
+
+    async def _timed(self, attempt: Callable[[], Awaitable[Any]], primary: bool = False) -> Any:
+        started = time.monotonic()
+        try:
+            result = await attempt()
+        except asyncio.CancelledError:
+            if primary:
+                # It would have taken at least this long; dropping it would
+                # lower the percentile (and the delay) with every hedge
+                self.attempts.add(time.monotonic() - started)
+            raise
+        self.attempts.add(time.monotonic() - started)
+        return result
+
+    async def run(self, attempt: Callable[[], Awaitable[Any]]) -> Any:
+        """Await `attempt()`, hedging with a second `attempt()` if it runs long"""
+        self.calls += 1
+        self._credit = min(MAX_CREDIT, self._credit + self.settings.llm_hedge_budget)
+        started = time.monotonic()
+        primary = asyncio.ensure_future(self._timed(attempt, primary=True))
+        tasks = [primary]
+        try:
+            delay = self.hedge_delay()
+            if delay is not None:
+                await asyncio.wait([primary], timeout=delay)
+            if primary.done() or delay is None or self._credit < 1 or not llm_limiter.idle_slots():
+                result = await primary
+            else:
+                self._credit -= 1
+                self.hedged += 1
+                logger.debug(f"Hedging {self.name} call after {delay:.2f}s")
+                hedge = asyncio.ensure_future(self._timed(attempt))
+                tasks.append(hedge)
+                result = await self._first_success(primary, hedge, started)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
+
+        self.observed.append(time.monotonic() - started)
+        return result
+
+    async def _first_success(self, primary: asyncio.Future, hedge: asyncio.Future, started: float) -> Any:
+        pending = {primary, hedge}
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in (primary, hedge):
+                if task not in done:
+                    continue
+                if task.exception() is not None:
+                    error = error or task.exception()
+                    continue
+                if task is hedge and primary in pending:
+                    self.hedge_wins += 1
+                    self.saved_seconds += self.attempts.expected_remaining(
+                        time.monotonic() - started
+                    )
+                return task.result()
+        raise error
+
+    def stats(self) -> dict:
+        observed = sorted(self.observed)
+        delay = self.hedge_delay()
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedge_rate": round(self.hedged / self.calls, 3) if self.calls else None,
+            "hedge_wins": self.hedge_wins,
+            "hedge_delay_seconds": round(delay, 3) if delay is not None else None,
+            "estimated_saved_seconds": round(self.saved_seconds, 3),
+            "attempt_latency": self.attempts.stats(),
+            "observed_p99": _percentile(observed, 99),
+        }
+
+
+_hedgers: Dict[str, Hedger] = {}
+
+
+def hedger(name: str) -> Hedger:
+    """The hedger for agent `name`, created on first use"""
+    if name not in _hedgers:
+        _hedgers[name] = Hedger(name)
+    return _hedgers[name]
+
+
+async def run_agent(name: str, agent, prompt: str, pt_id: Optional[int] = None):
+    """Run a pydantic-ai agent under the LLM limiter, hedged if enabled"""
+
+    async def attempt():
+        with tracer.span("llm.attempt") as span:
+            waiting = time.perf_counter()
+            # Waits for, or is shed by, the LLM concurrency limit
+            async with llm_limiter.slot(pt_id=pt_id):
+                span.set_attribute("queued_ms", round((time.perf_counter() - waiting) * 1000, 3))
+                return await agent.run(prompt)
+
+    started = time.perf_counter()
+    outcome = "error"
+    try:
+        with agent_calls_in_flight.track(name), tracer.span(f"agent.{name}", pt_id=pt_id):
+            result = await hedger(name).run(attempt)
+        outcome = "ok"
+        return result
+    except LLMOverloaded:
+        outcome = "shed"
+        raise
+    finally:
+        agent_call_seconds.observe(time.perf_counter() - started, name, outcome)
+
+
+def hedging_stats() -> dict:
+    return {name: hedger.stats() for name, hedger in sorted(_hedgers.items())}
@@ -0,0 +1,314 @@
+"""
+Concurrency limit and fair scheduling for LLM calls.
+
+At most LLM_MAX_CONCURRENCY agent calls run at once; the rest wait, at
+most LLM_MAX_QUEUE callers in all. The limit is enforced per process: the
+worker pool (WORKER_PROCESSES) splits it between its workers, but several
+uvicorn workers or hosts each get the full LLM_MAX_CONCURRENCY, so divide
+it by their number when running more than one. A caller that cannot start
+within its deadline (LLM_QUEUE_TIMEOUT_SECONDS by default) gets
+LLMOverloaded instead of piling onto an overloaded provider:
+
+- straight away, if the queue is full or its expected wait is already past
+  the deadline
+- otherwise when the deadline passes while still queued
+
+Calls also go through the "llm" circuit breaker (app.resilience): while the
+provider is failing, calls are shed at once ("circuit_open") rather than
+each waiting out its own timeout.
+
+process_message answers a shed discovery call with LLM_DEGRADED_REPLY, so
+the lead hears back at once while the backlog drains.
+
+Waiting calls are queued per PT and a freed slot goes to:
+
+1. a PT running fewer calls than its guaranteed share
+   (PTPreferences.llm_min_share x LLM_MAX_CONCURRENCY), most under-served
+   first
+2. otherwise the PT with the lowest virtual time. Each call a PT starts
+   advances its virtual time by 1 / llm_weight, so under contention PTs get
+   slots in proportion to their weights, and a PT that was idle does not
+   bank credit
+
+Idle capacity is never held back: with free slots, any PT's call starts at
+once. When the queue is full, the PT furthest over its weighted share of
+the queue loses its newest waiter, so one PT's burst cannot take every
+queue place.
+"""
+
+import asyncio
+import logging
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from typing import AsyncIterator, Deque, Dict, Optional
+
+from app.config import get_settings
+from app.pt_cache import pt_cache
+from app.resilience import CircuitOpen, circuit_breaker
+
+logger = logging.getLogger(__name__)
+
+EWMA_ALPHA = 0.2
+THROUGHPUT_WINDOW_SECONDS = 60.0
+
+llm_breaker = circuit_breaker("llm", slow_call_seconds=30.0)
+
+
+class LLMOverloaded(Exception):
+    """An LLM call was shed: no capacity within the caller's deadline"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"LLM capacity exhausted ({reason})")
+        self.reason = reason
+
+
+@dataclass
+class Waiter:
+    future: asyncio.Future
+    queued_at: float
+
+
+@dataclass
+class Tenant:
+    """Scheduling state and counters for one PT"""
+
+    weight: float = 1.0
+    min_slots: int = 0
+    in_flight: int = 0
+    vtime: float = 0.0
+    waiters: Deque[Waiter] = field(default_factory=deque)
+    admitted: int = 0
+    completed: int = 0
+    shed: int = 0
+    waited: int = 0
+    wait_total: float = 0.0
+    wait_max: float = 0.0
+    recent: Deque[float] = field(default_factory=deque)  # Completion times
+
+    def stats(self, now: float) -> dict:
+        while self.recent and now - self.recent[0] > THROUGHPUT_WINDOW_SECONDS:
+            self.recent.popleft()
+        return {
+            "weight": self.weight,
+            "guaranteed_slots": self.min_slots,
+            "in_flight": self.in_flight,
+            "queued": len(self.waiters),
+            "admitted": self.admitted,
+            "completed": self.completed,
+            "shed": self.shed,
+            "calls_per_minute": len(self.recent) * 60 / THROUGHPUT_WINDOW_SECONDS,
+            "avg_wait_seconds": round(self.wait_total / self.waited, 3) if self.waited else None,
+            "max_wait_seconds": round(self.wait_max, 3),
+        }
+
+
+class LLMLimiter:
+    """Bounded concurrency, queueing and per-PT fair sharing for agent calls"""
+
+    def __init__(self):
+        self.settings = get_settings()
+        self.max_concurrency = self.settings.llm_max_concurrency
+        self.max_queue = self.settings.llm_max_queue
+        self._in_flight = 0
+        self._queued = 0
+        self._tenants: Dict[Optional[int], Tenant] = {}
+        self._vclock = 0.0
+        self._call_seconds: Optional[float] = None  # EWMA of call duration
+        self.admitted = 0
+        self.shed: Dict[str, int] = {
+            "queue_full": 0, "deadline": 0, "timeout": 0, "circuit_open": 0,
+        }
+        self._waited = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _tenant(self, pt_id: Optional[int]) -> Tenant:
+        """Tenant state, with weight and guarantee refreshed from the PT's settings"""
+        tenant = self._tenants.get(pt_id)
+        if tenant is None:
+            tenant = self._tenants[pt_id] = Tenant(vtime=self._vclock)
+        pt = pt_cache.get(pt_id) if pt_id is not None else None
+        if pt is not None:
+            tenant.weight = pt.llm_weight if pt.llm_weight and pt.llm_weight > 0 else 1.0
+            share = min(max(pt.llm_min_share or 0.0, 0.0), 1.0)
+            tenant.min_slots = math.ceil(share * self.max_concurrency) if share else 0
+        return tenant
+
+    def idle_slots(self) -> int:
+        """Slots a call could take right now without queueing"""
+        return 0 if self._queued else max(0, self.max_concurrency - self._in_flight)
+
+    def expected_wait(self, tenant: Tenant) -> Optional[float]:
+        """Seconds until a call queued now for `tenant` should start"""
+        if self._call_seconds is None:
+            return None
+        backlogged = [t for t in self._tenants.values() if t.waiters or t is tenant]
+        share = tenant.weight / sum(t.weight for t in backlogged)
+        slots = max(self.max_concurrency * share, tenant.min_slots, 1)
+        return (len(tenant.waiters) + 1) * self._call_seconds / slots
+
+    @asynccontextmanager
+    async def slot(
+        self, pt_id: Optional[int] = None, timeout: Optional[float] = None
+    ) -> AsyncIterator[None]:
+        """
+        Run the block in an LLM slot charged to `pt_id`.
+
+        Raises LLMOverloaded if no slot frees up within `timeout`
+        (default LLM_QUEUE_TIMEOUT_SECONDS).
+        """
+        tenant = self._tenant(pt_id)
+        try:
+            permit = llm_breaker.acquire()
+        except CircuitOpen:
+            raise self._shed(tenant, "circuit_open") from None
+        try:
+            await self._acquire(
+                tenant, self.settings.llm_queue_timeout_seconds if timeout is None else timeout
+            )
+        except BaseException:
+            permit.cancel()
+            raise
+        started = permit.started = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            permit.done(e)
+            raise
+        else:
+            permit.done()
+        finally:
+            now = time.monotonic()
+            elapsed = now - started
+            if self._call_seconds is None:
+                self._call_seconds = elapsed
+            else:
+                self._call_seconds += EWMA_ALPHA * (elapsed - self._call_seconds)
+            tenant.completed += 1
+            tenant.recent.append(now)
+            self._release(tenant)
+
+    def _shed(self, tenant: Tenant, reason: str) -> LLMOverloaded:
+        self.shed[reason] += 1
+        tenant.shed += 1
+        logger.debug(
+            f"Shedding LLM call ({reason}): {self._in_flight} running, {self._queued} queued"
+        )
+        return LLMOverloaded(reason)
+
+    def _start(self, tenant: Tenant) -> None:
+        """Charge a started call to the tenant's virtual time"""
+        tenant.in_flight += 1
+        tenant.admitted += 1
+        self.admitted += 1
+        start = max(tenant.vtime, self._vclock)
+        self._vclock = start
+        tenant.vtime = start + 1.0 / tenant.weight
+
+    def _make_room(self, tenant: Tenant) -> bool:
+        """Evict the newest waiter of the PT most over its share of the queue"""
+        backlogged = [t for t in self._tenants.values() if t.waiters]
+        if not backlogged:
+            return False  # Nothing queued to evict (e.g. LLM_MAX_QUEUE=0)
+        victim = max(backlogged, key=lambda t: len(t.waiters) / t.weight)
+        if victim is tenant or len(victim.waiters) / victim.weight <= (
+            len(tenant.waiters) + 1
+        ) / tenant.weight:
+            return False
+        waiter = victim.waiters.pop()
+        self._queued -= 1
+        waiter.future.set_exception(self._shed(victim, "queue_full"))
+        return True
+
+    async def _acquire(self, tenant: Tenant, timeout: float) -> None:
+        if self._in_flight < self.max_concurrency and not self._queued:
+            self._in_flight += 1
+            self._start(tenant)
+            return
+        if self._queued >= self.max_queue and not self._make_room(tenant):
+            raise self._shed(tenant, "queue_full")
+        expected = self.expected_wait(tenant)
+        if expected is not None and expected > timeout:
+            raise self._shed(tenant, "deadline")
+
+        if not tenant.waiters:
+            # Back from idle: no credit for the time it wasn't competing
+            tenant.vtime = max(tenant.vtime, self._vclock)
+        waiter = Waiter(asyncio.get_running_loop().create_future(), time.monotonic())
+        tenant.waiters.append(waiter)
+        self._queued += 1
+        try:
+            await asyncio.wait_for(waiter.future, timeout)
+        except LLMOverloaded:
+            raise  # Evicted by _make_room
+        except BaseException as e:
+            future = waiter.future
+            if future.done() and not future.cancelled() and future.exception() is None:
+                # Handed a slot just as we gave up: pass it on
+                self._release(tenant)
+            else:
+                future.cancel()
+                try:
+                    tenant.waiters.remove(waiter)
+                    self._queued -= 1
+                except ValueError:
+                    pass
+            if isinstance(e, asyncio.TimeoutError):
+                raise self._shed(tenant, "timeout") from None
+            raise
+
+        # _release handed its slot over, so _in_flight is already counted
+        waited = time.monotonic() - waiter.queued_at
+        self._waited += 1
+        self._wait_total += waited
+        self._wait_max = max(self._wait_max, waited)
+        tenant.waited += 1
+        tenant.wait_total += waited
+        tenant.wait_max = max(tenant.wait_max, waited)
+
+    def _next_tenant(self) -> Optional[Tenant]:
+        backlogged = [t for t in self._tenants.values() if t.waiters]
+        if not backlogged:
+            return None
+        under_share = [t for t in backlogged if t.in_flight < t.min_slots]
+        if under_share:
+            return min(under_share, key=lambda t: t.in_flight / t.min_slots)
+        return min(backlogged, key=lambda t: t.vtime)
+
+    def _release(self, tenant: Tenant) -> None:
+        """Free the tenant's slot, handing it to the next waiter if there is one"""
+        tenant.in_flight -= 1
+        while True:
+            following = self._next_tenant()
+            if following is None:
+                self._in_flight -= 1
+                return
+            waiter = following.waiters.popleft()
+            self._queued -= 1
+            if not waiter.future.done():
+                self._start(following)
+                waiter.future.set_result(None)
+                return
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self._in_flight,
+            "queued": self._queued,
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "avg_wait_seconds": round(self._wait_total / self._waited, 3) if self._waited else None,
+            "max_wait_seconds": round(self._wait_max, 3),
+            "call_seconds": round(self._call_seconds, 3) if self._call_seconds is not None else None,
+            "tenants": {
+                str(pt_id): tenant.stats(now) for pt_id, tenant in self._tenants.items()
+            },
+        }
+
+
+llm_limiter = LLMLimiter()
@@ -1,7 +1,7 @@
 """Scoring Agent - Scores leads against PT preferences"""
-from pydantic_ai import Agent
 from app.schemas.lead import ExtractedLeadData, QualificationScore
 from app.models import PTPreferences
+from app.agents.hedging import run_agent
 from app.config import get_settings
 
 
@@ -50,6 +50,8 @@ Provide:
         """
         system_prompt = self._create_system_prompt(pt)
 
+        from pydantic_ai import Agent  # Deferred, see DiscoveryAgent.get_response
+
         # Create agent with structured output
         agent = Agent(
             'claude-sonnet-4-5-20250929',
@@ -69,7 +71,7 @@ Availability: {lead_data.availability}
 
 Provide a comprehensive scoring assessment."""
 
-        # Run the agent
-        result = await agent.run(prompt)
+        # Run the agent (under the LLM concurrency limit, hedged if enabled)
+        result = await run_agent("scoring", agent, prompt, pt_id=pt.id)
 
         return result.output
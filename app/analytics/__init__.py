@@ -0,0 +1,21 @@
+"""Lead analytics aggregates maintained alongside conversation changes"""
+
+from app.analytics.aggregates import (
+    forget_lead,
+    forget_score,
+    pt_summary,
+    rebuild_aggregates,
+    record_new_lead,
+    record_score,
+    record_status_change,
+)
+
+__all__ = [
+    "forget_lead",
+    "forget_score",
+    "pt_summary",
+    "rebuild_aggregates",
+    "record_new_lead",
+    "record_score",
+    "record_status_change",
+]
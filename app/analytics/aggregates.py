@@ -0,0 +1,269 @@
+"""
+Incrementally maintained lead analytics.
+
+Aggregates live in small tables bucketed by PT, creation day and status
+(see app/models/lead_stats.py). Every function here only stages changes on
+the caller's session, so the aggregates are committed in the same
+transaction as the conversation/lead change they describe.
+"""
+
+import logging
+from collections import defaultdict
+from datetime import date, datetime, timezone
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.models import Conversation, LeadDailyStats, LeadData, LeadScoreBucket
+
+logger = logging.getLogger(__name__)
+
+
+def _day(conversation: Conversation) -> date:
+    created_at = conversation.created_at or datetime.now(timezone.utc)
+    return created_at.date()
+
+
+def _score_bucket(score: int) -> int:
+    """Map a 1-100 score onto buckets of 10 points (0-9)"""
+    return min(max((score - 1) // 10, 0), 9)
+
+
+def _bump(db: Session, model, keys: Dict[str, Any], **deltas: int) -> None:
+    """
+    Add deltas to the aggregate row identified by keys, creating it if needed.
+
+    Increments are issued as `col = col + delta` so concurrent writers never
+    lose updates. The row is flushed straight away so several bumps to the
+    same row in one transaction all land.
+    """
+    row = db.query(model).filter_by(**keys).first()
+    if row is None:
+        try:
+            with db.begin_nested():
+                row = model(**keys, **{column: 0 for column in deltas})
+                db.add(row)
+        except IntegrityError:
+            # Another transaction created the row first
+            row = db.query(model).filter_by(**keys).one()
+
+    for column, delta in deltas.items():
+        setattr(row, column, getattr(model, column) + delta)
+    db.flush()
+
+
+def record_new_lead(db: Session, conversation: Conversation) -> None:
+    """Count a newly created conversation under its initial status"""
+    _bump(
+        db,
+        LeadDailyStats,
+        {"pt_id": conversation.pt_id, "day": _day(conversation), "status": conversation.status},
+        lead_count=1,
+    )
+
+
+def record_status_change(db: Session, conversation: Conversation, status: str) -> None:
+    """
+    Set the conversation status and move it between aggregate buckets.
+
+    Use this instead of assigning `conversation.status` directly.
+    """
+    previous = conversation.status
+    if previous == status:
+        return
+
+    conversation.status = status
+    day = _day(conversation)
+    _bump(
+        db,
+        LeadDailyStats,
+        {"pt_id": conversation.pt_id, "day": day, "status": previous},
+        lead_count=-1,
+    )
+
+    deltas = {"lead_count": 1}
+    if status == "qualified":
+        created_at = conversation.created_at.replace(tzinfo=timezone.utc)
+        elapsed = datetime.now(timezone.utc) - created_at
+        deltas["time_to_qualify_seconds"] = max(int(elapsed.total_seconds()), 0)
+        deltas["time_to_qualify_samples"] = 1
+    _bump(
+        db,
+        LeadDailyStats,
+        {"pt_id": conversation.pt_id, "day": day, "status": status},
+        **deltas,
+    )
+
+
+def record_score(db: Session, conversation: Conversation, score: int) -> None:
+    """Add a qualification score to the score distribution"""
+    _bump(
+        db,
+        LeadScoreBucket,
+        {"pt_id": conversation.pt_id, "day": _day(conversation), "bucket": _score_bucket(score)},
+        lead_count=1,
+        score_sum=score,
+    )
+
+
+def forget_score(db: Session, conversation: Conversation, score: int) -> None:
+    """Remove a qualification score that is being replaced or deleted"""
+    _bump(
+        db,
+        LeadScoreBucket,
+        {"pt_id": conversation.pt_id, "day": _day(conversation), "bucket": _score_bucket(score)},
+        lead_count=-1,
+        score_sum=-score,
+    )
+
+
+def forget_lead(
+    db: Session, conversation: Conversation, lead_data: Optional[LeadData]
+) -> None:
+    """Remove a conversation that is about to be deleted from the aggregates"""
+    _bump(
+        db,
+        LeadDailyStats,
+        {"pt_id": conversation.pt_id, "day": _day(conversation), "status": conversation.status},
+        lead_count=-1,
+    )
+    if lead_data is not None and lead_data.qualification_score is not None:
+        forget_score(db, conversation, lead_data.qualification_score)
+
+
+def pt_summary(db: Session) -> list[dict]:
+    """
+    Per-PT totals for the admin dashboard, computed from the aggregate
+    tables only (never from the raw conversations or lead_data tables).
+    """
+    summary: Dict[int, dict] = defaultdict(
+        lambda: {
+            "leads": 0,
+            "by_status": defaultdict(int),
+            "time_to_qualify_seconds": 0,
+            "time_to_qualify_samples": 0,
+            "scored": 0,
+            "score_sum": 0,
+            "score_distribution": [0] * 10,
+            "leads_per_day": defaultdict(int),
+        }
+    )
+
+    status_rows = db.query(
+        LeadDailyStats.pt_id,
+        LeadDailyStats.day,
+        LeadDailyStats.status,
+        LeadDailyStats.lead_count,
+        LeadDailyStats.time_to_qualify_seconds,
+        LeadDailyStats.time_to_qualify_samples,
+    )
+    for pt_id, day, status, count, qualify_seconds, qualify_samples in status_rows:
+        entry = summary[pt_id]
+        entry["leads"] += count
+        entry["by_status"][status] += count
+        entry["leads_per_day"][day] += count
+        entry["time_to_qualify_seconds"] += qualify_seconds
+        entry["time_to_qualify_samples"] += qualify_samples
+
+    score_rows = db.query(
+        LeadScoreBucket.pt_id,
+        LeadScoreBucket.bucket,
+        func.sum(LeadScoreBucket.lead_count),
+        func.sum(LeadScoreBucket.score_sum),
+    ).group_by(LeadScoreBucket.pt_id, LeadScoreBucket.bucket)
+    for pt_id, bucket, count, score_sum in score_rows:
+        entry = summary[pt_id]
+        entry["scored"] += count or 0
+        entry["score_sum"] += score_sum or 0
+        entry["score_distribution"][bucket] = count or 0
+
+    results = []
+    for pt_id, entry in sorted(summary.items()):
+        qualified = entry["by_status"].get("qualified", 0)
+        decided = qualified + entry["by_status"].get("rejected", 0)
+        samples = entry["time_to_qualify_samples"]
+        results.append(
+            {
+                "pt_id": pt_id,
+                "leads": entry["leads"],
+                "by_status": dict(entry["by_status"]),
+                "qualification_rate": qualified / decided if decided else None,
+                "avg_time_to_qualify_hours": (
+                    entry["time_to_qualify_seconds"] / samples / 3600 if samples else None
+                ),
+                "avg_score": entry["score_sum"] / entry["scored"] if entry["scored"] else None,
+                "score_distribution": entry["score_distribution"],
+                "leads_per_day": sorted(entry["leads_per_day"].items(), reverse=True),
+            }
+        )
+    return results
+
+
+def rebuild_aggregates(db: Session, batch_size: int = 1000) -> int:
+    """
+    Rebuild all aggregates from the raw conversations and lead_data tables.
+
+    Rows are streamed in batches with a server-side cursor; only the
+    aggregate counters are held in memory. The old aggregates are replaced
+    in a single transaction so the dashboard never sees a partial rebuild.
+
+    Time-to-qualify is approximated by `updated_at - created_at`, as the
+    conversation stops receiving messages once it leaves the active status.
+
+    Returns:
+        Number of conversations processed
+    """
+    status_totals: Dict[tuple, Dict[str, int]] = defaultdict(
+        lambda: {"lead_count": 0, "time_to_qualify_seconds": 0, "time_to_qualify_samples": 0}
+    )
+    score_totals: Dict[tuple, Dict[str, int]] = defaultdict(
+        lambda: {"lead_count": 0, "score_sum": 0}
+    )
+
+    rows = (
+        db.query(
+            Conversation.pt_id,
+            Conversation.status,
+            Conversation.created_at,
+            Conversation.updated_at,
+            LeadData.qualification_score,
+        )
+        .outerjoin(LeadData, LeadData.conversation_id == Conversation.id)
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+
+    processed = 0
+    for pt_id, status, created_at, updated_at, score in rows:
+        day = (created_at or datetime.now(timezone.utc)).date()
+        totals = status_totals[(pt_id, day, status)]
+        totals["lead_count"] += 1
+        if status == "qualified" and created_at and updated_at:
+            totals["time_to_qualify_seconds"] += max(
+                int((updated_at - created_at).total_seconds()), 0
+            )
+            totals["time_to_qualify_samples"] += 1
+        if score is not None:
+            bucket = score_totals[(pt_id, day, _score_bucket(score))]
+            bucket["lead_count"] += 1
+            bucket["score_sum"] += score
+
+        processed += 1
+        if processed % batch_size == 0:
+            logger.info(f"Aggregated {processed} conversations")
+
+    db.query(LeadDailyStats).delete()
+    db.query(LeadScoreBucket).delete()
+    db.add_all(
+        LeadDailyStats(pt_id=pt_id, day=day, status=status, **totals)
+        for (pt_id, day, status), totals in status_totals.items()
+    )
+    db.add_all(
+        LeadScoreBucket(pt_id=pt_id, day=day, bucket=bucket, **totals)
+        for (pt_id, day, bucket), totals in score_totals.items()
+    )
+    db.commit()
+
+    logger.info(f"Rebuilt lead aggregates from {processed} conversations")
+    return processed
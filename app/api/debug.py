@@ -0,0 +1,125 @@
+"""
+Admin-only profiling endpoints (CPU sampling and memory snapshots)
+
+Each endpoint acts on the process that serves the request and, with
+WORKER_PROCESSES set, on every pool worker too (sent as a command on their
+job queues). Worker results are under `workers`, by shard; every result
+carries its `pid`, which is also part of each profile's file name.
+"""
+
+import asyncio
+import logging
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query
+
+from app.config import get_settings
+from app.profiling import ProfilerBusy, memory_profiler, profiler
+from app.workers import worker_pool
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+def _check_token(authorization: Optional[str]) -> None:
+    """Profiles expose code paths and memory contents: require the admin token"""
+    token = get_settings().admin_api_token
+    if not token:
+        raise HTTPException(status_code=404, detail="Debug API is disabled")
+    if not authorization or not secrets.compare_digest(
+        authorization, f"Bearer {token}"
+    ):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+def _workers(command: str, timeout: float = 10.0, **args) -> dict:
+    """Run a profiling command on the pool workers; replies by shard"""
+    if not worker_pool.running:
+        return {}
+    replies = worker_pool.call(command, args, timeout=timeout)
+    return {str(shard): reply for shard, reply in sorted(replies.items())}
+
+
+@router.get("/profile/cpu")
+def cpu_profile_status(authorization: Optional[str] = Header(None)):
+    """Whether a CPU profile is running, and the summary of the last one"""
+    _check_token(authorization)
+    workers = _workers("profile_status")
+    return {
+        **profiler.status(),
+        "workers": {shard: reply.get("cpu", reply) for shard, reply in workers.items()},
+    }
+
+
+@router.post("/profile/cpu")
+def start_cpu_profile(
+    seconds: float = Query(30.0, gt=0, description="Stop after this long"),
+    interval_ms: float = Query(10.0, ge=1, description="Sampling interval"),
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Sample every thread's stack for `seconds`, then write folded stacks.
+
+    Poll GET /debug/profile/cpu for the file and top functions, or stop it
+    early with POST /debug/profile/cpu/stop.
+    """
+    _check_token(authorization)
+    max_seconds = get_settings().profiling_max_seconds
+    if seconds > max_seconds:
+        raise HTTPException(status_code=400, detail=f"seconds must be at most {max_seconds}")
+    try:
+        status = profiler.start(seconds=seconds, interval=interval_ms / 1000)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    workers = _workers("profile_cpu_start", seconds=seconds, interval=interval_ms / 1000)
+    return {**status, "workers": workers}
+
+
+@router.post("/profile/cpu/stop")
+def stop_cpu_profile(authorization: Optional[str] = Header(None)):
+    """Stop the running CPU profile and return its summary"""
+    _check_token(authorization)
+    summary = profiler.stop()
+    workers = _workers("profile_cpu_stop")
+    if summary is None and not any("error" not in reply for reply in workers.values()):
+        raise HTTPException(status_code=404, detail="No CPU profile has run")
+    return {**(summary or {}), "workers": workers}
+
+
+@router.get("/profile/memory")
+def memory_profile_status(authorization: Optional[str] = Header(None)):
+    _check_token(authorization)
+    workers = _workers("profile_status")
+    return {
+        **memory_profiler.status(),
+        "workers": {shard: reply.get("memory", reply) for shard, reply in workers.items()},
+    }
+
+
+@router.post("/profile/memory")
+async def take_memory_snapshot(authorization: Optional[str] = Header(None)):
+    """
+    Take an allocation snapshot (starting tracemalloc on the first call).
+
+    From the second call on, the response lists where memory grew since the
+    previous snapshot and a diff file is written alongside.
+    """
+    _check_token(authorization)
+    # Snapshots of a large heap take a while; don't block the event loop
+    snapshot = await asyncio.to_thread(memory_profiler.snapshot)
+    workers = await asyncio.to_thread(_workers, "profile_memory_snapshot", 60.0)
+    return {**snapshot, "workers": workers}
+
+
+@router.delete("/profile/memory")
+def stop_memory_profiling(authorization: Optional[str] = Header(None)):
+    """Stop tracemalloc, which slows every allocation while it runs"""
+    _check_token(authorization)
+    memory_profiler.stop()
+    workers = _workers("profile_memory_stop")
+    return {
+        **memory_profiler.status(),
+        "workers": {shard: reply.get("memory", reply) for shard, reply in workers.items()},
+    }
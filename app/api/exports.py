@@ -0,0 +1,62 @@
+"""Streaming NDJSON export endpoints for CRM and data warehouse sync"""
+
+import logging
+import secrets
+from typing import Optional
+
+from fastapi import APIRouter, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+
+from app.config import get_settings
+from app.database import ReadSessionLocal
+from app.exports import EXPORT_ENTITIES, ExportCursorError, iter_ndjson
+from app.exports.ndjson import decode_cursor
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter()
+
+
+def _check_token(authorization: Optional[str]) -> None:
+    """Exports contain lead PII: require the configured bearer token"""
+    token = get_settings().export_api_token
+    if not token:
+        raise HTTPException(status_code=404, detail="Export API is disabled")
+    if not authorization or not secrets.compare_digest(
+        authorization, f"Bearer {token}"
+    ):
+        raise HTTPException(status_code=401, detail="Invalid export token")
+
+
+@router.get("/{entity}.ndjson")
+def export_entity(
+    entity: str,
+    after: Optional[str] = Query(None, description="_cursor of the last synced row"),
+    limit: Optional[int] = Query(None, ge=1, description="Maximum rows to return"),
+    batch_size: int = Query(1000, ge=1, le=10000),
+    authorization: Optional[str] = Header(None),
+):
+    """
+    Stream conversations, messages, leads or deletions as NDJSON, oldest
+    change first.
+
+    Each line has a `_cursor`; pass the last one back as `after` to fetch
+    only rows created or updated (or, for deletions, deleted) since.
+    """
+    _check_token(authorization)
+    if entity not in EXPORT_ENTITIES:
+        raise HTTPException(status_code=404, detail=f"Unknown export entity: {entity}")
+    if after:
+        try:
+            decode_cursor(after)
+        except ExportCursorError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    def stream():
+        db = ReadSessionLocal()
+        try:
+            yield from iter_ndjson(db, entity, after, limit, batch_size)
+        finally:
+            db.close()
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
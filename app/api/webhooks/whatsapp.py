@@ -1,17 +1,25 @@
 """WhatsApp webhook endpoint for receiving messages from Twilio"""
 
 import logging
+import time
 from datetime import datetime, timezone
 
 from fastapi import APIRouter, BackgroundTasks, Depends, Request
 from fastapi.responses import Response
 from sqlalchemy.orm import Session
 
+from app.analytics import forget_lead, record_new_lead, record_status_change
 from app.database import get_db
-from app.models import Conversation, LeadData, Message, PTPreferences
+from app.exports import record_deletions
+from app.metrics import webhook_ack_seconds
+from app.models import Conversation, LeadData, Message
 from app.prompts.manager import PromptManager
-from app.services import whatsapp_service
+from app.pt_cache import pt_cache
+from app.services import outbox_service
 from app.tasks import process_message
+from app.tenants import tenant_router
+from app.tracing import tracer
+from app.workers import worker_pool
 
 logger = logging.getLogger(__name__)
 
@@ -33,6 +41,10 @@ async def whatsapp_webhook(
         background_tasks: Background tasks
         db: Database session
     """
+    received_at = time.time()
+    started = time.perf_counter()
+    # Root of the message's trace, if it is sampled
+    span = tracer.start_span("whatsapp_webhook", root=True)
     try:
         # Get form data from request
         form_data = await request.form()
@@ -42,6 +54,7 @@ async def whatsapp_webhook(
 
         # Extract required fields
         from_number = form_data.get("From", "")
+        to_number = form_data.get("To", "")
         body = form_data.get("Body", "")
         message_sid = form_data.get("MessageSid", "")
 
@@ -56,18 +69,37 @@ async def whatsapp_webhook(
         # Extract phone number (remove whatsapp: prefix)
         phone = from_number.replace("whatsapp:", "")  # type: ignore
 
-        logger.info(f"Received WhatsApp message from {phone}: {body[:50]}...")
+        # Route to the PT that owns the number the lead messaged
+        pt_id = tenant_router.pt_for_number(to_number)  # type: ignore
+
+        logger.info(f"Received WhatsApp message from {phone} for PT {pt_id}: {body[:50]}...")
 
         # Check for clear_chat command
         if body.strip().lower() == "clear_chat":  # type: ignore
             # Get the most recent active conversation
             conversation = (
                 db.query(Conversation)
-                .filter_by(phone_number=phone, status="active")
+                .filter_by(phone_number=phone, pt_id=pt_id, status="active")
                 .order_by(Conversation.created_at.desc())
                 .first()
             )
             if conversation:
+                # Remove it from the analytics aggregates
+                lead_data = (
+                    db.query(LeadData).filter_by(conversation_id=conversation.id).first()
+                )
+                forget_lead(db, conversation, lead_data)
+                # Tombstones, so incremental exports pass the deletion on
+                message_ids = [
+                    message_id
+                    for (message_id,) in db.query(Message.id).filter_by(
+                        conversation_id=conversation.id
+                    )
+                ]
+                record_deletions(db, "messages", message_ids)
+                if lead_data is not None:
+                    record_deletions(db, "leads", [lead_data.id])
+                record_deletions(db, "conversations", [conversation.id])
                 # Delete all messages for this conversation
                 db.query(Message).filter_by(conversation_id=conversation.id).delete()
                 # Delete lead data
@@ -89,11 +121,11 @@ async def whatsapp_webhook(
             # Archive all active conversations for this number
             active_conversations = (
                 db.query(Conversation)
-                .filter_by(phone_number=phone, status="active")
+                .filter_by(phone_number=phone, pt_id=pt_id, status="active")
                 .all()
             )
             for conv in active_conversations:
-                conv.status = "archived"
+                record_status_change(db, conv, "archived")
                 logger.info(f"Archived conversation {conv.id} for {phone}")
             db.commit()
 
@@ -105,7 +137,7 @@ async def whatsapp_webhook(
         # Get or create active conversation (most recent active one)
         conversation = (
             db.query(Conversation)
-            .filter_by(phone_number=phone, status="active")
+            .filter_by(phone_number=phone, pt_id=pt_id, status="active")
             .order_by(Conversation.created_at.desc())
             .first()
         )
@@ -115,11 +147,12 @@ async def whatsapp_webhook(
             conversation = Conversation(
                 phone_number=phone,
                 status="active",
-                pt_id=1,  # Default PT
+                pt_id=pt_id,
                 created_at=datetime.now(timezone.utc),
                 updated_at=datetime.now(timezone.utc),
             )
             db.add(conversation)
+            record_new_lead(db, conversation)
             db.commit()
             db.refresh(conversation)
 
@@ -131,13 +164,19 @@ async def whatsapp_webhook(
             logger.info(f"Created new conversation {conversation.id} for {phone}")
 
             # Send intro message for new conversation
-            pt = db.query(PTPreferences).filter_by(id=conversation.pt_id).first()
+            pt = pt_cache.get(conversation.pt_id)
             if pt:
                 prompt_manager = PromptManager(pt)
                 intro_message = prompt_manager.get_intro_message()
 
                 # Send intro message via WhatsApp
-                whatsapp_service.send_message(phone, intro_message)
+                outbox_service.enqueue(
+                    phone,
+                    intro_message,
+                    conversation_id=conversation.id,
+                    from_number=tenant_router.sender_for(pt_id),
+                    received_at=received_at,
+                )
 
                 # Save intro message to conversation
                 intro_msg = Message(
@@ -157,14 +196,27 @@ async def whatsapp_webhook(
 <Response></Response>"""
             return Response(content=twiml_response, media_type="application/xml")
 
-        # Add background task to process message
-        background_tasks.add_task(
-            process_message,
-            conversation_id=conversation.id,  # type: ignore
-            phone=phone,
-            user_message=body,  # type: ignore
-            message_sid=message_sid,  # type: ignore
-        )
+        # Hand the message to its worker shard, or process it in a background task
+        span.set_attribute("conversation_id", conversation.id)
+        if worker_pool.running:
+            worker_pool.submit(
+                conversation.id,  # type: ignore
+                phone,
+                body,  # type: ignore
+                message_sid,  # type: ignore
+                traceparent=span.traceparent,
+                received_at=received_at,
+            )
+        else:
+            background_tasks.add_task(
+                process_message,
+                conversation_id=conversation.id,  # type: ignore
+                phone=phone,
+                user_message=body,  # type: ignore
+                message_sid=message_sid,  # type: ignore
+                received_at=received_at,
+                traceparent=span.traceparent,
+            )
 
         # Return empty TwiML response immediately (within 1 second)
         twiml_response = """<?xml version='1.0' encoding='UTF-8'?>
@@ -174,7 +226,15 @@ async def whatsapp_webhook(
 
     except Exception as e:
         logger.error(f"Error in WhatsApp webhook: {e}")
+        span.record_exception(e)
         # Still return 200 to Twilio to prevent retries
         twiml_response = """<?xml version='1.0' encoding='UTF-8'?>
 <Response></Response>"""
         return Response(content=twiml_response, media_type="application/xml")
+
+    finally:
+        # Give the connection back now: get_db only closes the session after
+        # the response is sent and background processing has run
+        db.close()
+        webhook_ack_seconds.observe(time.perf_counter() - started)
+        span.end()
@@ -8,6 +8,12 @@ from app.config.pt_defaults import PTDefaults
 
 load_dotenv()
 
+# Sent instead of an LLM reply when the LLM limit sheds a message
+DEFAULT_DEGRADED_REPLY = (
+    "Thanks for your message! I'm getting a lot of messages right now. "
+    "Give me a few minutes and reply again, and I'll pick up right where we left off."
+)
+
 
 class Settings(BaseModel):
     # FastAPI
@@ -17,6 +23,9 @@ class Settings(BaseModel):
 
     # Database
     database_url: str = "sqlite:///./pt_chatbot.db"
+    # Admin/analytics/export reads; empty = read-only SQLite connection
+    database_read_url: str = ""
+    database_read_pool_size: int = 5
 
     # Anthropic
     anthropic_api_key: str = ""
@@ -26,13 +35,107 @@ class Settings(BaseModel):
     twilio_auth_token: str = ""
     twilio_whatsapp_number: str = ""
 
+    # Outbound message scheduler (rates in messages per second)
+    outbox_sender_rate: float = 10.0
+    outbox_sender_burst: int = 20
+    outbox_recipient_rate: float = 0.5
+    outbox_recipient_burst: int = 3
+    outbox_max_in_flight: int = 8
+    outbox_max_attempts: int = 8
+    outbox_retry_base_seconds: float = 2.0
+    outbox_retry_max_seconds: float = 300.0
+    outbox_poll_seconds: float = 1.0
+    outbox_claim_timeout_seconds: int = 60
+
     # Google Calendar (optional)
     google_calendar_credentials_path: str = "./google_credentials.json"
     google_calendar_id: str = "primary"
 
+    # Calendar availability
+    calendar_backend: str = "database"  # database, memory
+    calendar_work_start_hour: int = 9
+    calendar_work_end_hour: int = 17
+    calendar_slot_minutes: int = 60
+    calendar_working_days: str = "0,1,2,3,4"  # Monday=0
+    calendar_hold_minutes: int = 15
+    calendar_min_notice_hours: int = 24
+    calendar_provider: str = "local"  # local, or empty for none
+    calendar_freebusy_ttl_seconds: int = 300
+    calendar_write_batch_size: int = 20
+    calendar_write_flush_seconds: float = 5.0
+
     # Email (optional)
     sendgrid_api_key: str = ""
     rejection_email_from: str = "noreply@demo.com"
+    email_transport: str = "log"  # log, smtp, sendgrid
+    email_smtp_host: str = "localhost"
+    email_smtp_port: int = 1025
+    email_smtp_username: str = ""
+    email_smtp_password: str = ""
+    email_smtp_starttls: bool = False
+    email_concurrency: int = 4  # Workers, each with one connection
+    email_batch_size: int = 50
+    email_queue_size: int = 10000
+    email_claim_timeout_seconds: int = 600
+
+    # Exports (NDJSON API is disabled while empty)
+    export_api_token: str = ""
+    # Rows changed this recently are held back until they can no longer be
+    # overtaken by a slower transaction with an earlier watermark
+    export_safety_window_seconds: float = 30.0
+
+    # Multi-PT routing: PT for messages to numbers no PT claims
+    default_pt_id: int = 1
+    # PT preferences cache: how often each process checks for PT edits
+    pt_cache_poll_seconds: float = 5.0
+
+    # Per-conversation leases: one worker at a time processes a conversation
+    conversation_lease_ttl_seconds: float = 60.0
+    conversation_lease_wait_seconds: float = 120.0
+
+    # Sharded worker processes (0 = process messages in the web process)
+    worker_processes: int = 0
+    worker_concurrency: int = 8
+
+    # LLM concurrency limit (per process) and load shedding
+    llm_max_concurrency: int = 16
+    llm_max_queue: int = 200
+    llm_queue_timeout_seconds: float = 10.0
+    llm_degraded_reply: str = DEFAULT_DEGRADED_REPLY
+
+    # Hedged LLM calls (a second request for calls past a latency percentile)
+    llm_hedging_enabled: bool = False
+    llm_hedge_percentile: float = 95.0
+    llm_hedge_budget: float = 0.05
+    llm_hedge_min_samples: int = 20
+
+    # Webhook rate limits (sliding windows; Redis shares them between processes)
+    rate_limit_enabled: bool = True
+    rate_limit_phone_max: int = 10
+    rate_limit_phone_window_seconds: float = 60.0
+    rate_limit_global_max: int = 3000
+    rate_limit_global_window_seconds: float = 60.0
+    rate_limit_redis_url: str = ""
+
+    # Tracing (sampled spans to a JSONL file and/or an OTLP/HTTP collector)
+    tracing_enabled: bool = False
+    tracing_sample_rate: float = 0.05
+    tracing_file: str = "traces.jsonl"
+    tracing_otlp_endpoint: str = ""
+    tracing_service_name: str = "pt-lead-chatbot"
+
+    # Admin debug endpoints (/debug/profile; disabled while the token is empty)
+    admin_api_token: str = ""
+    profiling_dir: str = "profiles"
+    profiling_max_seconds: float = 300.0
+
+    # Circuit breakers (LLM, Twilio, calendar)
+    breaker_window_seconds: float = 60.0
+    breaker_min_calls: int = 10
+    breaker_failure_rate: float = 0.5
+    breaker_slow_call_rate: float = 0.8
+    breaker_open_seconds: float = 30.0
+    breaker_half_open_probes: int = 2
 
     # PT Configuration (defaults from pt_defaults.py)
     pt_name: str = PTDefaults.NAME
@@ -62,20 +165,97 @@ def get_settings() -> Settings:
         port=int(os.getenv("PORT", "8000")),
         # Database
         database_url=os.getenv("DATABASE_URL", "sqlite:///./pt_chatbot.db"),
+        database_read_url=os.getenv("DATABASE_READ_URL", ""),
+        database_read_pool_size=int(os.getenv("DATABASE_READ_POOL_SIZE", "5")),
         # Anthropic
         anthropic_api_key=os.getenv("ANTHROPIC_API_KEY", ""),
         # Twilio
         twilio_account_sid=os.getenv("TWILIO_ACCOUNT_SID", ""),
         twilio_auth_token=os.getenv("TWILIO_AUTH_TOKEN", ""),
         twilio_whatsapp_number=os.getenv("TWILIO_WHATSAPP_NUMBER", ""),
+        # Outbound message scheduler
+        outbox_sender_rate=float(os.getenv("OUTBOX_SENDER_RATE", "10")),
+        outbox_sender_burst=int(os.getenv("OUTBOX_SENDER_BURST", "20")),
+        outbox_recipient_rate=float(os.getenv("OUTBOX_RECIPIENT_RATE", "0.5")),
+        outbox_recipient_burst=int(os.getenv("OUTBOX_RECIPIENT_BURST", "3")),
+        outbox_max_in_flight=int(os.getenv("OUTBOX_MAX_IN_FLIGHT", "8")),
+        outbox_max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8")),
+        outbox_retry_base_seconds=float(os.getenv("OUTBOX_RETRY_BASE_SECONDS", "2")),
+        outbox_retry_max_seconds=float(os.getenv("OUTBOX_RETRY_MAX_SECONDS", "300")),
+        outbox_poll_seconds=float(os.getenv("OUTBOX_POLL_SECONDS", "1")),
+        outbox_claim_timeout_seconds=int(os.getenv("OUTBOX_CLAIM_TIMEOUT_SECONDS", "60")),
         # Google Calendar
         google_calendar_credentials_path=os.getenv(
             "GOOGLE_CALENDAR_CREDENTIALS_PATH", "./google_credentials.json"
         ),
         google_calendar_id=os.getenv("GOOGLE_CALENDAR_ID", "primary"),
+        # Calendar availability
+        calendar_backend=os.getenv("CALENDAR_BACKEND", "database"),
+        calendar_work_start_hour=int(os.getenv("CALENDAR_WORK_START_HOUR", "9")),
+        calendar_work_end_hour=int(os.getenv("CALENDAR_WORK_END_HOUR", "17")),
+        calendar_slot_minutes=int(os.getenv("CALENDAR_SLOT_MINUTES", "60")),
+        calendar_working_days=os.getenv("CALENDAR_WORKING_DAYS", "0,1,2,3,4"),
+        calendar_hold_minutes=int(os.getenv("CALENDAR_HOLD_MINUTES", "15")),
+        calendar_min_notice_hours=int(os.getenv("CALENDAR_MIN_NOTICE_HOURS", "24")),
+        calendar_provider=os.getenv("CALENDAR_PROVIDER", "local"),
+        calendar_freebusy_ttl_seconds=int(os.getenv("CALENDAR_FREEBUSY_TTL_SECONDS", "300")),
+        calendar_write_batch_size=int(os.getenv("CALENDAR_WRITE_BATCH_SIZE", "20")),
+        calendar_write_flush_seconds=float(os.getenv("CALENDAR_WRITE_FLUSH_SECONDS", "5")),
         # Email
         sendgrid_api_key=os.getenv("SENDGRID_API_KEY", ""),
         rejection_email_from=os.getenv("REJECTION_EMAIL_FROM", "noreply@demo.com"),
+        email_transport=os.getenv("EMAIL_TRANSPORT", "log"),
+        email_smtp_host=os.getenv("EMAIL_SMTP_HOST", "localhost"),
+        email_smtp_port=int(os.getenv("EMAIL_SMTP_PORT", "1025")),
+        email_smtp_username=os.getenv("EMAIL_SMTP_USERNAME", ""),
+        email_smtp_password=os.getenv("EMAIL_SMTP_PASSWORD", ""),
+        email_smtp_starttls=os.getenv("EMAIL_SMTP_STARTTLS", "False").lower() == "true",
+        email_concurrency=int(os.getenv("EMAIL_CONCURRENCY", "4")),
+        email_batch_size=int(os.getenv("EMAIL_BATCH_SIZE", "50")),
+        email_queue_size=int(os.getenv("EMAIL_QUEUE_SIZE", "10000")),
+        email_claim_timeout_seconds=int(os.getenv("EMAIL_CLAIM_TIMEOUT_SECONDS", "600")),
+        # Exports
+        export_api_token=os.getenv("EXPORT_API_TOKEN", ""),
+        export_safety_window_seconds=float(os.getenv("EXPORT_SAFETY_WINDOW_SECONDS", "30")),
+        # Multi-PT routing
+        default_pt_id=int(os.getenv("DEFAULT_PT_ID", "1")),
+        pt_cache_poll_seconds=float(os.getenv("PT_CACHE_POLL_SECONDS", "5")),
+        # Conversation leases
+        conversation_lease_ttl_seconds=float(os.getenv("CONVERSATION_LEASE_TTL_SECONDS", "60")),
+        conversation_lease_wait_seconds=float(os.getenv("CONVERSATION_LEASE_WAIT_SECONDS", "120")),
+        # Worker processes
+        worker_processes=int(os.getenv("WORKER_PROCESSES", "0")),
+        worker_concurrency=int(os.getenv("WORKER_CONCURRENCY", "8")),
+        # LLM limits
+        llm_max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+        llm_max_queue=int(os.getenv("LLM_MAX_QUEUE", "200")),
+        llm_queue_timeout_seconds=float(os.getenv("LLM_QUEUE_TIMEOUT_SECONDS", "10")),
+        llm_degraded_reply=os.getenv("LLM_DEGRADED_REPLY", DEFAULT_DEGRADED_REPLY),
+        llm_hedging_enabled=os.getenv("LLM_HEDGING_ENABLED", "False").lower() == "true",
+        llm_hedge_percentile=float(os.getenv("LLM_HEDGE_PERCENTILE", "95")),
+        llm_hedge_budget=float(os.getenv("LLM_HEDGE_BUDGET", "0.05")),
+        llm_hedge_min_samples=int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20")),
+        rate_limit_enabled=os.getenv("RATE_LIMIT_ENABLED", "True").lower() == "true",
+        rate_limit_phone_max=int(os.getenv("RATE_LIMIT_PHONE_MAX", "10")),
+        rate_limit_phone_window_seconds=float(os.getenv("RATE_LIMIT_PHONE_WINDOW_SECONDS", "60")),
+        rate_limit_global_max=int(os.getenv("RATE_LIMIT_GLOBAL_MAX", "3000")),
+        rate_limit_global_window_seconds=float(os.getenv("RATE_LIMIT_GLOBAL_WINDOW_SECONDS", "60")),
+        rate_limit_redis_url=os.getenv("RATE_LIMIT_REDIS_URL", ""),
+        tracing_enabled=os.getenv("TRACING_ENABLED", "False").lower() == "true",
+        tracing_sample_rate=float(os.getenv("TRACING_SAMPLE_RATE", "0.05")),
+        tracing_file=os.getenv("TRACING_FILE", "traces.jsonl"),
+        tracing_otlp_endpoint=os.getenv("TRACING_OTLP_ENDPOINT", ""),
+        tracing_service_name=os.getenv("TRACING_SERVICE_NAME", "pt-lead-chatbot"),
+        admin_api_token=os.getenv("ADMIN_API_TOKEN", ""),
+        profiling_dir=os.getenv("PROFILING_DIR", "profiles"),
+        profiling_max_seconds=float(os.getenv("PROFILING_MAX_SECONDS", "300")),
+        # Circuit breakers
+        breaker_window_seconds=float(os.getenv("BREAKER_WINDOW_SECONDS", "60")),
+        breaker_min_calls=int(os.getenv("BREAKER_MIN_CALLS", "10")),
+        breaker_failure_rate=float(os.getenv("BREAKER_FAILURE_RATE", "0.5")),
+        breaker_slow_call_rate=float(os.getenv("BREAKER_SLOW_CALL_RATE", "0.8")),
+        breaker_open_seconds=float(os.getenv("BREAKER_OPEN_SECONDS", "30")),
+        breaker_half_open_probes=int(os.getenv("BREAKER_HALF_OPEN_PROBES", "2")),
         # PT Configuration (env vars override pt_defaults.py)
         pt_name=os.getenv("PT_NAME", PTDefaults.NAME),
         pt_specialty=os.getenv("PT_SPECIALTY", PTDefaults.SPECIALTY),
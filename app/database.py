@@ -1,26 +1,189 @@
-from sqlalchemy import create_engine
+import logging
+import time
+from typing import Any, Dict
+
+from sqlalchemy import create_engine, event, inspect
+from sqlalchemy.engine import Engine, make_url
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql import Delete, Insert, Update
 
 from app.config import get_settings
+from app.metrics import add_db_time
+from app.search import install_search_indexes
+from app.tracing import tracer
+
+logger = logging.getLogger(__name__)
 
 settings = get_settings()
 
-# Create engine
+
+def _connect_args(url: str) -> dict:
+    return {"check_same_thread": False} if "sqlite" in url else {}
+
+
+def _create_read_engine() -> Engine:
+    """
+    Engine for admin, analytics and export reads.
+
+    Uses DATABASE_READ_URL (e.g. a Postgres replica) when set. Otherwise a
+    file-based SQLite database is opened a second time in read-only mode
+    with its own pool; any other database falls back to the primary engine.
+    """
+    if settings.database_read_url:
+        read_engine = create_engine(
+            settings.database_read_url,
+            connect_args=_connect_args(settings.database_read_url),
+            pool_size=settings.database_read_pool_size,
+        )
+        if read_engine.dialect.name == "postgresql":
+            read_engine = read_engine.execution_options(postgresql_readonly=True)
+        return read_engine
+
+    url = make_url(settings.database_url)
+    if url.get_backend_name() == "sqlite" and url.database not in (None, "", ":memory:"):
+        read_only_url = url.set(
+            database=f"file:{url.database}", query={"mode": "ro", "uri": "true"}
+        )
+        return create_engine(
+            read_only_url,
+            connect_args={"check_same_thread": False},
+            pool_size=settings.database_read_pool_size,
+        )
+
+    return engine
+
+
+# Create engines: primary for writes and the webhook/message hot path,
+# read for admin browsing, analytics and exports
 engine = create_engine(
     settings.database_url,
-    connect_args=(
-        {"check_same_thread": False} if "sqlite" in settings.database_url else {}
-    ),
+    connect_args=_connect_args(settings.database_url),
 )
+read_engine = _create_read_engine()
+
+engines: Dict[str, Engine] = {"primary": engine, "read": read_engine}
+
+
+class RoutingSession(Session):
+    """
+    Session that reads from the read engine and writes to the primary.
+
+    Once a session has flushed, it stays on the primary so it reads its
+    own writes.
+    """
+
+    _wrote = False
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            self._wrote = True
+        if self._wrote:
+            return engine
+        return read_engine
+
 
 # Create SessionLocal class
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Read-only sessions (analytics, exports)
+ReadSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=read_engine)
+
+# Admin sessions: reads on the read engine, edits on the primary
+AdminSessionLocal = sessionmaker(class_=RoutingSession, autocommit=False, autoflush=False)
+
 # Create Base class
 Base = declarative_base()
 
 
+# Per-route pool metrics
+
+
+class _PoolCounters:
+    def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+
+
+_pool_counters: Dict[str, _PoolCounters] = {}
+
+
+def _instrument_pool(route: str, route_engine: Engine) -> None:
+    counters = _PoolCounters()
+    _pool_counters[route] = counters
+
+    @event.listens_for(route_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        counters.connects += 1
+
+    @event.listens_for(route_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        counters.checkouts += 1
+
+    @event.listens_for(route_engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        counters.checkins += 1
+
+    @event.listens_for(route_engine, "invalidate")
+    def _on_invalidate(dbapi_connection, connection_record, exception):
+        counters.invalidations += 1
+
+
+_instrument_pool("primary", engine)
+if read_engine is not engine:
+    _instrument_pool("read", read_engine)
+
+
+# Statement time on the primary, for the per-turn database time metric and
+# for a span per statement in traced messages
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _before_execute(conn, cursor, statement, parameters, context, executemany):
+    context._started = time.perf_counter()
+    context._span = tracer.statement_span(statement)
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _after_execute(conn, cursor, statement, parameters, context, executemany):
+    add_db_time(time.perf_counter() - context._started)
+    if context._span is not None:
+        context._span.end()
+
+
+@event.listens_for(engine, "handle_error")
+def _on_error(exception_context):
+    span = getattr(exception_context.execution_context, "_span", None)
+    if span is not None:
+        span.record_exception(exception_context.original_exception)
+        span.end()
+
+
+def pool_metrics() -> Dict[str, Dict[str, Any]]:
+    """Connection pool usage for each engine route"""
+    metrics = {}
+    for route, route_engine in engines.items():
+        pool = route_engine.pool
+        counters = _pool_counters.get(route) or _pool_counters["primary"]
+        metrics[route] = {
+            "url": route_engine.url.render_as_string(hide_password=True),
+            "shared_with_primary": route != "primary" and route_engine is engine,
+            "pool": type(pool).__name__,
+            "size": pool.size() if hasattr(pool, "size") else None,
+            "checked_out": pool.checkedout() if hasattr(pool, "checkedout") else None,
+            "checked_in": pool.checkedin() if hasattr(pool, "checkedin") else None,
+            "overflow": pool.overflow() if hasattr(pool, "overflow") else None,
+            "connects": counters.connects,
+            "checkouts": counters.checkouts,
+            "checkins": counters.checkins,
+            "invalidations": counters.invalidations,
+        }
+    return metrics
+
+
 def get_db():
     """Dependency for FastAPI to get database session"""
     db = SessionLocal()
@@ -30,6 +193,41 @@ def get_db():
         db.close()
 
 
+def get_read_db():
+    """Dependency for FastAPI to get a read-only database session"""
+    db = ReadSessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def _add_missing_columns():
+    """
+    create_all never alters existing tables; add nullable columns declared
+    after a table was created so older databases keep working
+    """
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            existing = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                ddl = CreateColumn(column).compile(dialect=engine.dialect)
+                conn.exec_driver_sql(f"ALTER TABLE {table.name} ADD COLUMN {ddl}")
+                logger.info(f"Added column {table.name}.{column.name}")
+
+
 def init_db():
-    """Initialize database tables"""
+    """Initialize database tables, indexes and full-text search indexes"""
     Base.metadata.create_all(bind=engine)
+    _add_missing_columns()
+
+    # create_all only builds indexes together with new tables; add any
+    # index declared later on a table that already existed
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+
+    install_search_indexes(engine)
@@ -0,0 +1,5 @@
+"""Bulk exports of conversations, messages and leads for CRM/warehouse sync"""
+
+from app.exports.ndjson import EXPORT_ENTITIES, ExportCursorError, iter_ndjson, record_deletions
+
+__all__ = ["EXPORT_ENTITIES", "ExportCursorError", "iter_ndjson", "record_deletions"]
@@ -0,0 +1,283 @@
+"""
+Columnar (Parquet) snapshots of lead data for offline analysis.
+
+Writes four Hive-partitioned datasets under the output directory:
+
+    conversations/pt_id=<id>/month=<YYYY-MM>/part-<run>-<n>.parquet
+    leads/...
+    message_stats/...
+    deletions/month=<YYYY-MM>/part-<run>-<n>.parquet
+
+Source rows are streamed with the same server-side cursors as the NDJSON
+export and written in chunks, so memory is bounded by the chunk size.
+Incremental runs append only rows changed since the previous run, up to
+the same EXPORT_SAFETY_WINDOW_SECONDS cutoff as the NDJSON export; updated
+rows appear again with a later `updated_at`, so readers should keep the
+latest version of each `id`. Deleted rows (e.g. by clear_chat) are
+appended to `deletions` as (entity, record_id) tombstones: readers drop
+conversations, leads and message_stats (by conversation_id) they name.
+
+pyarrow is an optional dependency, imported on first use.
+"""
+
+import json
+import logging
+from collections import defaultdict
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import case, func, select, tuple_
+from sqlalchemy.orm import Session
+
+from app.exports.ndjson import decode_cursor, encode_cursor, iter_rows, settled_before
+from app.models import Conversation, Message
+
+logger = logging.getLogger(__name__)
+
+STATE_FILE = "_snapshot_state.json"
+
+PartitionKey = Tuple[int, str]  # (pt_id, "YYYY-MM")
+
+
+def _pyarrow():
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError(
+            "Parquet snapshots need pyarrow: pip install pyarrow"
+        ) from e
+    return pa, pq
+
+
+def _schemas(pa) -> Dict[str, "pa.Schema"]:
+    """File schemas; pt_id and month live in the partition directories"""
+    ts = pa.timestamp("us")
+    return {
+        "conversations": pa.schema(
+            [
+                ("id", pa.int64()),
+                ("phone_number", pa.string()),
+                ("status", pa.string()),
+                ("created_at", ts),
+                ("updated_at", ts),
+            ]
+        ),
+        "leads": pa.schema(
+            [
+                ("id", pa.int64()),
+                ("conversation_id", pa.int64()),
+                ("goals", pa.string()),
+                ("age", pa.int64()),
+                ("location", pa.string()),
+                ("budget_range", pa.string()),
+                ("commitment_level", pa.int64()),
+                ("availability", pa.string()),
+                ("qualification_score", pa.int64()),
+                ("is_qualified", pa.bool_()),
+                ("reasoning", pa.string()),
+                ("phone_number", pa.string()),
+                ("status", pa.string()),
+                ("created_at", ts),
+                ("updated_at", ts),
+            ]
+        ),
+        "message_stats": pa.schema(
+            [
+                ("conversation_id", pa.int64()),
+                ("message_count", pa.int64()),
+                ("user_messages", pa.int64()),
+                ("assistant_messages", pa.int64()),
+                ("total_chars", pa.int64()),
+                ("first_message_at", ts),
+                ("last_message_at", ts),
+                ("as_of", ts),
+            ]
+        ),
+        "deletions": pa.schema(
+            [
+                ("id", pa.int64()),
+                ("entity", pa.string()),
+                ("record_id", pa.int64()),
+                ("deleted_at", ts),
+            ]
+        ),
+    }
+
+
+class PartitionedWriter:
+    """
+    Buffer rows per (pt_id, month) partition and write Parquet part files.
+
+    All buffers are flushed once `chunk_rows` rows are held in total, which
+    bounds memory regardless of how many partitions a run touches. Rows
+    added without a pt_id are partitioned by month only.
+    """
+
+    def __init__(self, root: Path, dataset: str, schema, run_id: str, chunk_rows: int):
+        self.pa, self.pq = _pyarrow()
+        self.root = root / dataset
+        self.schema = schema
+        self.run_id = run_id
+        self.chunk_rows = chunk_rows
+        self.buffers: Dict[PartitionKey, List[dict]] = defaultdict(list)
+        self.buffered = 0
+        self.parts = 0
+        self.rows = 0
+
+    def add(self, pt_id: Optional[int], created_at: Optional[datetime], row: dict) -> None:
+        month = created_at.strftime("%Y-%m") if created_at else "unknown"
+        self.buffers[(pt_id, month)].append(row)
+        self.buffered += 1
+        if self.buffered >= self.chunk_rows:
+            self.flush()
+
+    def flush(self) -> None:
+        for (pt_id, month), rows in self.buffers.items():
+            directory = self.root / f"month={month}"
+            if pt_id is not None:
+                directory = self.root / f"pt_id={pt_id}" / f"month={month}"
+            directory.mkdir(parents=True, exist_ok=True)
+            table = self.pa.Table.from_pylist(rows, schema=self.schema)
+            path = directory / f"part-{self.run_id}-{self.parts:05d}.parquet"
+            self.pq.write_table(table, path, compression="zstd")
+            self.parts += 1
+            self.rows += len(rows)
+        self.buffers.clear()
+        self.buffered = 0
+
+
+def _message_stats(
+    db: Session, after: Optional[str], until: Tuple[datetime, int], batch_size: int
+) -> Iterator[dict]:
+    """
+    Per-conversation message stats for conversations with messages in
+    (after, until], computed by the database and streamed.
+    """
+    changed = select(Message.conversation_id).where(
+        tuple_(Message.timestamp, Message.id) <= tuple_(*until)
+    )
+    if after:
+        changed = changed.where(
+            tuple_(Message.timestamp, Message.id) > tuple_(*decode_cursor(after))
+        )
+
+    stmt = (
+        select(
+            Message.conversation_id,
+            Conversation.pt_id,
+            Conversation.created_at,
+            func.count(Message.id).label("message_count"),
+            func.sum(case((Message.role == "user", 1), else_=0)).label("user_messages"),
+            func.sum(case((Message.role == "assistant", 1), else_=0)).label(
+                "assistant_messages"
+            ),
+            func.sum(func.length(Message.content)).label("total_chars"),
+            func.min(Message.timestamp).label("first_message_at"),
+            func.max(Message.timestamp).label("last_message_at"),
+        )
+        .join(Conversation, Conversation.id == Message.conversation_id)
+        .where(Message.conversation_id.in_(changed.distinct()))
+        .group_by(Message.conversation_id, Conversation.pt_id, Conversation.created_at)
+        .order_by(Message.conversation_id)
+        .execution_options(stream_results=True, yield_per=batch_size)
+    )
+    for row in db.execute(stmt).mappings():
+        yield dict(row)
+
+
+def _write_rows(
+    writer: PartitionedWriter,
+    rows: Iterable[dict],
+    columns: Iterable[str],
+    month_column: str = "created_at",
+) -> Optional[str]:
+    """Add rows to a writer and return the cursor of the last one"""
+    columns = list(columns)
+    last_cursor = None
+    for row in rows:
+        writer.add(row.get("pt_id"), row[month_column], {c: row.get(c) for c in columns})
+        last_cursor = row.get("_cursor", last_cursor)
+    writer.flush()
+    return last_cursor
+
+
+def write_snapshot(
+    db: Session,
+    output_dir: Path,
+    incremental: bool = True,
+    batch_size: int = 5000,
+    chunk_rows: int = 50_000,
+    safety_window_seconds: Optional[float] = None,
+) -> Dict[str, int]:
+    """
+    Write (or append to) the Parquet snapshot in output_dir.
+
+    Args:
+        db: Database session (use a read session)
+        output_dir: Snapshot root directory
+        incremental: Append only rows changed since the last run
+        batch_size: Rows fetched per database round trip
+        chunk_rows: Rows buffered before part files are written
+        safety_window_seconds: Leave rows changed this recently for the next
+            run (default EXPORT_SAFETY_WINDOW_SECONDS)
+
+    Returns:
+        Rows written per dataset
+    """
+    pa, _ = _pyarrow()
+    schemas = _schemas(pa)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    state_path = output_dir / STATE_FILE
+    state = json.loads(state_path.read_text()) if incremental and state_path.exists() else {}
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S%f")
+    written = {}
+
+    # Fix the message watermark up front, at the last settled message, so
+    # rows arriving mid-run or committing late behind it are picked up by
+    # the next run rather than skipped
+    last_message = db.execute(
+        select(Message.timestamp, Message.id)
+        .where(Message.timestamp <= settled_before(safety_window_seconds))
+        .order_by(Message.timestamp.desc(), Message.id.desc())
+        .limit(1)
+    ).first()
+
+    for dataset, month_column in (
+        ("conversations", "created_at"),
+        ("leads", "created_at"),
+        ("deletions", "deleted_at"),
+    ):
+        writer = PartitionedWriter(output_dir, dataset, schemas[dataset], run_id, chunk_rows)
+        rows = iter_rows(
+            db,
+            dataset,
+            after=state.get(dataset),
+            batch_size=batch_size,
+            safety_window_seconds=safety_window_seconds,
+        )
+        cursor = _write_rows(writer, rows, schemas[dataset].names, month_column)
+        if cursor:
+            state[dataset] = cursor
+        written[dataset] = writer.rows
+        logger.info(f"Snapshot {dataset}: {writer.rows} rows in {writer.parts} files")
+
+    writer = PartitionedWriter(
+        output_dir, "message_stats", schemas["message_stats"], run_id, chunk_rows
+    )
+    if last_message is not None:
+        as_of = datetime.now(timezone.utc).replace(tzinfo=None)
+        stats = (
+            {**row, "as_of": as_of}
+            for row in _message_stats(
+                db, state.get("message_stats"), tuple(last_message), batch_size
+            )
+        )
+        _write_rows(writer, stats, schemas["message_stats"].names)
+        state["message_stats"] = encode_cursor(*last_message)
+    written["message_stats"] = writer.rows
+    logger.info(f"Snapshot message_stats: {writer.rows} rows in {writer.parts} files")
+
+    state_path.write_text(json.dumps(state, indent=2))
+    return written
@@ -0,0 +1,79 @@
+"""
+Helpers for deferring work until first use, to keep cold start fast.
+
+- LazyObject: module-level singleton created on first attribute access
+- LazyASGIApp: ASGI sub-application imported and built on first request
+"""
+
+import importlib
+import threading
+from typing import Any, Callable
+
+
+class LazyObject:
+    """
+    Proxy for an object created on first use.
+
+    Attribute reads and writes are forwarded to the real object, so a
+    module can expose `service = LazyObject(Service)` and callers use it
+    exactly as they would the instance.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _get(self) -> Any:
+        instance = object.__getattribute__(self, "_instance")
+        if instance is None:
+            with object.__getattribute__(self, "_lock"):
+                instance = object.__getattribute__(self, "_instance")
+                if instance is None:
+                    instance = object.__getattribute__(self, "_factory")()
+                    object.__setattr__(self, "_instance", instance)
+        return instance
+
+    @property
+    def initialized(self) -> bool:
+        return object.__getattribute__(self, "_instance") is not None
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._get(), name, value)
+
+    def __repr__(self) -> str:
+        factory = object.__getattribute__(self, "_factory")
+        state = "initialized" if self.initialized else "not initialized"
+        return f"<LazyObject {getattr(factory, '__name__', factory)} ({state})>"
+
+
+class LazyASGIApp:
+    """
+    ASGI app loaded from "module:factory" on the first request.
+
+    Mount it like any sub-application; `routes` is exposed so url_for()
+    can resolve names inside the mount.
+    """
+
+    def __init__(self, target: str):
+        self.target = target
+        self._app = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._app is None:
+            with self._lock:
+                if self._app is None:
+                    module_name, _, factory = self.target.partition(":")
+                    self._app = getattr(importlib.import_module(module_name), factory)()
+        return self._app
+
+    @property
+    def routes(self):
+        return self.load().routes
+
+    async def __call__(self, scope, receive, send):
+        await self.load()(scope, receive, send)
@@ -0,0 +1,261 @@
+"""
+Per-conversation leases with fencing tokens.
+
+With several uvicorn workers or hosts, two messages from the same lead can
+be processed at once. Each run would then read history without the other's
+reply and interleave writes. `process_message` therefore holds a lease on
+the conversation while it works:
+
+- a lease is a row in conversation_leases, taken with a conditional UPDATE
+  (or INSERT the first time) when the previous lease has expired or been
+  released, so it works on SQLite and Postgres alike
+- each acquisition increments the row's token (the fencing token), and the
+  holder renews the lease in the background while it runs
+- every commit made by a session carrying a lease (`session.info["lease"]`)
+  first checks, in the same transaction, that the lease row still has that
+  token. A worker that stalled past its lease and was superseded gets
+  LeaseLost instead of overwriting the new holder's work
+
+Different conversations have different rows, so they never wait on each
+other. Messages for a held conversation wait for it, up to
+CONVERSATION_LEASE_WAIT_SECONDS.
+"""
+
+import asyncio
+import logging
+import os
+import random
+import socket
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from app.config import get_settings
+from app.database import SessionLocal
+from app.models import ConversationLease
+
+logger = logging.getLogger(__name__)
+
+
+class LeaseUnavailable(Exception):
+    """Another worker held the conversation for longer than we could wait"""
+
+
+class LeaseLost(Exception):
+    """The lease was taken over by another worker; this worker's writes are stale"""
+
+
+@dataclass
+class Lease:
+    conversation_id: int
+    holder: str
+    token: int
+    expires_at: datetime
+    lost: bool = False
+
+
+class LeaseManager:
+    """Takes, renews and releases conversation leases"""
+
+    def __init__(self, session_factory=SessionLocal):
+        self.settings = get_settings()
+        self._session_factory = session_factory
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self.held = 0
+        self.acquired = 0
+        self.contended = 0
+        self.timeouts = 0
+        self.lost = 0
+
+    def _ttl(self) -> timedelta:
+        return timedelta(seconds=self.settings.conversation_lease_ttl_seconds)
+
+    def try_acquire(self, conversation_id: int) -> Optional[Lease]:
+        """Take the lease if it is free or expired, without waiting"""
+        holder = f"{self.worker}:{uuid.uuid4().hex[:8]}"
+        now = datetime.now(timezone.utc)
+        expires_at = now + self._ttl()
+        key = ConversationLease.conversation_id == conversation_id
+
+        db = self._session_factory()
+        try:
+            taken = db.execute(
+                update(ConversationLease)
+                .where(key, ConversationLease.expires_at <= now)
+                .values(
+                    holder=holder,
+                    token=ConversationLease.token + 1,
+                    acquired_at=now,
+                    expires_at=expires_at,
+                )
+            )
+            if taken.rowcount == 0:
+                if db.execute(select(ConversationLease.token).where(key)).first() is not None:
+                    db.rollback()
+                    return None
+                db.execute(
+                    insert(ConversationLease).values(
+                        conversation_id=conversation_id,
+                        holder=holder,
+                        token=1,
+                        acquired_at=now,
+                        expires_at=expires_at,
+                    )
+                )
+            token = db.execute(
+                select(ConversationLease.token).where(key, ConversationLease.holder == holder)
+            ).scalar_one()
+            db.commit()
+        except IntegrityError:
+            # Another worker inserted the first lease for this conversation
+            db.rollback()
+            return None
+        finally:
+            db.close()
+
+        return Lease(conversation_id, holder, token, expires_at)
+
+    def renew(self, lease: Lease) -> bool:
+        """Extend the lease; False (and lease.lost) if it has been taken over"""
+        expires_at = datetime.now(timezone.utc) + self._ttl()
+        db = self._session_factory()
+        try:
+            renewed = db.execute(
+                update(ConversationLease)
+                .where(
+                    ConversationLease.conversation_id == lease.conversation_id,
+                    ConversationLease.token == lease.token,
+                )
+                .values(expires_at=expires_at)
+            )
+            db.commit()
+        finally:
+            db.close()
+
+        if renewed.rowcount != 1:
+            lease.lost = True
+            return False
+        lease.expires_at = expires_at
+        return True
+
+    def check(self, lease: Lease) -> None:
+        """
+        Raise LeaseLost if the lease has been taken over, without writing.
+
+        For side effects outside the database (e.g. holding a calendar
+        slot) that a later fenced commit could not undo.
+        """
+        if not lease.lost:
+            db = self._session_factory()
+            try:
+                current = db.execute(
+                    select(ConversationLease.token).where(
+                        ConversationLease.conversation_id == lease.conversation_id,
+                        ConversationLease.token == lease.token,
+                    )
+                ).first()
+            finally:
+                db.close()
+            lease.lost = current is None
+        if lease.lost:
+            raise LeaseLost(
+                f"Lease on conversation {lease.conversation_id} (token {lease.token}) is stale"
+            )
+
+    def release(self, lease: Lease) -> None:
+        """Free the lease now; the token is kept so the next one is higher"""
+        db = self._session_factory()
+        try:
+            db.execute(
+                update(ConversationLease)
+                .where(
+                    ConversationLease.conversation_id == lease.conversation_id,
+                    ConversationLease.token == lease.token,
+                )
+                .values(holder=None, expires_at=datetime.now(timezone.utc))
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    async def _keep_renewed(self, lease: Lease) -> None:
+        interval = self.settings.conversation_lease_ttl_seconds / 3
+        while True:
+            await asyncio.sleep(interval)
+            if not self.renew(lease):
+                self.lost += 1
+                logger.warning(
+                    f"Lease on conversation {lease.conversation_id} (token {lease.token}) "
+                    "was taken over"
+                )
+                return
+
+    @asynccontextmanager
+    async def hold(self, conversation_id: int) -> AsyncIterator[Lease]:
+        """
+        Hold the conversation's lease for the duration of the block.
+
+        Waits (polling with jittered backoff) while another worker holds it,
+        and raises LeaseUnavailable after CONVERSATION_LEASE_WAIT_SECONDS.
+        """
+        deadline = time.monotonic() + self.settings.conversation_lease_wait_seconds
+        delay = 0.05
+        lease = self.try_acquire(conversation_id)
+        if lease is None:
+            self.contended += 1
+        while lease is None:
+            if time.monotonic() >= deadline:
+                self.timeouts += 1
+                raise LeaseUnavailable(f"Conversation {conversation_id} is held by another worker")
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, 0.5)
+            lease = self.try_acquire(conversation_id)
+
+        self.acquired += 1
+        self.held += 1
+        renewer = asyncio.create_task(self._keep_renewed(lease))
+        try:
+            yield lease
+        finally:
+            renewer.cancel()
+            self.held -= 1
+            if not lease.lost:
+                self.release(lease)
+
+    def stats(self) -> dict:
+        return {
+            "held": self.held,
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "timeouts": self.timeouts,
+            "lost": self.lost,
+        }
+
+
+lease_manager = LeaseManager()
+
+
+@event.listens_for(Session, "before_commit")
+def _fence(session):
+    """Refuse to commit for a lease that is no longer current"""
+    lease = session.info.get("lease")
+    if lease is None:
+        return
+    table = ConversationLease.__table__
+    current = session.connection().execute(
+        update(table)
+        .where(table.c.conversation_id == lease.conversation_id, table.c.token == lease.token)
+        .values(last_write_at=datetime.now(timezone.utc))
+    )
+    if current.rowcount != 1:
+        lease.lost = True
+        raise LeaseLost(
+            f"Lease on conversation {lease.conversation_id} (token {lease.token}) is stale"
+        )
@@ -0,0 +1,270 @@
+"""
+Prometheus metrics for the message pipeline, served as text on /metrics.
+
+Histograms (seconds):
+
+- webhook_ack_seconds: time to answer Twilio's webhook POST
+- queue_wait_seconds: webhook receipt to processing start (background task or
+  worker shard queue)
+- agent_call_seconds{agent,outcome}: each agent call, including LLM
+  limiter waits and hedges (outcome ok, error or shed)
+- twilio_send_seconds{outcome}: each Twilio send
+- db_seconds_per_turn: statement time on the primary database while
+  processing one message
+- reply_latency_seconds: webhook receipt to the reply being accepted by
+  Twilio
+
+Counters: lead_outcomes_total{outcome} (qualified, rejected,
+needs_more_info) and fallback_messages_total{reason}. Gauges:
+messages_in_flight, agent_calls_in_flight{agent} and
+twilio_sends_in_flight.
+
+Recording takes no lock: each thread updates its own shard of a metric
+(threading.local) and a scrape adds the shards up. A lock is taken only the
+first time a thread touches a metric, to register its shard.
+
+With WORKER_PROCESSES > 0, messages are processed in the worker processes.
+Each worker sends a snapshot() of its metrics to the web process over the
+pool's results queue every second; the web process keeps the latest one per
+worker (merge()) and adds them in on every scrape. A worker that exits
+keeps its counts and histograms but not its gauges (retire()).
+"""
+
+import threading
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+PREFIX = "ptbot_"
+
+# Upper bounds (seconds) of histogram buckets
+FAST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SLOW_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 32.0, 64.0, 128.0)
+
+LabelValues = Tuple[str, ...]
+
+_registry: List["Metric"] = []
+
+# Latest snapshot from each other process: source -> metric name -> values
+_remote: Dict[str, Dict[str, Dict[LabelValues, list]]] = {}
+_remote_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric:
+    """A metric whose values are kept in one shard per thread"""
+
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = PREFIX + name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._local = threading.local()
+        self._shards: List[Dict[LabelValues, list]] = []
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _shard(self) -> Dict[LabelValues, list]:
+        try:
+            return self._local.values
+        except AttributeError:
+            values: Dict[LabelValues, list] = {}
+            with self._lock:
+                self._shards.append(values)
+            self._local.values = values
+            return values
+
+    def _new(self) -> list:
+        return [0.0]
+
+    def collect(self) -> Dict[LabelValues, list]:
+        """Shards added up, per label values"""
+        with self._lock:
+            shards = list(self._shards)
+        with _remote_lock:
+            shards += [
+                snapshot[self.name] for snapshot in _remote.values() if self.name in snapshot
+            ]
+        totals: Dict[LabelValues, list] = {}
+        for shard in shards:
+            for labels, values in list(shard.items()):
+                total = totals.get(labels)
+                if total is None:
+                    totals[labels] = list(values)
+                else:
+                    for i, value in enumerate(values):
+                        total[i] += value
+        return totals
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, (value,) in sorted(self.collect().items()):
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels: str, amount: float = 1.0) -> None:
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            values = shard[labels] = self._new()
+        values[0] += amount
+
+
+class Gauge(Counter):
+    """An up/down count; each shard holds its thread's net change"""
+
+    kind = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1.0) -> None:
+        self.inc(*labels, amount=-amount)
+
+    @contextmanager
+    def track(self, *labels: str) -> Iterator[None]:
+        """Count the block as in flight while it runs"""
+        self.inc(*labels)
+        try:
+            yield
+        finally:
+            self.dec(*labels)
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = FAST_BUCKETS,
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def _new(self) -> list:
+        # A count per bucket, then the sum and count of all observations
+        return [0] * len(self.buckets) + [0.0, 0]
+
+    def observe(self, seconds: float, *labels: str) -> None:
+        shard = self._shard()
+        values = shard.get(labels)
+        if values is None:
+            values = shard[labels] = self._new()
+        values[bisect_left(self.buckets, seconds)] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, values in sorted(self.collect().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, values):
+                cumulative += count
+                le = _labels(self.labelnames, labels, f'le="{_number(bound)}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(values[-2])}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {values[-1]}")
+        return lines
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines: List[str] = []
+    for metric in _registry:
+        lines += metric.render()
+    return "\n".join(lines) + "\n"
+
+
+# Metrics of other processes (pool workers)
+
+
+def snapshot() -> Dict[str, Dict[LabelValues, list]]:
+    """This process's metric values, picklable, for merge() in another process"""
+    return {metric.name: metric.collect() for metric in _registry}
+
+
+def merge(source: str, values: Dict[str, Dict[LabelValues, list]]) -> None:
+    """Include another process's snapshot; it replaces that source's previous one"""
+    with _remote_lock:
+        _remote[source] = values
+
+
+def retire(source: str) -> None:
+    """The source process exited: keep its totals, drop what it had in flight"""
+    gauges = {metric.name for metric in _registry if isinstance(metric, Gauge)}
+    with _remote_lock:
+        values = _remote.get(source)
+        if values is not None:
+            _remote[source] = {name: v for name, v in values.items() if name not in gauges}
+
+
+# Database time per turn: statement timings are added to the running
+# turn's total, if the current context is processing one
+
+_db_time: ContextVar[Optional[List[float]]] = ContextVar("db_time", default=None)
+
+
+def add_db_time(seconds: float) -> None:
+    total = _db_time.get()
+    if total is not None:
+        total[0] += seconds
+
+
+@contextmanager
+def track_db_time() -> Iterator[None]:
+    """Observe db_seconds_per_turn for the statements run in the block"""
+    total = [0.0]
+    token = _db_time.set(total)
+    try:
+        yield
+    finally:
+        _db_time.reset(token)
+        db_seconds_per_turn.observe(total[0])
+
+
+# Pipeline metrics
+
+webhook_ack_seconds = Histogram("webhook_ack_seconds", "Time to answer a WhatsApp webhook POST")
+queue_wait_seconds = Histogram(
+    "queue_wait_seconds", "Webhook receipt to the start of processing", buckets=SLOW_BUCKETS
+)
+agent_call_seconds = Histogram(
+    "agent_call_seconds", "Agent call duration, including limiter waits", ["agent", "outcome"], SLOW_BUCKETS
+)
+twilio_send_seconds = Histogram("twilio_send_seconds", "Twilio message send duration", ["outcome"])
+db_seconds_per_turn = Histogram(
+    "db_seconds_per_turn", "Primary database statement time while processing one message"
+)
+reply_latency_seconds = Histogram(
+    "reply_latency_seconds", "Webhook receipt to the reply being accepted by Twilio", buckets=SLOW_BUCKETS
+)
+
+lead_outcomes = Counter("lead_outcomes_total", "Scored leads by outcome", ["outcome"])
+fallback_messages = Counter("fallback_messages_total", "Fallback replies sent, by reason", ["reason"])
+
+messages_in_flight = Gauge("messages_in_flight", "Messages being processed")
+agent_calls_in_flight = Gauge("agent_calls_in_flight", "Agent calls in progress", ["agent"])
+twilio_sends_in_flight = Gauge("twilio_sends_in_flight", "Twilio sends in progress")
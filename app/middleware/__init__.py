@@ -0,0 +1,3 @@
+from app.middleware.rate_limit import RateLimiter, RateLimitMiddleware, rate_limiter
+
+__all__ = ["RateLimiter", "RateLimitMiddleware", "rate_limiter"]
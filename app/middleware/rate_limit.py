@@ -0,0 +1,288 @@
+"""
+Rate limiting for the WhatsApp webhook, before any database or LLM work.
+
+RateLimitMiddleware is plain ASGI: for a webhook POST it reads the form body
+once, takes the sender from its `From` field and replays the same body to
+the route, so the endpoint's `request.form()` still works. Every other
+request passes straight through.
+
+Two sliding windows apply (a weighted sum of the current and previous
+fixed window, so memory is constant per key):
+
+- per phone: at most RATE_LIMIT_PHONE_MAX messages per
+  RATE_LIMIT_PHONE_WINDOW_SECONDS from one sender, which stops spammers and
+  bots stuck in a reply loop
+- global: at most RATE_LIMIT_GLOBAL_MAX webhook messages per
+  RATE_LIMIT_GLOBAL_WINDOW_SECONDS across all senders (0 = no global limit)
+
+A rejected message gets the usual empty TwiML with a 200, so Twilio does not
+retry it. Counters are kept in memory per process, or in Redis when
+RATE_LIMIT_REDIS_URL is set so that several processes share them; if Redis
+is unreachable, messages are let through.
+
+Counts and the time the limiter adds per request are under `rate_limit` on
+/health.
+"""
+
+import logging
+import time
+from typing import Dict, Iterable, Optional
+from urllib.parse import unquote_plus
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+EMPTY_TWIML = b"<?xml version='1.0' encoding='UTF-8'?>\n<Response></Response>"
+GLOBAL_KEY = "*"
+EWMA_ALPHA = 0.05
+
+
+def sender_from_form(body: bytes) -> Optional[str]:
+    """The `From` field of a urlencoded form body, without the whatsapp: prefix"""
+    for field in body.split(b"&"):
+        if field.startswith(b"From="):
+            sender = unquote_plus(field[5:].decode("latin-1"))
+            return sender.replace("whatsapp:", "") or None
+    return None
+
+
+class MemoryWindows:
+    """Sliding-window counters in this process"""
+
+    name = "memory"
+
+    def __init__(self):
+        # key -> [window seconds, window index, count in that window,
+        # count in the one before]; each key keeps the window it is counted in
+        self._counts: Dict[str, list] = {}
+        self._next_prune = 0.0
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def _current(self, key: str, window: float, now: float) -> list:
+        index = int(now // window)
+        counts = self._counts.get(key)
+        if counts is None:
+            counts = self._counts[key] = [window, index, 0, 0]
+        elif counts[1] != index:
+            counts[3] = counts[2] if counts[1] == index - 1 else 0
+            counts[2] = 0
+            counts[1] = index
+        return counts
+
+    async def hit(self, key: str, limit: int, window: float, now: float) -> bool:
+        """Count a hit for `key` if it is under `limit`; False if it is not"""
+        counts = self._current(key, window, now)
+        previous_weight = 1.0 - (now % window) / window
+        if counts[2] + counts[3] * previous_weight >= limit:
+            return False
+        counts[2] += 1
+        if now >= self._next_prune:
+            self._prune(now, window)
+        return True
+
+    async def undo(self, key: str, window: float, now: float) -> None:
+        """Take back a hit counted by hit() at `now`"""
+        counts = self._counts.get(key)
+        if counts is not None and counts[1] == int(now // window) and counts[2] > 0:
+            counts[2] -= 1
+
+    def _prune(self, now: float, window: float) -> None:
+        """Forget keys with no hits in their current or previous window"""
+        stale = [
+            key for key, counts in self._counts.items()
+            if counts[1] < int(now // counts[0]) - 1
+        ]
+        for key in stale:
+            del self._counts[key]
+        self._next_prune = now + window
+
+
+# Counts the hit only if it is under the limit, in one atomic step, so
+# concurrent processes cannot all pass the check before any of them counts.
+# KEYS: current window, previous window; ARGV: limit, previous weight, TTL
+_HIT_SCRIPT = """
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+if current + previous * tonumber(ARGV[2]) >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[3])
+return 1
+"""
+
+
+class RedisWindows:
+    """Sliding-window counters shared through Redis"""
+
+    name = "redis"
+
+    def __init__(self, url: str):
+        try:
+            import redis.asyncio as redis
+        except ImportError as e:
+            raise RuntimeError(
+                "RATE_LIMIT_REDIS_URL needs the redis package: pip install redis"
+            ) from e
+        self._redis = redis.from_url(url)
+        self._hit = self._redis.register_script(_HIT_SCRIPT)
+        self.errors = 0
+
+    def __len__(self) -> int:
+        return 0  # Not tracked locally
+
+    async def hit(self, key: str, limit: int, window: float, now: float) -> bool:
+        index = int(now // window)
+        try:
+            return bool(await self._hit(
+                keys=[f"ratelimit:{key}:{index}", f"ratelimit:{key}:{index - 1}"],
+                args=[limit, 1.0 - (now % window) / window, int(window * 2) + 1],
+            ))
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Rate limit store unavailable, allowing message: {e}")
+        return True
+
+    async def undo(self, key: str, window: float, now: float) -> None:
+        try:
+            await self._redis.decr(f"ratelimit:{key}:{int(now // window)}")
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Rate limit store unavailable: {e}")
+
+
+class RateLimiter:
+    """Per-phone and global limits on incoming webhook messages"""
+
+    def __init__(self):
+        self.settings = get_settings()
+        self._windows = None
+        self.allowed = 0
+        self.rejected: Dict[str, int] = {"phone": 0, "global": 0}
+        self._overhead: Optional[float] = None  # EWMA, seconds
+
+    @property
+    def windows(self):
+        if self._windows is None:
+            url = self.settings.rate_limit_redis_url
+            self._windows = RedisWindows(url) if url else MemoryWindows()
+        return self._windows
+
+    async def check(self, phone: Optional[str]) -> Optional[str]:
+        """None if the message may go through, else which limit it hit"""
+        now = time.time()
+        settings = self.settings
+        phone_counted = False
+        if phone is not None and settings.rate_limit_phone_max > 0:
+            if not await self.windows.hit(
+                phone, settings.rate_limit_phone_max, settings.rate_limit_phone_window_seconds, now
+            ):
+                return "phone"
+            phone_counted = True
+        if settings.rate_limit_global_max > 0:
+            if not await self.windows.hit(
+                GLOBAL_KEY,
+                settings.rate_limit_global_max,
+                settings.rate_limit_global_window_seconds,
+                now,
+            ):
+                # Dropped for everyone's sake: don't count it against the sender
+                if phone_counted:
+                    await self.windows.undo(phone, settings.rate_limit_phone_window_seconds, now)
+                return "global"
+        return None
+
+    def record(self, phone: Optional[str], rejected_by: Optional[str], seconds: float) -> None:
+        if rejected_by is None:
+            self.allowed += 1
+        else:
+            self.rejected[rejected_by] += 1
+            logger.debug(f"Rate limited message from {phone} ({rejected_by} limit)")
+        if self._overhead is None:
+            self._overhead = seconds
+        else:
+            self._overhead += EWMA_ALPHA * (seconds - self._overhead)
+
+    def stats(self) -> dict:
+        windows = self._windows
+        return {
+            "enabled": self.settings.rate_limit_enabled,
+            "backend": windows.name if windows is not None else None,
+            "allowed": self.allowed,
+            "rejected": dict(self.rejected),
+            "tracked_keys": len(windows) if windows is not None else 0,
+            "overhead_us": round(self._overhead * 1e6, 1) if self._overhead is not None else None,
+        }
+
+
+class RateLimitMiddleware:
+    """ASGI middleware applying `limiter` to form POSTs on `paths`"""
+
+    def __init__(
+        self,
+        app,
+        limiter: Optional[RateLimiter] = None,
+        paths: Iterable[str] = ("/webhook/whatsapp",),
+    ):
+        self.app = app
+        self.limiter = limiter or rate_limiter
+        self.paths = frozenset(paths)
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] != "POST"
+            or scope["path"] not in self.paths
+            or not self.limiter.settings.rate_limit_enabled
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                # Client went away before sending the whole body
+                await self.app(scope, _replay([message], receive), send)
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+
+        started = time.perf_counter()
+        phone = sender_from_form(body)
+        rejected_by = await self.limiter.check(phone)
+        self.limiter.record(phone, rejected_by, time.perf_counter() - started)
+
+        if rejected_by is not None:
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"application/xml"),
+                    (b"content-length", str(len(EMPTY_TWIML)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": EMPTY_TWIML})
+            return
+
+        replayed = {"type": "http.request", "body": body, "more_body": False}
+        await self.app(scope, _replay([replayed], receive), send)
+
+
+def _replay(messages: list, receive):
+    """A receive callable that returns `messages` first, then defers to `receive`"""
+
+    async def replay():
+        if messages:
+            return messages.pop(0)
+        return await receive()
+
+    return replay
+
+
+rate_limiter = RateLimiter()
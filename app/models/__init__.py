@@ -2,5 +2,16 @@ from app.models.conversation import Conversation
 from app.models.message import Message
 from app.models.lead_data import LeadData
 from app.models.pt_preferences import PTPreferences
+from app.models.lead_stats import LeadDailyStats, LeadScoreBucket
+from app.models.booked_slot import BookedSlot
+from app.models.outbound_message import OutboundMessage
+from app.models.email_delivery import EmailDelivery
+from app.models.cache_version import CacheVersion
+from app.models.conversation_lease import ConversationLease
+from app.models.deleted_record import DeletedRecord
 
-__all__ = ["Conversation", "Message", "LeadData", "PTPreferences"]
+__all__ = [
+    "Conversation", "Message", "LeadData", "PTPreferences",
+    "LeadDailyStats", "LeadScoreBucket", "BookedSlot", "OutboundMessage",
+    "EmailDelivery", "CacheVersion", "ConversationLease", "DeletedRecord",
+]
@@ -0,0 +1,29 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, DateTime, ForeignKey, Index, Integer, String, UniqueConstraint
+
+from app.database import Base
+
+
+class BookedSlot(Base):
+    """A held or booked intro-call slot in a PT's calendar"""
+
+    __tablename__ = "booked_slots"
+    __table_args__ = (
+        # One booking per slot per PT: concurrent holds on the same slot
+        # fail on this constraint instead of double-booking
+        UniqueConstraint("pt_id", "slot_index", name="uq_booked_slots_pt_slot"),
+        Index("ix_booked_slots_pt_start", "pt_id", "start_at"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    pt_id = Column(Integer, ForeignKey("pt_preferences.id"), nullable=False)
+    slot_index = Column(Integer, nullable=False)  # Position on the working-hours slot grid
+    start_at = Column(DateTime, nullable=False)
+    end_at = Column(DateTime, nullable=False)
+    status = Column(String, nullable=False, default="held")  # held, booked
+    hold_expires_at = Column(DateTime, nullable=True)  # Held slots free up after this
+    conversation_id = Column(Integer, ForeignKey("conversations.id"), nullable=True)
+    lead_phone = Column(String, nullable=True)
+    meeting_link = Column(String, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
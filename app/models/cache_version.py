@@ -0,0 +1,15 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, DateTime, Integer, String
+
+from app.database import Base
+
+
+class CacheVersion(Base):
+    """Version counter bumped when cached data changes, polled by every process"""
+
+    __tablename__ = "cache_versions"
+
+    name = Column(String, primary_key=True)  # e.g. "pt_preferences"
+    version = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
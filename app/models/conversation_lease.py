@@ -0,0 +1,20 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String
+
+from app.database import Base
+
+
+class ConversationLease(Base):
+    """Which worker may currently advance a conversation (see app.leases)"""
+
+    __tablename__ = "conversation_leases"
+
+    conversation_id = Column(
+        Integer, ForeignKey("conversations.id", ondelete="CASCADE"), primary_key=True
+    )
+    holder = Column(String, nullable=True)  # host:pid:nonce, None once released
+    token = Column(Integer, nullable=False, default=0)  # Fencing token, +1 per acquisition
+    acquired_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    expires_at = Column(DateTime, nullable=False)
+    last_write_at = Column(DateTime, nullable=True)  # Last commit fenced by this lease
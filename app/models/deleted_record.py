@@ -0,0 +1,20 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, DateTime, Index, Integer, String
+
+from app.database import Base
+
+
+class DeletedRecord(Base):
+    """Tombstone for an exported row that was deleted (e.g. by clear_chat)"""
+
+    __tablename__ = "deleted_records"
+    __table_args__ = (
+        # Incremental export of deletions, in (deleted_at, id) order
+        Index("ix_deleted_records_deleted_at_id", "deleted_at", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    entity = Column(String, nullable=False)  # conversations, messages, leads
+    record_id = Column(Integer, nullable=False)
+    deleted_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
@@ -0,0 +1,27 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, String, Text
+
+from app.database import Base
+
+
+class EmailDelivery(Base):
+    """An email to a lead: queued until sent, then the result of sending it"""
+
+    __tablename__ = "email_deliveries"
+
+    id = Column(Integer, primary_key=True, index=True)
+    conversation_id = Column(
+        Integer, ForeignKey("conversations.id", ondelete="SET NULL"), nullable=True, index=True
+    )
+    kind = Column(String, nullable=False, default="rejection")
+    to_email = Column(String, nullable=False)
+    subject = Column(String, nullable=False)  # Empty until rendered
+    transport = Column(String, nullable=False)  # smtp, sendgrid, log
+    status = Column(String, nullable=False)  # pending, sending, sent, failed, skipped
+    error = Column(Text, nullable=True)
+    provider_message_id = Column(String, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    sent_at = Column(DateTime, nullable=True)
+    # When a process took it for sending; stale claims are requeued on start
+    claimed_at = Column(DateTime, nullable=True)
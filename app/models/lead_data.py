@@ -16,6 +16,8 @@ class LeadData(Base):
     budget_range = Column(String, nullable=True)
     commitment_level = Column(Integer, nullable=True)  # 1-10 scale
     availability = Column(String, nullable=True)
+    name = Column(String, nullable=True)
+    email = Column(String, nullable=True)
 
     # Qualification results
     qualification_score = Column(Integer, nullable=True)  # 1-100
@@ -0,0 +1,35 @@
+from sqlalchemy import Column, Date, ForeignKey, Integer, String, UniqueConstraint
+
+from app.database import Base
+
+
+class LeadDailyStats(Base):
+    """Lead counts per PT, creation day and current conversation status"""
+
+    __tablename__ = "lead_daily_stats"
+    __table_args__ = (UniqueConstraint("pt_id", "day", "status"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    pt_id = Column(Integer, ForeignKey("pt_preferences.id"), nullable=False, index=True)
+    day = Column(Date, nullable=False)  # Day the conversation was created
+    status = Column(String, nullable=False)  # active, qualified, rejected, archived
+
+    lead_count = Column(Integer, nullable=False, default=0)
+    # Only populated on "qualified" rows
+    time_to_qualify_seconds = Column(Integer, nullable=False, default=0)
+    time_to_qualify_samples = Column(Integer, nullable=False, default=0)
+
+
+class LeadScoreBucket(Base):
+    """Score distribution per PT and creation day, in buckets of 10 points"""
+
+    __tablename__ = "lead_score_buckets"
+    __table_args__ = (UniqueConstraint("pt_id", "day", "bucket"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    pt_id = Column(Integer, ForeignKey("pt_preferences.id"), nullable=False, index=True)
+    day = Column(Date, nullable=False)
+    bucket = Column(Integer, nullable=False)  # 0 = 1-10, 1 = 11-20, ... 9 = 91-100
+
+    lead_count = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Integer, nullable=False, default=0)
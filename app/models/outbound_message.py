@@ -0,0 +1,33 @@
+from datetime import datetime, timezone
+
+from sqlalchemy import Column, DateTime, Float, ForeignKey, Index, Integer, String, Text
+
+from app.database import Base
+
+
+class OutboundMessage(Base):
+    """A WhatsApp message queued for sending (the outbox)"""
+
+    __tablename__ = "outbound_messages"
+    __table_args__ = (
+        # Oldest unsent message per recipient
+        Index("ix_outbound_messages_status_to_id", "status", "to_phone", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, index=True)
+    conversation_id = Column(
+        Integer, ForeignKey("conversations.id", ondelete="SET NULL"), nullable=True
+    )
+    from_number = Column(String, nullable=False)  # Sender, e.g. whatsapp:+14155238886
+    to_phone = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String, nullable=False, default="pending")  # pending, sending, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    last_error = Column(Text, nullable=True)
+    twilio_message_sid = Column(String, nullable=True)
+    created_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+    sent_at = Column(DateTime, nullable=True)
+    # Epoch time the lead's message this replies to arrived (reply latency),
+    # kept here because the reply may be sent by another process
+    received_at = Column(Float, nullable=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime
+from sqlalchemy import Column, Integer, Float, String, Text, DateTime, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime, timezone
 from app.database import Base
@@ -6,9 +6,16 @@ from app.database import Base
 
 class PTPreferences(Base):
     __tablename__ = "pt_preferences"
+    __table_args__ = (
+        # Tenant routing: each number belongs to at most one PT
+        Index("ix_pt_preferences_whatsapp_number", "whatsapp_number", unique=True),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
+    # Twilio WhatsApp number leads message this PT on (e.g. +14155238886);
+    # NULL = the deployment's default number
+    whatsapp_number = Column(String, nullable=True)
     target_goals = Column(Text, nullable=False)  # e.g., "weight loss, muscle building"
     age_range = Column(String, nullable=False)  # e.g., "25-45"
     preferred_location = Column(String, nullable=False)
@@ -40,5 +47,9 @@ class PTPreferences(Base):
         DateTime, nullable=True, default=lambda: datetime.now(timezone.utc)
     )  # When prompts were last customized
 
+    # LLM capacity tier (see app/agents/limiter.py)
+    llm_weight = Column(Float, nullable=True)  # Relative share of LLM capacity under contention (NULL = 1.0)
+    llm_min_share = Column(Float, nullable=True)  # Fraction of LLM slots guaranteed, 0-1 (NULL = none)
+
     # Relationships
     conversations = relationship("Conversation", back_populates="pt")
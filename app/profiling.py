@@ -0,0 +1,298 @@
+"""
+On-demand CPU and memory profiling of a running process.
+
+- SamplingProfiler: a background thread samples every thread's Python stack
+  every `interval` seconds (sys._current_frames), for a set time or until
+  stopped. Nothing is instrumented, so the cost is one stack walk per
+  thread per sample, and none at all while it is not running.
+- MemoryProfiler: tracemalloc snapshots. The first snapshot starts
+  tracemalloc, each later one is compared with the one before, showing
+  where memory grew in between. tracemalloc slows allocation noticeably,
+  so stop it when done.
+
+Both write folded stacks ("frame;frame;frame count" per line), the input
+of flamegraph.pl, speedscope and inferno: CPU samples per stack, bytes
+allocated per stack, and bytes grown per stack for a diff. Files go to
+PROFILING_DIR, named with the process id so several processes can share it.
+
+The admin endpoints under /debug/profile (app.api.debug) drive the
+singletons below, in the web process and (through WorkerPool.call) in each
+pool worker; scripts/benchmark.py and scripts/loadgen.py take --profile to
+use the same profiler on their runs.
+"""
+
+import itertools
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL_SECONDS = 0.01
+MIN_INTERVAL_SECONDS = 0.001
+TRACEMALLOC_FRAMES = 25
+TOP = 15
+
+ROOT = str(Path(__file__).resolve().parent.parent) + os.sep
+
+_sequence = itertools.count(1)
+
+
+class ProfilerBusy(RuntimeError):
+    """A CPU profile is already running"""
+
+
+def _short_path(filename: str) -> str:
+    if filename.startswith(ROOT):
+        return filename[len(ROOT):]
+    _, marker, rest = filename.rpartition("site-packages" + os.sep)
+    return rest if marker else os.path.basename(filename)
+
+
+def _output_path(kind: str) -> Path:
+    directory = Path(get_settings().profiling_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / f"{kind}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{next(_sequence)}.folded"
+
+
+def _write_folded(path: Path, weights: Dict[str, int]) -> None:
+    with open(path, "w", encoding="utf-8") as f:
+        for stack, weight in sorted(weights.items()):
+            if weight > 0:
+                f.write(f"{stack} {weight}\n")
+
+
+class SamplingProfiler:
+    """Statistical CPU profiler for all threads of this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._labels: Dict[object, str] = {}
+        self._samples: Counter = Counter()
+        self._path: Optional[Path] = None
+        self._interval = DEFAULT_INTERVAL_SECONDS
+        self._started = 0.0
+        self._seconds: Optional[float] = None
+        self.last: Optional[dict] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(
+        self,
+        seconds: Optional[float] = None,
+        interval: float = DEFAULT_INTERVAL_SECONDS,
+        path: Optional[Path] = None,
+    ) -> dict:
+        """
+        Start sampling; it stops by itself after `seconds` (if given)
+
+        Raises ProfilerBusy if a profile is already running.
+        """
+        with self._lock:
+            if self.running:
+                raise ProfilerBusy("A CPU profile is already running")
+            self._samples = Counter()
+            self._path = Path(path) if path else _output_path("cpu")
+            self._interval = max(MIN_INTERVAL_SECONDS, interval)
+            self._seconds = seconds
+            self._started = time.monotonic()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self._thread.start()
+        logger.info(f"CPU profiling for {seconds or 'unlimited'}s into {self._path}")
+        return self.status()
+
+    def stop(self) -> Optional[dict]:
+        """Stop sampling now; returns the profile's summary"""
+        thread = self._thread
+        if thread is not None:
+            self._stop.set()
+            thread.join()
+        return self.last
+
+    @contextmanager
+    def profile(self, path: Path, interval: float = DEFAULT_INTERVAL_SECONDS) -> Iterator[dict]:
+        """Profile the block; the yielded dict is filled with the summary"""
+        summary: dict = {}
+        self.start(interval=interval, path=path)
+        try:
+            yield summary
+        finally:
+            summary.update(self.stop() or {})
+
+    def status(self) -> dict:
+        running = self.running
+        return {
+            "running": running,
+            "pid": os.getpid(),
+            "file": str(self._path) if running else None,
+            "elapsed_seconds": round(time.monotonic() - self._started, 1) if running else None,
+            "seconds": self._seconds if running else None,
+            "samples": sum(list(self._samples.values())) if running else None,
+            "last": self.last,
+        }
+
+    def _run(self) -> None:
+        deadline = self._started + self._seconds if self._seconds else None
+        own = threading.get_ident()
+        try:
+            while not self._stop.wait(self._interval):
+                self._sample(own)
+                if deadline is not None and time.monotonic() >= deadline:
+                    break
+        finally:
+            self._finish()
+
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            name = getattr(code, "co_qualname", code.co_name)
+            label = self._labels[code] = (
+                f"{name} ({_short_path(code.co_filename)}:{code.co_firstlineno})".replace(";", ",")
+            )
+        return label
+
+    def _sample(self, own: int) -> None:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own:
+                continue
+            stack: List[str] = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(ident, f"thread-{ident}").replace(";", ","))
+            stack.reverse()
+            self._samples[";".join(stack)] += 1
+
+    def _finish(self) -> None:
+        samples = self._samples
+        total = sum(samples.values())
+        _write_folded(self._path, samples)
+        leaves: Counter = Counter()
+        for stack, count in samples.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        self.last = {
+            "file": str(self._path),
+            "seconds": round(time.monotonic() - self._started, 1),
+            "interval_seconds": self._interval,
+            "samples": total,
+            "top_self": [
+                {"function": function, "samples": count, "share": round(count / total, 3)}
+                for function, count in leaves.most_common(TOP)
+            ],
+        }
+        self._labels = {}
+        logger.info(f"CPU profile written to {self._path} ({total} samples)")
+
+
+class MemoryProfiler:
+    """tracemalloc snapshots, each compared with the one before"""
+
+    def __init__(self):
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self.snapshots = 0
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def snapshot(self, path: Optional[Path] = None) -> dict:
+        """
+        Take a snapshot and write it as folded stacks weighted by bytes
+
+        Starts tracemalloc if needed (so the first snapshot only covers
+        allocations from then on). From the second snapshot on, growth since
+        the previous one is written next to it as `<name>-diff.folded`.
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._previous = None
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        path = Path(path) if path else _output_path("memory")
+        _write_folded(path, {
+            self._stack(stat.traceback): stat.size for stat in snapshot.statistics("traceback")
+        })
+        current, peak = tracemalloc.get_traced_memory()
+        result = {
+            "file": str(path),
+            "pid": os.getpid(),
+            "traced_kb": round(current / 1024, 1),
+            "peak_kb": round(peak / 1024, 1),
+            "top": [
+                {
+                    "where": self._where(stat.traceback),
+                    "size_kb": round(stat.size / 1024, 1),
+                    "count": stat.count,
+                }
+                for stat in snapshot.statistics("lineno")[:TOP]
+            ],
+        }
+
+        if self._previous is not None:
+            diff_path = path.with_name(f"{path.stem}-diff.folded")
+            _write_folded(diff_path, {
+                self._stack(stat.traceback): stat.size_diff
+                for stat in snapshot.compare_to(self._previous, "traceback")
+            })
+            result["diff_file"] = str(diff_path)
+            result["growth"] = [
+                {
+                    "where": self._where(stat.traceback),
+                    "size_diff_kb": round(stat.size_diff / 1024, 1),
+                    "count_diff": stat.count_diff,
+                }
+                for stat in snapshot.compare_to(self._previous, "lineno")[:TOP]
+            ]
+
+        self._previous = snapshot
+        self.snapshots += 1
+        return result
+
+    def stop(self) -> None:
+        """Stop tracemalloc and forget the previous snapshot"""
+        tracemalloc.stop()
+        self._previous = None
+
+    def status(self) -> dict:
+        current, peak = tracemalloc.get_traced_memory() if self.tracing else (0, 0)
+        return {
+            "tracing": self.tracing,
+            "pid": os.getpid(),
+            "snapshots": self.snapshots,
+            "traced_kb": round(current / 1024, 1),
+            "peak_kb": round(peak / 1024, 1),
+        }
+
+    @staticmethod
+    def _where(traceback: tracemalloc.Traceback) -> str:
+        frame = traceback[-1]
+        return f"{_short_path(frame.filename)}:{frame.lineno}"
+
+    @staticmethod
+    def _stack(traceback: tracemalloc.Traceback) -> str:
+        # Frames are oldest first, as folded stacks want them
+        return ";".join(
+            f"{_short_path(frame.filename)}:{frame.lineno}".replace(";", ",") for frame in traceback
+        )
+
+
+profiler = SamplingProfiler()
+memory_profiler = MemoryProfiler()
@@ -0,0 +1,180 @@
+"""
+Read-through cache of PTPreferences.
+
+PT rows are read on every message but almost never change, so each process
+keeps detached snapshots of them. Snapshots are plain PTPreferences
+instances no longer attached to a session: read their columns, but do not
+modify them or touch relationships.
+
+Invalidation:
+- a transaction that inserts, updates or deletes a PTPreferences row
+  (including SQLAdmin edits) bumps the "pt_preferences" row in
+  cache_versions, and clears this process's cache when it commits
+- every process polls that version, plus max(prompts_last_updated) to catch
+  edits made outside the ORM, at most every PT_CACHE_POLL_SECONDS, and
+  clears its cache when either has moved
+
+Editing a prompt override through the ORM also stamps prompts_last_updated.
+"""
+
+import itertools
+import logging
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import event, func, insert, select, update
+from sqlalchemy.orm import Session, attributes
+
+from app.config import get_settings
+from app.database import SessionLocal
+from app.models import PTPreferences
+from app.models.cache_version import CacheVersion
+
+logger = logging.getLogger(__name__)
+
+VERSION_NAME = "pt_preferences"
+
+PROMPT_FIELDS = (
+    "intro_message_override",
+    "discovery_prompt_override",
+    "qualification_prompt_override",
+    "rejection_email_override",
+    "booking_confirmation_override",
+    "prompt_version",
+)
+
+
+class PTCache:
+    """Process-local PTPreferences snapshots, kept in step across processes"""
+
+    def __init__(self, session_factory=SessionLocal):
+        self.settings = get_settings()
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        self._snapshots: Dict[int, PTPreferences] = {}
+        self._listeners: List[Callable[[], None]] = []
+        self._seen = None  # (version, max prompts_last_updated)
+        self._checked_at = 0.0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def on_change(self, listener: Callable[[], None]) -> None:
+        """Call `listener` whenever PT data may have changed"""
+        self._listeners.append(listener)
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._snapshots = {}
+        self.invalidations += 1
+        for listener in self._listeners:
+            listener()
+
+    def check(self) -> None:
+        """Poll the shared version (rate limited) and drop stale snapshots"""
+        now = time.monotonic()
+        if now - self._checked_at < self.settings.pt_cache_poll_seconds:
+            return
+        self._checked_at = now
+
+        db = self._session_factory()
+        try:
+            version = db.execute(
+                select(CacheVersion.version).where(CacheVersion.name == VERSION_NAME)
+            ).scalar()
+            last_updated = db.execute(select(func.max(PTPreferences.prompts_last_updated))).scalar()
+        finally:
+            db.close()
+
+        seen = (version, last_updated)
+        if self._seen is not None and seen != self._seen:
+            logger.info(f"PT preferences changed (version {version}), clearing cache")
+            self.invalidate()
+        self._seen = seen
+
+    def get(self, pt_id: int) -> Optional[PTPreferences]:
+        """Snapshot of a PT's preferences, or None if there is no such PT"""
+        self.check()
+        snapshot = self._snapshots.get(pt_id)
+        if snapshot is not None:
+            self.hits += 1
+            return snapshot
+
+        self.misses += 1
+        db = self._session_factory()
+        try:
+            snapshot = db.get(PTPreferences, pt_id)
+            if snapshot is None:
+                return None
+            db.expunge(snapshot)
+        finally:
+            db.close()
+
+        with self._lock:
+            self._snapshots[pt_id] = snapshot
+        return snapshot
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "cached": len(self._snapshots),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "invalidations": self.invalidations,
+            "version": self._seen[0] if self._seen else None,
+        }
+
+
+pt_cache = PTCache()
+
+
+# Change tracking for any session (app, admin, scripts)
+
+
+@event.listens_for(Session, "before_flush")
+def _stamp_prompt_changes(session, flush_context, instances):
+    for obj in session.dirty:
+        if not isinstance(obj, PTPreferences):
+            continue
+        if any(attributes.get_history(obj, field).has_changes() for field in PROMPT_FIELDS):
+            obj.prompts_last_updated = datetime.now(timezone.utc)
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_version(session, flush_context):
+    changed = itertools.chain(session.new, session.dirty, session.deleted)
+    if not any(isinstance(obj, PTPreferences) for obj in changed):
+        return
+    session.info["pt_preferences_changed"] = True
+    if session.info.get("pt_preferences_bumped"):
+        return
+
+    # Same transaction as the change, so other processes never see the new
+    # version without the new row
+    connection = session.connection()
+    now = datetime.now(timezone.utc)
+    table = CacheVersion.__table__
+    result = connection.execute(
+        update(table)
+        .where(table.c.name == VERSION_NAME)
+        .values(version=table.c.version + 1, updated_at=now)
+    )
+    if result.rowcount == 0:
+        connection.execute(insert(table).values(name=VERSION_NAME, version=1, updated_at=now))
+    session.info["pt_preferences_bumped"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _pt_changes_committed(session):
+    session.info.pop("pt_preferences_bumped", None)
+    if session.info.pop("pt_preferences_changed", False):
+        pt_cache.invalidate()
+
+
+@event.listens_for(Session, "after_rollback")
+def _pt_changes_rolled_back(session):
+    session.info.pop("pt_preferences_bumped", None)
+    session.info.pop("pt_preferences_changed", None)
@@ -0,0 +1,236 @@
+"""
+Circuit breakers for external dependencies (LLM provider, Twilio, calendar).
+
+Each breaker watches a rolling window of BREAKER_WINDOW_SECONDS:
+
+- closed: calls go through. Once the window holds at least
+  BREAKER_MIN_CALLS calls and either the error rate reaches
+  BREAKER_FAILURE_RATE or the share of calls slower than the breaker's
+  slow-call threshold reaches BREAKER_SLOW_CALL_RATE, the breaker opens
+- open: calls fail immediately with CircuitOpen for BREAKER_OPEN_SECONDS,
+  so callers fall back to their queued retry instead of each waiting out a
+  timeout against a dependency that is down
+- half-open: up to BREAKER_HALF_OPEN_PROBES calls are let through. If they
+  all succeed (and are not slow) the breaker closes; any failure opens it
+  again
+
+Only errors that point at the dependency count as failures (`is_failure`);
+a rejected request (e.g. an invalid phone number) is a healthy response.
+Cancelled calls are not counted at all.
+
+Breakers are per process. Their state is under `breakers` on /health.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, Iterator, List, Optional
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """The dependency's breaker is open; retry after `retry_after` seconds"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"Circuit '{name}' is open, retry in {retry_after:.1f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class Permit:
+    """One call let through by a breaker; report how it went with done()"""
+
+    def __init__(self, breaker: "CircuitBreaker", probe: bool):
+        self.breaker = breaker
+        self.probe = probe
+        self.started = time.monotonic()
+        self._finished = False
+
+    def done(self, error: Optional[BaseException] = None) -> None:
+        """Record the outcome: no error, an exception, or a cancellation"""
+        if self._finished:
+            return
+        self._finished = True
+        if error is not None and not isinstance(error, Exception):
+            outcome = None  # Cancelled: says nothing about the dependency
+        elif error is not None and self.breaker.is_failure(error):
+            outcome = "failure"
+        elif time.monotonic() - self.started >= self.breaker.slow_call_seconds:
+            outcome = "slow"
+        else:
+            outcome = "success"
+        self.breaker._record(self.probe, outcome)
+
+    def cancel(self) -> None:
+        """The call never happened"""
+        if not self._finished:
+            self._finished = True
+            self.breaker._record(self.probe, None)
+
+
+class CircuitBreaker:
+    """Rolling-window circuit breaker with half-open probes"""
+
+    def __init__(
+        self,
+        name: str,
+        slow_call_seconds: float,
+        is_failure: Optional[Callable[[Exception], bool]] = None,
+    ):
+        settings = get_settings()
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds
+        self.is_failure = is_failure or (lambda error: True)
+        self.window_seconds = settings.breaker_window_seconds
+        self.min_calls = settings.breaker_min_calls
+        self.failure_rate = settings.breaker_failure_rate
+        self.slow_call_rate = settings.breaker_slow_call_rate
+        self.open_seconds = settings.breaker_open_seconds
+        self.half_open_probes = settings.breaker_half_open_probes
+
+        self._lock = threading.Lock()
+        self.state = CLOSED
+        self._opened_at = 0.0
+        # [second, calls, failures, slow] per second of the window
+        self._buckets: Deque[List[int]] = deque()
+        self._probes_in_flight = 0
+        self._probe_successes = 0
+        self.trips = 0
+        self.rejected = 0
+
+    def _window(self, now: float) -> tuple:
+        horizon = int(now) - int(self.window_seconds)
+        while self._buckets and self._buckets[0][0] <= horizon:
+            self._buckets.popleft()
+        calls = sum(bucket[1] for bucket in self._buckets)
+        failures = sum(bucket[2] for bucket in self._buckets)
+        slow = sum(bucket[3] for bucket in self._buckets)
+        return calls, failures, slow
+
+    def _open(self, now: float, reason: str) -> None:
+        self.state = OPEN
+        self._opened_at = now
+        self.trips += 1
+        logger.error(f"Circuit '{self.name}' opened: {reason}")
+
+    def retry_after(self) -> float:
+        """Seconds until a call could be let through (0 if it would be now)"""
+        with self._lock:
+            if self.state == OPEN:
+                return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+            if self.state == HALF_OPEN and self._probes_in_flight >= self.half_open_probes:
+                return min(1.0, self.open_seconds)
+            return 0.0
+
+    def acquire(self) -> Permit:
+        """Let a call through, or raise CircuitOpen"""
+        with self._lock:
+            now = time.monotonic()
+            if self.state == OPEN:
+                remaining = self._opened_at + self.open_seconds - now
+                if remaining > 0:
+                    self.rejected += 1
+                    raise CircuitOpen(self.name, remaining)
+                self.state = HALF_OPEN
+                self._probes_in_flight = 0
+                self._probe_successes = 0
+                logger.info(f"Circuit '{self.name}' half-open, probing")
+            if self.state == HALF_OPEN:
+                if self._probes_in_flight >= self.half_open_probes:
+                    self.rejected += 1
+                    raise CircuitOpen(self.name, min(1.0, self.open_seconds))
+                self._probes_in_flight += 1
+                return Permit(self, probe=True)
+            return Permit(self, probe=False)
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """Run the block as one call through the breaker"""
+        permit = self.acquire()
+        try:
+            yield
+        except BaseException as e:
+            permit.done(e)
+            raise
+        permit.done()
+
+    def _record(self, probe: bool, outcome: Optional[str]) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if probe:
+                self._probes_in_flight = max(0, self._probes_in_flight - 1)
+                if self.state != HALF_OPEN or outcome is None:
+                    return
+                if outcome in ("failure", "slow"):
+                    self._open(now, f"probe {outcome}")
+                    return
+                self._probe_successes += 1
+                if self._probe_successes >= self.half_open_probes:
+                    self.state = CLOSED
+                    self._buckets.clear()
+                    logger.info(f"Circuit '{self.name}' closed")
+                return
+
+            if outcome is None or self.state != CLOSED:
+                return
+            second = int(now)
+            if not self._buckets or self._buckets[-1][0] != second:
+                self._buckets.append([second, 0, 0, 0])
+            bucket = self._buckets[-1]
+            bucket[1] += 1
+            bucket[2] += outcome == "failure"
+            bucket[3] += outcome == "slow"
+
+            calls, failures, slow = self._window(now)
+            if calls < self.min_calls:
+                return
+            if failures / calls >= self.failure_rate:
+                self._open(now, f"{failures}/{calls} calls failed in {self.window_seconds:.0f}s")
+            elif slow / calls >= self.slow_call_rate:
+                self._open(
+                    now,
+                    f"{slow}/{calls} calls slower than {self.slow_call_seconds}s "
+                    f"in {self.window_seconds:.0f}s",
+                )
+
+    def stats(self) -> dict:
+        retry_after = self.retry_after()
+        with self._lock:
+            calls, failures, slow = self._window(time.monotonic())
+            return {
+                "state": self.state,
+                "calls": calls,
+                "failure_rate": round(failures / calls, 3) if calls else None,
+                "slow_rate": round(slow / calls, 3) if calls else None,
+                "trips": self.trips,
+                "rejected": self.rejected,
+                "retry_after_seconds": round(retry_after, 1) if retry_after else None,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def circuit_breaker(
+    name: str,
+    slow_call_seconds: float,
+    is_failure: Optional[Callable[[Exception], bool]] = None,
+) -> CircuitBreaker:
+    """The process-wide breaker called `name`, created on first use"""
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = _breakers[name] = CircuitBreaker(name, slow_call_seconds, is_failure)
+    return breaker
+
+
+def breaker_stats() -> dict:
+    return {name: breaker.stats() for name, breaker in sorted(_breakers.items())}
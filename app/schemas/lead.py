@@ -10,6 +10,8 @@ class ExtractedLeadData(BaseModel):
     budget_range: str | None = None
     commitment_level: int | None = None  # 1-10 scale
     availability: str | None = None
+    name: str | None = None  # Optional, only if volunteered
+    email: str | None = None  # Optional, used for the rejection email
     has_all_info: bool  # Ready to score?
 
 
@@ -0,0 +1,259 @@
+"""
+Full-text search indexes for messages and lead data.
+
+SQLite uses external-content FTS5 tables kept in sync by triggers;
+Postgres uses a generated `tsvector` column with a GIN index. Both expose
+the same API: a ranked hits subquery, a filter for arbitrary statements
+and highlighted snippets for the rows being displayed.
+"""
+
+import logging
+import re
+from typing import Dict, Iterable, List, Optional
+
+from markupsafe import Markup, escape
+from sqlalchemy import Select, column, func, literal_column, select, table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# Private-use markers around matches, swapped for <mark> after HTML escaping
+_MATCH_START = "\x02"
+_MATCH_END = "\x03"
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class FullTextIndex:
+    """Full-text index over one or more text columns of a table"""
+
+    def __init__(self, table_name: str, columns: List[str]):
+        self.table_name = table_name
+        self.columns = columns
+        self.fts_table = f"{table_name}_fts"
+        self.dialect: Optional[str] = None  # Set by install()
+
+    @property
+    def available(self) -> bool:
+        return self.dialect is not None
+
+    # Installation
+
+    def install(self, engine: Engine) -> None:
+        """Create the index and its sync triggers if they do not exist yet"""
+        dialect = engine.dialect.name
+        try:
+            with engine.begin() as conn:
+                if dialect == "sqlite":
+                    self._install_sqlite(conn)
+                elif dialect == "postgresql":
+                    self._install_postgres(conn)
+                else:
+                    logger.warning(
+                        f"Full-text search not supported on {dialect}, "
+                        f"{self.table_name} search uses LIKE"
+                    )
+                    return
+        except Exception as e:
+            logger.warning(
+                f"Could not install full-text index for {self.table_name}, "
+                f"falling back to LIKE: {e}"
+            )
+            return
+
+        self.dialect = dialect
+        logger.info(f"Full-text index ready for {self.table_name} ({dialect})")
+
+    def _install_sqlite(self, conn) -> None:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+            {"name": self.fts_table},
+        ).first()
+
+        cols = ", ".join(self.columns)
+        new_cols = ", ".join(f"new.{c}" for c in self.columns)
+        old_cols = ", ".join(f"old.{c}" for c in self.columns)
+
+        conn.execute(
+            text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.fts_table} USING fts5("
+                f"{cols}, content='{self.table_name}', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2')"
+            )
+        )
+        conn.execute(
+            text(
+                f"CREATE TRIGGER IF NOT EXISTS {self.fts_table}_ai "
+                f"AFTER INSERT ON {self.table_name} BEGIN "
+                f"INSERT INTO {self.fts_table}(rowid, {cols}) VALUES (new.id, {new_cols}); "
+                f"END"
+            )
+        )
+        conn.execute(
+            text(
+                f"CREATE TRIGGER IF NOT EXISTS {self.fts_table}_ad "
+                f"AFTER DELETE ON {self.table_name} BEGIN "
+                f"INSERT INTO {self.fts_table}({self.fts_table}, rowid, {cols}) "
+                f"VALUES ('delete', old.id, {old_cols}); "
+                f"END"
+            )
+        )
+        conn.execute(
+            text(
+                f"CREATE TRIGGER IF NOT EXISTS {self.fts_table}_au "
+                f"AFTER UPDATE OF {cols} ON {self.table_name} BEGIN "
+                f"INSERT INTO {self.fts_table}({self.fts_table}, rowid, {cols}) "
+                f"VALUES ('delete', old.id, {old_cols}); "
+                f"INSERT INTO {self.fts_table}(rowid, {cols}) VALUES (new.id, {new_cols}); "
+                f"END"
+            )
+        )
+
+        if not exists:
+            # Index rows written before the index existed
+            conn.execute(
+                text(f"INSERT INTO {self.fts_table}({self.fts_table}) VALUES ('rebuild')")
+            )
+            logger.info(f"Built full-text index {self.fts_table} from existing rows")
+
+    def _install_postgres(self, conn) -> None:
+        document = " || ' ' || ".join(f"coalesce({c}, '')" for c in self.columns)
+        conn.execute(
+            text(
+                f"ALTER TABLE {self.table_name} ADD COLUMN IF NOT EXISTS search_vector "
+                f"tsvector GENERATED ALWAYS AS (to_tsvector('english', {document})) STORED"
+            )
+        )
+        conn.execute(
+            text(
+                f"CREATE INDEX IF NOT EXISTS ix_{self.table_name}_search_vector "
+                f"ON {self.table_name} USING GIN (search_vector)"
+            )
+        )
+
+    # Queries
+
+    @staticmethod
+    def _fts5_query(term: str) -> str:
+        """
+        Turn free text into a safe FTS5 query: every word must match,
+        and the last word matches as a prefix so results appear while typing.
+        """
+        tokens = _TOKEN_RE.findall(term)
+        if not tokens:
+            return '""'
+        quoted = [f'"{token}"' for token in tokens]
+        quoted[-1] += "*"
+        return " ".join(quoted)
+
+    def hits(self, term: str):
+        """
+        Subquery of matching rows with columns `id` and `rank`.
+
+        Lower rank is more relevant on every backend.
+        """
+        if self.dialect == "sqlite":
+            fts = table(self.fts_table, column("rowid"), column(self.fts_table))
+            return (
+                select(
+                    fts.c.rowid.label("id"),
+                    func.bm25(literal_column(self.fts_table)).label("rank"),
+                )
+                .where(fts.c[self.fts_table].op("MATCH")(self._fts5_query(term)))
+                .subquery(f"{self.fts_table}_hits")
+            )
+
+        query = func.websearch_to_tsquery("english", term)
+        source = table(self.table_name, column("id"), column("search_vector"))
+        return (
+            select(
+                source.c.id.label("id"),
+                (-func.ts_rank_cd(source.c.search_vector, query)).label("rank"),
+            )
+            .where(source.c.search_vector.op("@@")(query))
+            .subquery(f"{self.table_name}_hits")
+        )
+
+    def filter(self, stmt: Select, pk_column, term: str) -> Select:
+        """Restrict a statement to rows matching the search term"""
+        hits = self.hits(term)
+        return stmt.where(pk_column.in_(select(hits.c.id)))
+
+    def snippets(
+        self,
+        session: Session,
+        term: str,
+        ids: Iterable[int],
+        column_name: Optional[str] = None,
+        tokens: int = 12,
+    ) -> Dict[int, Markup]:
+        """
+        Highlighted snippets for the given rows only, so snippet generation
+        cost scales with the page size rather than the number of matches.
+
+        Args:
+            session: Database session
+            term: Search term as typed by the user
+            ids: Primary keys of the rows to build snippets for
+            column_name: Indexed column to take the snippet from
+                (default: whichever column matched best)
+            tokens: Approximate snippet length in words
+        """
+        ids = list(ids)
+        if not ids:
+            return {}
+
+        if self.dialect == "sqlite":
+            column_index = self.columns.index(column_name) if column_name else -1
+            rows = session.execute(
+                text(
+                    f"SELECT rowid, snippet({self.fts_table}, {column_index}, "
+                    f":start, :end, '…', :tokens) "
+                    f"FROM {self.fts_table} WHERE {self.fts_table} MATCH :query "
+                    f"AND rowid IN ({', '.join(str(int(i)) for i in ids)})"
+                ),
+                {
+                    "start": _MATCH_START,
+                    "end": _MATCH_END,
+                    "tokens": tokens,
+                    "query": self._fts5_query(term),
+                },
+            )
+        else:
+            columns = [column_name] if column_name else self.columns
+            document = " || ' ' || ".join(f"coalesce({c}, '')" for c in columns)
+            rows = session.execute(
+                text(
+                    f"SELECT id, ts_headline('english', {document}, "
+                    f"websearch_to_tsquery('english', :query), :options) "
+                    f"FROM {self.table_name} WHERE id = ANY(:ids)"
+                ),
+                {
+                    "query": term,
+                    "ids": ids,
+                    "options": (
+                        f"StartSel={_MATCH_START}, StopSel={_MATCH_END}, "
+                        f"MaxWords={tokens}, MinWords={max(tokens // 2, 1)}"
+                    ),
+                },
+            )
+
+        return {row_id: _highlight(snippet or "") for row_id, snippet in rows}
+
+
+def _highlight(snippet: str) -> Markup:
+    """Escape snippet text and turn match markers into <mark> tags"""
+    escaped = str(escape(snippet))
+    return Markup(escaped.replace(_MATCH_START, "<mark>").replace(_MATCH_END, "</mark>"))
+
+
+# Indexes used by the admin views
+message_search_index = FullTextIndex("messages", ["content"])
+lead_search_index = FullTextIndex("lead_data", ["goals", "location"])
+
+
+def install_search_indexes(engine: Engine) -> None:
+    """Create full-text indexes (idempotent); called from init_db()"""
+    message_search_index.install(engine)
+    lead_search_index.install(engine)
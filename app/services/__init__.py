@@ -1,8 +1,9 @@
 from app.services.whatsapp import WhatsAppService, whatsapp_service
 from app.services.calendar import CalendarService, calendar_service
 from app.services.email import EmailService, email_service
+from app.services.outbox import OutboxService, outbox_service
 
 __all__ = [
-    "WhatsAppService", "CalendarService", "EmailService",
-    "whatsapp_service", "calendar_service", "email_service"
+    "WhatsAppService", "CalendarService", "EmailService", "OutboxService",
+    "whatsapp_service", "calendar_service", "email_service", "outbox_service"
 ]
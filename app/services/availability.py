@@ -0,0 +1,402 @@
+"""
+Calendar availability engine.
+
+Working time is laid out as a grid of fixed-length slots numbered
+consecutively across working days only (weekends and out-of-hours time
+have no index). Booked slots per PT are kept as a sorted list of slot
+indexes, and "next free slot at or after index i" is two binary searches:
+in a sorted list of distinct integers L, `L[q] - q` never decreases, so
+the end of the run of consecutive booked slots starting at i can be found
+by bisection, O(log n) in the number of booked slots once they are in a
+list.
+
+Two backends share that index:
+- InMemoryAvailability: process-local, guarded by a lock (tests, demos).
+  The list is kept in memory, so lookups are O(log n). Lapsed holds are
+  given back from a heap ordered by expiry before each operation.
+- DatabaseAvailability: booked_slots table with a unique (pt_id, slot_index)
+  constraint, so holds from concurrent workers cannot double-book. Each
+  lookup first reads the k booked slots inside the requested window, so it
+  costs O(k) rows; the window is a week or two of one PT's calendar, so k
+  stays in the tens.
+"""
+
+import bisect
+import heapq
+import logging
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.database import SessionLocal
+from app.models import BookedSlot
+
+logger = logging.getLogger(__name__)
+
+# Any Monday; slot indexes count working slots from this date
+_GRID_EPOCH = date(2024, 1, 1)
+
+
+@dataclass(frozen=True)
+class WorkingHours:
+    """Working days and hours, split into fixed-length slots"""
+
+    start_hour: int = 9
+    end_hour: int = 17
+    slot_minutes: int = 60
+    working_days: Tuple[int, ...] = (0, 1, 2, 3, 4)  # Monday=0
+
+    @property
+    def slots_per_day(self) -> int:
+        return (self.end_hour - self.start_hour) * 60 // self.slot_minutes
+
+    @property
+    def slots_per_week(self) -> int:
+        return self.slots_per_day * len(self.working_days)
+
+    def slot_index(self, moment: datetime) -> int:
+        """Index of the first slot starting at or after `moment`"""
+        days = (moment.date() - _GRID_EPOCH).days
+        weeks, weekday = divmod(days, 7)
+        minutes = (moment.hour - self.start_hour) * 60 + moment.minute
+        if moment.second or moment.microsecond:
+            minutes += 1
+
+        working_days = sorted(self.working_days)
+        day_rank = bisect.bisect_left(working_days, weekday)
+        if day_rank < len(working_days) and working_days[day_rank] == weekday:
+            if minutes <= 0:
+                slot = 0
+            else:
+                slot = -(-minutes // self.slot_minutes)  # ceil
+            if slot < self.slots_per_day:
+                return (weeks * len(working_days) + day_rank) * self.slots_per_day + slot
+            day_rank += 1  # Past today's last slot: next working day
+
+        return weeks * self.slots_per_week + day_rank * self.slots_per_day
+
+    def slot_start(self, index: int) -> datetime:
+        """Start time of the slot with the given index"""
+        weeks, rest = divmod(index, self.slots_per_week)
+        day_rank, slot = divmod(rest, self.slots_per_day)
+        day = _GRID_EPOCH + timedelta(days=weeks * 7 + sorted(self.working_days)[day_rank])
+        return datetime(day.year, day.month, day.day, self.start_hour) + timedelta(
+            minutes=slot * self.slot_minutes
+        )
+
+
+def next_free_index(booked: List[int], start: int) -> int:
+    """
+    First index >= start that is not in `booked` (sorted, distinct), in
+    O(log n) for a list already in memory.
+    """
+    p = bisect.bisect_left(booked, start)
+    if p == len(booked) or booked[p] != start:
+        return start
+    # booked[p:q] is the run start, start+1, ... exactly when
+    # booked[k] - k == start - p; find the first q where that breaks
+    lo, hi = p, len(booked)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        if booked[mid] - mid == start - p:
+            lo = mid + 1
+        else:
+            hi = mid
+    return start + (lo - p)
+
+
+def next_open_index(booked: List[int], busy: Sequence[int], start: int) -> int:
+    """
+    First index >= start in neither `booked` nor `busy` (both sorted,
+    distinct). Alternates between the two lists until both agree.
+    """
+    index = start
+    while True:
+        index = next_free_index(booked, index)
+        if not busy:
+            return index
+        free = next_free_index(busy, index)
+        if free == index:
+            return index
+        index = free
+
+
+class AvailabilityBackend:
+    """Interface for booked-slot storage"""
+
+    def __init__(self, hours: WorkingHours):
+        self.hours = hours
+
+    def find_free_slot(
+        self, pt_id: int, earliest: datetime, latest: datetime, busy: Sequence[int] = ()
+    ) -> Optional[datetime]:
+        """Next slot in [earliest, latest) not booked here or in `busy`"""
+        raise NotImplementedError
+
+    def hold(
+        self,
+        pt_id: int,
+        earliest: datetime,
+        latest: datetime,
+        hold_minutes: int,
+        lead_phone: Optional[str] = None,
+        conversation_id: Optional[int] = None,
+        busy: Sequence[int] = (),
+    ) -> Optional[datetime]:
+        """
+        Atomically find and hold the next free slot in [earliest, latest).
+        `busy` is a sorted list of slot indexes blocked elsewhere (e.g. the
+        PT's external calendar).
+        """
+        raise NotImplementedError
+
+    def confirm(
+        self,
+        pt_id: int,
+        slot_time: datetime,
+        meeting_link: str,
+        conversation_id: Optional[int] = None,
+    ) -> bool:
+        """
+        Turn this conversation's unexpired hold into a booking. False if the
+        hold expired or the slot is held or booked by someone else.
+        """
+        raise NotImplementedError
+
+    def release(self, pt_id: int, slot_time: datetime, conversation_id: Optional[int] = None) -> None:
+        """Free the slot if this conversation holds or booked it"""
+        raise NotImplementedError
+
+    def booked_by(self, pt_id: int, slot_time: datetime) -> Optional[int]:
+        """Conversation holding or booking the slot (None if free or unowned)"""
+        raise NotImplementedError
+
+    def _window(self, earliest: datetime, latest: datetime) -> Tuple[int, int]:
+        return self.hours.slot_index(earliest), self.hours.slot_index(latest)
+
+
+class InMemoryAvailability(AvailabilityBackend):
+    """Process-local availability; holds expire after hold_minutes"""
+
+    def __init__(self, hours: WorkingHours):
+        super().__init__(hours)
+        self._lock = threading.Lock()
+        self._booked: Dict[int, List[int]] = defaultdict(list)
+        # (pt_id, slot index) -> (conversation_id, status, hold expiry on the monotonic clock)
+        self._owners: Dict[Tuple[int, int], Tuple[Optional[int], str, Optional[float]]] = {}
+        # pt_id -> heap of (hold expiry, slot index)
+        self._expiring: Dict[int, List[Tuple[float, int]]] = defaultdict(list)
+
+    def _free(self, pt_id: int, index: int) -> None:
+        del self._owners[pt_id, index]
+        booked = self._booked[pt_id]
+        booked.pop(bisect.bisect_left(booked, index))
+
+    def _expire_holds(self, pt_id: int) -> None:
+        """Give back the slots of lapsed holds (call with the lock held)"""
+        now = time.monotonic()
+        expiring = self._expiring[pt_id]
+        while expiring and expiring[0][0] <= now:
+            expires_at, index = heapq.heappop(expiring)
+            owner = self._owners.get((pt_id, index))
+            # Skip holds since confirmed or released (and the slot perhaps held again)
+            if owner is not None and owner[1] == "held" and owner[2] == expires_at:
+                self._free(pt_id, index)
+
+    def find_free_slot(self, pt_id, earliest, latest, busy=()):
+        start, end = self._window(earliest, latest)
+        with self._lock:
+            self._expire_holds(pt_id)
+            index = next_open_index(self._booked[pt_id], busy, start)
+        return self.hours.slot_start(index) if index < end else None
+
+    def hold(self, pt_id, earliest, latest, hold_minutes, lead_phone=None, conversation_id=None, busy=()):
+        start, end = self._window(earliest, latest)
+        with self._lock:
+            self._expire_holds(pt_id)
+            booked = self._booked[pt_id]
+            index = next_open_index(booked, busy, start)
+            if index >= end:
+                return None
+            bisect.insort(booked, index)
+            expires_at = time.monotonic() + hold_minutes * 60
+            self._owners[pt_id, index] = (conversation_id, "held", expires_at)
+            heapq.heappush(self._expiring[pt_id], (expires_at, index))
+        return self.hours.slot_start(index)
+
+    def confirm(self, pt_id, slot_time, meeting_link, conversation_id=None):
+        key = (pt_id, self.hours.slot_index(slot_time))
+        with self._lock:
+            self._expire_holds(pt_id)
+            owner = self._owners.get(key)
+            if owner is None or owner[:2] != (conversation_id, "held"):
+                return False
+            self._owners[key] = (conversation_id, "booked", None)
+            return True
+
+    def release(self, pt_id, slot_time, conversation_id=None):
+        index = self.hours.slot_index(slot_time)
+        with self._lock:
+            owner = self._owners.get((pt_id, index))
+            if owner is None or owner[0] != conversation_id:
+                return
+            self._free(pt_id, index)
+
+    def booked_by(self, pt_id, slot_time):
+        with self._lock:
+            self._expire_holds(pt_id)
+            owner = self._owners.get((pt_id, self.hours.slot_index(slot_time)))
+        return owner[0] if owner is not None else None
+
+
+class DatabaseAvailability(AvailabilityBackend):
+    """
+    Availability stored in the booked_slots table.
+
+    Each lookup reads the booked slot indexes inside the requested window
+    (an index range scan on pt_id, slot_index, O(k) in the slots booked in
+    the window) and runs the same bisection as the in-memory backend. Holds rely on the unique constraint: if a
+    concurrent worker took the slot first, the insert fails and the next
+    free slot is tried.
+    """
+
+    def __init__(self, hours: WorkingHours, session_factory=SessionLocal, max_attempts: int = 20):
+        super().__init__(hours)
+        self._session_factory = session_factory
+        self.max_attempts = max_attempts
+
+    def _session(self):
+        return self._session_factory()
+
+    @staticmethod
+    def _active(now: datetime):
+        return or_(
+            BookedSlot.status == "booked",
+            BookedSlot.hold_expires_at.is_(None),
+            BookedSlot.hold_expires_at > now,
+        )
+
+    def _booked_indexes(self, db, pt_id: int, start: int, end: int) -> List[int]:
+        rows = db.execute(
+            select(BookedSlot.slot_index)
+            .where(
+                BookedSlot.pt_id == pt_id,
+                BookedSlot.slot_index >= start,
+                BookedSlot.slot_index < end,
+                self._active(datetime.now(timezone.utc)),
+            )
+            .order_by(BookedSlot.slot_index)
+        )
+        return [index for (index,) in rows]
+
+    def find_free_slot(self, pt_id, earliest, latest, busy=()):
+        start, end = self._window(earliest, latest)
+        db = self._session()
+        try:
+            index = next_open_index(self._booked_indexes(db, pt_id, start, end), busy, start)
+        finally:
+            db.close()
+        return self.hours.slot_start(index) if index < end else None
+
+    def hold(self, pt_id, earliest, latest, hold_minutes, lead_phone=None, conversation_id=None, busy=()):
+        start, end = self._window(earliest, latest)
+        now = datetime.now(timezone.utc)
+        db = self._session()
+        try:
+            # Expired holds give their slot back
+            db.execute(
+                delete(BookedSlot).where(
+                    BookedSlot.pt_id == pt_id,
+                    BookedSlot.status == "held",
+                    and_(
+                        BookedSlot.hold_expires_at.is_not(None),
+                        BookedSlot.hold_expires_at <= now,
+                    ),
+                )
+            )
+            db.commit()
+
+            booked = self._booked_indexes(db, pt_id, start, end)
+            for _ in range(self.max_attempts):
+                index = next_open_index(booked, busy, start)
+                if index >= end:
+                    return None
+
+                slot_start = self.hours.slot_start(index)
+                db.add(
+                    BookedSlot(
+                        pt_id=pt_id,
+                        slot_index=index,
+                        start_at=slot_start,
+                        end_at=slot_start + timedelta(minutes=self.hours.slot_minutes),
+                        status="held",
+                        hold_expires_at=now + timedelta(minutes=hold_minutes),
+                        lead_phone=lead_phone,
+                        conversation_id=conversation_id,
+                    )
+                )
+                try:
+                    db.commit()
+                    return slot_start
+                except IntegrityError:
+                    # Another worker held this slot first; skip it
+                    db.rollback()
+                    bisect.insort(booked, index)
+                    logger.info(f"Slot {slot_start} for PT {pt_id} taken concurrently, retrying")
+
+            logger.warning(f"Gave up holding a slot for PT {pt_id} after {self.max_attempts} conflicts")
+            return None
+        finally:
+            db.close()
+
+    def _owned(self, pt_id: int, slot_time: datetime, conversation_id: Optional[int]):
+        return and_(
+            BookedSlot.pt_id == pt_id,
+            BookedSlot.slot_index == self.hours.slot_index(slot_time),
+            BookedSlot.conversation_id == conversation_id,
+        )
+
+    def confirm(self, pt_id, slot_time, meeting_link, conversation_id=None):
+        db = self._session()
+        try:
+            # Only our own hold, and only while it lasts: once it expires the
+            # slot may have been held by another lead
+            confirmed = db.execute(
+                update(BookedSlot)
+                .where(
+                    self._owned(pt_id, slot_time, conversation_id),
+                    BookedSlot.status == "held",
+                    BookedSlot.hold_expires_at > datetime.now(timezone.utc),
+                )
+                .values(status="booked", hold_expires_at=None, meeting_link=meeting_link)
+            )
+            db.commit()
+            return confirmed.rowcount == 1
+        finally:
+            db.close()
+
+    def release(self, pt_id, slot_time, conversation_id=None):
+        db = self._session()
+        try:
+            db.execute(delete(BookedSlot).where(self._owned(pt_id, slot_time, conversation_id)))
+            db.commit()
+        finally:
+            db.close()
+
+    def booked_by(self, pt_id, slot_time):
+        db = self._session()
+        try:
+            return db.execute(
+                select(BookedSlot.conversation_id).where(
+                    BookedSlot.pt_id == pt_id,
+                    BookedSlot.slot_index == self.hours.slot_index(slot_time),
+                )
+            ).scalar_one_or_none()
+        finally:
+            db.close()
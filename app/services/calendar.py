@@ -1,52 +1,262 @@
 """Google Calendar integration service"""
-from datetime import datetime, timedelta
+from dataclasses import replace
+from datetime import datetime, timedelta, timezone
 import logging
 from typing import Optional
 
+from app.config import get_settings
+from app.database import SessionLocal
+from app.lazy import LazyObject
+from app.models import Conversation, Message
+from app.services.availability import (
+    AvailabilityBackend,
+    DatabaseAvailability,
+    InMemoryAvailability,
+    WorkingHours,
+)
+from app.resilience import circuit_breaker
+from app.services.calendar_provider import (
+    CalendarProvider,
+    GuardedCalendarProvider,
+    LocalCalendarProvider,
+    NewEvent,
+    SyncTokenExpired,
+)
+from app.services.freebusy import CalendarWriteQueue, FreeBusyCache
+from app.services.outbox import outbox_service
+from app.tenants import tenant_router
+
 logger = logging.getLogger(__name__)
 
+# An expired sync token is a normal answer, not a provider failure
+calendar_breaker = circuit_breaker(
+    "calendar",
+    slow_call_seconds=5.0,
+    is_failure=lambda error: not isinstance(error, SyncTokenExpired),
+)
+
+
+class SlotUnavailable(Exception):
+    """A held slot can no longer be booked: the hold expired or was taken"""
+
 
 class CalendarService:
     """Service for managing calendar bookings"""
 
-    def __init__(self):
-        # For demo purposes, we'll mock calendar functionality
-        # In production, this would use Google Calendar API
-        pass
+    def __init__(
+        self,
+        backend: Optional[AvailabilityBackend] = None,
+        provider: Optional[CalendarProvider] = None,
+    ):
+        self.settings = get_settings()
+        hours = WorkingHours(
+            start_hour=self.settings.calendar_work_start_hour,
+            end_hour=self.settings.calendar_work_end_hour,
+            slot_minutes=self.settings.calendar_slot_minutes,
+            working_days=tuple(
+                int(day) for day in self.settings.calendar_working_days.split(",")
+            ),
+        )
+        if backend is None:
+            if self.settings.calendar_backend == "memory":
+                backend = InMemoryAvailability(hours)
+            else:
+                backend = DatabaseAvailability(hours)
+        self.backend = backend
+
+        # External calendar: busy times are cached, bookings written in batches
+        if provider is None and self.settings.calendar_provider == "local":
+            provider = LocalCalendarProvider()
+        self.provider = provider
+        self.free_busy = None
+        self.writes = None
+        if provider is not None:
+            # Remote calls go through the calendar circuit breaker
+            provider = GuardedCalendarProvider(provider, calendar_breaker)
+            self.free_busy = FreeBusyCache(
+                provider, backend.hours, ttl_seconds=self.settings.calendar_freebusy_ttl_seconds
+            )
+            self.writes = CalendarWriteQueue(
+                provider,
+                batch_size=self.settings.calendar_write_batch_size,
+                flush_seconds=self.settings.calendar_write_flush_seconds,
+                on_conflict=self._on_conflict,
+            )
+
+    def _window(self, days_ahead: int) -> tuple[datetime, datetime]:
+        now = datetime.now()
+        earliest = now + timedelta(hours=self.settings.calendar_min_notice_hours)
+        return earliest, now + timedelta(days=days_ahead)
+
+    def _busy(self, pt_id: int, earliest: datetime, latest: datetime) -> list[int]:
+        """Slots taken in the PT's external calendar (cached)"""
+        if self.free_busy is None:
+            return []
+        try:
+            return self.free_busy.busy_slots(pt_id, earliest, latest)
+        except Exception as e:
+            # Calendar unavailable (or its circuit open): book against what we
+            # last knew; a clash is caught when the event is written
+            logger.warning(f"Using cached free/busy for PT {pt_id}: {e}")
+            return self.free_busy.cached_slots(pt_id)
+
+    def _on_conflict(self, pt_id: int, event: NewEvent) -> None:
+        """
+        The PT's calendar already had something at a time we booked.
+
+        The cached free/busy missed it, so it is re-read before the next
+        booking. The lead was told the slot already: the booking is released
+        and the lead moved to the next free slot (or told the PT will be in
+        touch), with the change saved to the conversation.
+        """
+        self.free_busy.invalidate(pt_id)
+        logger.error(
+            f"Booking at {event.start} for PT {pt_id} conflicts with their calendar: "
+            f"{event.summary} ({event.description.splitlines()[0]})"
+        )
+        conversation_id = self.backend.booked_by(pt_id, event.start)
+        if conversation_id is None:
+            return  # Released meanwhile
+        self.backend.release(pt_id, event.start, conversation_id)
+
+        db = SessionLocal()
+        try:
+            conversation = db.get(Conversation, conversation_id)
+            if conversation is None:
+                return
+            phone = conversation.phone_number
+
+            slot = None
+            try:
+                slot = self.reserve_next_available_slot(
+                    pt_id=pt_id, lead_phone=phone, conversation_id=conversation_id
+                )
+                if slot is not None:
+                    meeting_link = self.confirm_slot(slot, pt_id=pt_id, conversation_id=conversation_id)
+            except Exception as e:
+                logger.error(f"Could not re-book conversation {conversation_id}: {e}")
+                if slot is not None:
+                    self.release_slot(slot, pt_id=pt_id, conversation_id=conversation_id)
+                slot = None
 
-    def find_next_available_slot(self, days_ahead: int = 7) -> datetime:
+            previous = event.start.strftime("%A, %B %d at %I:%M %p")
+            if slot is None:
+                body = f"""Sorry, the {previous} slot for your free intro call has just been taken, and the calendar is fully booked for the next few days.
+
+I'll reach out personally to find a new time."""
+                logger.error(
+                    f"PT {pt_id}: lead {phone} (conversation {conversation_id}) lost their "
+                    f"{event.start} intro call and needs a new time arranged"
+                )
+            else:
+                body = f"""Sorry, the {previous} slot for your free intro call has just been taken.
+
+I've moved your call to {slot.strftime("%A, %B %d at %I:%M %p")} instead. Looking forward to speaking with you!"""
+                logger.warning(
+                    f"PT {pt_id}: moved conversation {conversation_id} from {event.start} to {slot}"
+                )
+
+            db.add(
+                Message(
+                    conversation_id=conversation_id,
+                    role="assistant",
+                    content=body,
+                    timestamp=datetime.now(timezone.utc),
+                )
+            )
+            db.commit()
+        finally:
+            db.close()
+
+        if slot is not None:
+            # Same attendee and goals, at the new time
+            details = event.description.rsplit("\n", 1)[0]
+            self.writes.put(
+                pt_id,
+                replace(
+                    event,
+                    start=slot,
+                    end=slot + (event.end - event.start),
+                    description=f"{details}\n{meeting_link}",
+                ),
+            )
+        outbox_service.enqueue(
+            phone, body, conversation_id=conversation_id, from_number=tenant_router.sender_for(pt_id)
+        )
+
+    def find_next_available_slot(self, days_ahead: int = 7, pt_id: int = 1) -> Optional[datetime]:
         """
-        Find next available 1-hour slot in PT's calendar
+        Find next free slot in PT's calendar within working hours
 
-        For demo: Returns next weekday at 10am
-        Production: Would query actual Google Calendar availability
+        Does not hold the slot; use reserve_next_available_slot() when
+        booking, so concurrent leads cannot be offered the same slot.
 
         Args:
             days_ahead: Number of days to look ahead
+            pt_id: PT whose calendar to search
 
         Returns:
-            datetime of available slot
+            datetime of available slot, or None if fully booked
         """
-        # Simple mock: find next weekday (Mon-Fri) at 10am
-        current_date = datetime.now()
-        next_date = current_date + timedelta(days=1)
+        earliest, latest = self._window(days_ahead)
+        available_slot = self.backend.find_free_slot(
+            pt_id, earliest, latest, busy=self._busy(pt_id, earliest, latest)
+        )
+
+        logger.info(f"Found available slot for PT {pt_id}: {available_slot}")
+        return available_slot
 
-        # Find next weekday
-        while next_date.weekday() >= 5:  # Saturday=5, Sunday=6
-            next_date += timedelta(days=1)
+    def reserve_next_available_slot(
+        self,
+        days_ahead: int = 7,
+        pt_id: int = 1,
+        lead_phone: Optional[str] = None,
+        conversation_id: Optional[int] = None,
+    ) -> Optional[datetime]:
+        """
+        Atomically find and hold the next free slot
 
-        # Set to 10am
-        available_slot = next_date.replace(hour=10, minute=0, second=0, microsecond=0)
+        The hold expires after CALENDAR_HOLD_MINUTES unless confirmed by
+        book_calendar_event().
 
-        logger.info(f"Found available slot: {available_slot}")
-        return available_slot
+        Args:
+            days_ahead: Number of days to look ahead
+            pt_id: PT whose calendar to book
+            lead_phone: Phone number of the lead
+            conversation_id: Conversation the hold is for
+
+        Returns:
+            datetime of held slot, or None if fully booked
+        """
+        earliest, latest = self._window(days_ahead)
+        slot = self.backend.hold(
+            pt_id,
+            earliest,
+            latest,
+            hold_minutes=self.settings.calendar_hold_minutes,
+            lead_phone=lead_phone,
+            conversation_id=conversation_id,
+            busy=self._busy(pt_id, earliest, latest),
+        )
+
+        logger.info(f"Held slot for PT {pt_id}: {slot}")
+        return slot
+
+    def release_slot(
+        self, slot_time: datetime, pt_id: int = 1, conversation_id: Optional[int] = None
+    ) -> None:
+        """Give back a slot held or booked for this conversation"""
+        self.backend.release(pt_id, slot_time, conversation_id)
+        logger.info(f"Released slot {slot_time} for PT {pt_id}")
 
     def book_calendar_event(
         self,
         slot_time: datetime,
         lead_name: str,
         lead_phone: str,
-        lead_goals: Optional[str] = None
+        lead_goals: Optional[str] = None,
+        pt_id: int = 1,
+        conversation_id: Optional[int] = None,
     ) -> str:
         """
         Create calendar event and return meeting link
@@ -54,31 +264,94 @@ class CalendarService:
         For demo: Returns mock Google Meet link
         Production: Would create actual Google Calendar event
 
+        Confirms the hold (confirm_slot) and queues the event for the PT's
+        calendar (write_calendar_event). Callers that must commit their own
+        writes first call the two steps separately.
+
         Args:
-            slot_time: DateTime for the appointment
+            slot_time: DateTime for the appointment (held beforehand)
             lead_name: Name of the lead
             lead_phone: Phone number of the lead
             lead_goals: Fitness goals (optional)
+            pt_id: PT whose calendar the slot is in
+            conversation_id: Conversation the slot was held for
 
         Returns:
             Meeting link or event details
+
+        Raises:
+            SlotUnavailable: the hold expired or the slot went to another lead
+        """
+        meeting_link = self.confirm_slot(slot_time, pt_id=pt_id, conversation_id=conversation_id)
+        self.write_calendar_event(slot_time, meeting_link, lead_name, lead_phone, lead_goals, pt_id=pt_id)
+        return meeting_link
+
+    def confirm_slot(
+        self, slot_time: datetime, pt_id: int = 1, conversation_id: Optional[int] = None
+    ) -> str:
         """
+        Turn the conversation's hold on `slot_time` into a booking; returns
+        the meeting link. Raises SlotUnavailable if the hold is gone.
+        """
+        # In production, this would create a real Google Calendar event
+        # and return the actual Google Meet link
+        mock_meet_link = f"https://meet.google.com/mock-{slot_time.strftime('%Y%m%d%H%M')}"
+
+        if not self.backend.confirm(pt_id, slot_time, mock_meet_link, conversation_id):
+            raise SlotUnavailable(
+                f"Hold on {slot_time} (PT {pt_id}) for conversation {conversation_id} "
+                "expired or was taken"
+            )
+        return mock_meet_link
+
+    def write_calendar_event(
+        self,
+        slot_time: datetime,
+        meeting_link: str,
+        lead_name: str,
+        lead_phone: str,
+        lead_goals: Optional[str] = None,
+        pt_id: int = 1,
+    ) -> None:
+        """Queue a confirmed booking for the PT's calendar"""
         # Mock calendar event creation
         event_details = {
             "time": slot_time,
-            "duration": "1 hour",
+            "duration": f"{self.settings.calendar_slot_minutes} minutes",
             "attendee": lead_name,
             "phone": lead_phone,
             "goals": lead_goals or "Not specified"
         }
 
-        # In production, this would create a real Google Calendar event
-        # and return the actual Google Meet link
-        mock_meet_link = f"https://meet.google.com/mock-{slot_time.strftime('%Y%m%d%H%M')}"
+        # Written to the PT's calendar in the next batch
+        if self.writes is not None:
+            self.writes.put(
+                pt_id,
+                NewEvent(
+                    start=slot_time,
+                    end=slot_time + timedelta(minutes=self.settings.calendar_slot_minutes),
+                    summary=f"Intro call: {lead_name}",
+                    description=f"Phone: {lead_phone}\nGoals: {event_details['goals']}\n{meeting_link}",
+                ),
+            )
 
-        logger.info(f"Created calendar event for {lead_name} at {slot_time}")
-        return mock_meet_link
+        logger.info(f"Created calendar event for {lead_name} at {slot_time}: {event_details}")
+
+    def shutdown(self) -> None:
+        """Write any bookings still queued for the provider"""
+        if self.writes is not None:
+            self.writes.stop()
+
+    def stats(self) -> dict:
+        """Free/busy cache and batched write stats"""
+        if self.free_busy is None:
+            return {"provider": None}
+        return {
+            "provider": type(self.provider).__name__,
+            "free_busy": self.free_busy.stats(),
+            "writes": self.writes.stats(),
+        }
 
 
-# Singleton instance
-calendar_service = CalendarService()
+# Singleton instance, created on first use
+calendar_service = LazyObject(CalendarService)
@@ -0,0 +1,207 @@
+"""
+Calendar providers: where a PT's busy times and booked events live.
+
+The interface mirrors what remote calendars (e.g. Google Calendar) offer:
+a free/busy read for a window that returns a sync token, an incremental
+"changes since token" read, and batched event inserts. LocalCalendarProvider
+implements it in memory so the cache and batching can be exercised offline.
+"""
+
+import itertools
+import logging
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.resilience import CircuitBreaker
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class BusyEvent:
+    """A busy interval in a PT's calendar"""
+
+    id: str
+    start: datetime
+    end: datetime
+
+
+@dataclass
+class FreeBusy:
+    """Busy events in a window, plus the token to sync changes from"""
+
+    events: List[BusyEvent]
+    sync_token: str
+
+
+@dataclass
+class CalendarChanges:
+    """Events added and removed since a sync token"""
+
+    added: List[BusyEvent] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+    sync_token: str = ""
+
+
+@dataclass
+class NewEvent:
+    """An event to create in a PT's calendar"""
+
+    start: datetime
+    end: datetime
+    summary: str
+    description: str = ""
+
+
+@dataclass
+class InsertResult:
+    """Outcome of inserting one event; conflict means the time was taken"""
+
+    event: NewEvent
+    event_id: Optional[str] = None
+    conflict: bool = False
+
+
+class SyncTokenExpired(Exception):
+    """The sync token is too old; a full free/busy read is needed"""
+
+
+class CalendarProvider:
+    """Interface for a PT calendar backend"""
+
+    def free_busy(self, pt_id: int, start: datetime, end: datetime) -> FreeBusy:
+        raise NotImplementedError
+
+    def changes(self, pt_id: int, sync_token: str) -> CalendarChanges:
+        """Changes since `sync_token`; raises SyncTokenExpired if unknown"""
+        raise NotImplementedError
+
+    def insert_events(self, pt_id: int, events: List[NewEvent]) -> List[InsertResult]:
+        """Create several events in one round trip"""
+        raise NotImplementedError
+
+
+class LocalCalendarProvider(CalendarProvider):
+    """
+    In-memory calendar for offline testing and demos.
+
+    Keeps a bounded change log per PT so sync tokens behave like a remote
+    calendar's (old tokens expire). `latency_seconds` simulates the round
+    trip of a remote call, and `calls` counts requests by kind.
+    """
+
+    def __init__(self, latency_seconds: float = 0.0, max_changes: int = 1000):
+        self.latency_seconds = latency_seconds
+        self.max_changes = max_changes
+        self.calls: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+        self._events: Dict[int, Dict[str, BusyEvent]] = defaultdict(dict)
+        # Per PT: (sequence, event or None for removal, event id)
+        self._log: Dict[int, List[Tuple[int, Optional[BusyEvent], str]]] = defaultdict(list)
+        self._seq: Dict[int, int] = defaultdict(int)
+
+    def _round_trip(self, kind: str):
+        self.calls[kind] += 1
+        if self.latency_seconds:
+            time.sleep(self.latency_seconds)
+
+    def _record(self, pt_id: int, event_id: str, event: Optional[BusyEvent]):
+        self._seq[pt_id] += 1
+        log = self._log[pt_id]
+        log.append((self._seq[pt_id], event, event_id))
+        if len(log) > self.max_changes:
+            del log[: len(log) - self.max_changes]
+
+    def _token(self, pt_id: int) -> str:
+        return f"{pt_id}:{self._seq[pt_id]}"
+
+    def add_event(self, pt_id: int, start: datetime, end: datetime) -> str:
+        """Mark time busy directly (as if the PT added it to their calendar)"""
+        with self._lock:
+            event = BusyEvent(id=f"local-{next(self._ids)}", start=start, end=end)
+            self._events[pt_id][event.id] = event
+            self._record(pt_id, event.id, event)
+            return event.id
+
+    def remove_event(self, pt_id: int, event_id: str) -> None:
+        with self._lock:
+            if self._events[pt_id].pop(event_id, None) is not None:
+                self._record(pt_id, event_id, None)
+
+    def free_busy(self, pt_id, start, end):
+        self._round_trip("free_busy")
+        with self._lock:
+            events = [
+                event
+                for event in self._events[pt_id].values()
+                if event.start < end and event.end > start
+            ]
+            return FreeBusy(events=events, sync_token=self._token(pt_id))
+
+    def changes(self, pt_id, sync_token):
+        self._round_trip("changes")
+        with self._lock:
+            token_pt, _, token_seq = sync_token.partition(":")
+            if token_pt != str(pt_id) or not token_seq.isdigit():
+                raise SyncTokenExpired(sync_token)
+            since = int(token_seq)
+            log = self._log[pt_id]
+            if since < self._seq[pt_id] and (not log or log[0][0] > since + 1):
+                raise SyncTokenExpired(sync_token)
+
+            changes = CalendarChanges(sync_token=self._token(pt_id))
+            for seq, event, event_id in log:
+                if seq <= since:
+                    continue
+                if event is None:
+                    changes.removed.append(event_id)
+                else:
+                    changes.added.append(event)
+            return changes
+
+    def insert_events(self, pt_id, events):
+        self._round_trip("insert_events")
+        results = []
+        with self._lock:
+            for new in events:
+                taken = any(
+                    busy.start < new.end and busy.end > new.start
+                    for busy in self._events[pt_id].values()
+                )
+                if taken:
+                    results.append(InsertResult(event=new, conflict=True))
+                    continue
+                event = BusyEvent(id=f"local-{next(self._ids)}", start=new.start, end=new.end)
+                self._events[pt_id][event.id] = event
+                self._record(pt_id, event.id, event)
+                results.append(InsertResult(event=new, event_id=event.id))
+        return results
+
+
+class GuardedCalendarProvider(CalendarProvider):
+    """
+    Wraps a provider so every remote call goes through a circuit breaker.
+
+    While the breaker is open, calls raise CircuitOpen straight away.
+    """
+
+    def __init__(self, provider: CalendarProvider, breaker: CircuitBreaker):
+        self.provider = provider
+        self.breaker = breaker
+
+    def free_busy(self, pt_id, start, end):
+        with self.breaker.guard():
+            return self.provider.free_busy(pt_id, start, end)
+
+    def changes(self, pt_id, sync_token):
+        with self.breaker.guard():
+            return self.provider.changes(pt_id, sync_token)
+
+    def insert_events(self, pt_id, events):
+        with self.breaker.guard():
+            return self.provider.insert_events(pt_id, events)
@@ -1,63 +1,461 @@
-"""Email service for sending rejection emails (optional)"""
+"""
+Email service for sending rejection emails (optional)
+
+Queueing a rejection email writes a pending EmailDelivery row and hands
+its id to a small pool of async workers started with the app, so queueing
+one never adds latency to the WhatsApp turn. Each worker claims a batch,
+renders it with PromptManager.get_rejection_email, sends it over its own
+long-lived connection (SMTP or the SendGrid HTTP API) and records the
+outcome on the same rows. EMAIL_CONCURRENCY workers bound the number of
+connections.
+
+Pending rows are queued again when the service starts, so emails survive
+a restart or crash. As in the outbox, each row is claimed with a
+conditional UPDATE before it is sent, so several processes can share the
+table; a claim left by a process that died is released after
+EMAIL_CLAIM_TIMEOUT_SECONDS and the email is sent again (at-least-once).
+"""
+import asyncio
 import logging
-from typing import Optional
+import smtplib
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from email.utils import make_msgid
+from typing import List, Optional, Tuple
+
+from sqlalchemy import select, update
+
+from app.config import get_settings
+from app.database import SessionLocal
+from app.lazy import LazyObject
+from app.models import Conversation, EmailDelivery, LeadData, PTPreferences
+from app.prompts.manager import PromptManager
 
 logger = logging.getLogger(__name__)
 
+# (provider message id, error) per email
+SendResult = Tuple[Optional[str], Optional[str]]
+
+
+@dataclass
+class OutgoingEmail:
+    """A rendered email for one lead"""
+
+    conversation_id: int
+    to_email: str
+    subject: str
+    body: str
+    kind: str = "rejection"
+    delivery_id: Optional[int] = None
+
+
+class EmailTransport:
+    """Sends batches of emails over a connection reused between batches"""
+
+    name = "log"
+
+    def __init__(self, from_email: str):
+        self.from_email = from_email
+
+    def _message(self, email: OutgoingEmail) -> EmailMessage:
+        message = EmailMessage()
+        message["From"] = self.from_email
+        message["To"] = email.to_email
+        message["Subject"] = email.subject
+        message["Message-ID"] = make_msgid()
+        message.set_content(email.body)
+        return message
+
+    def send_batch(self, emails: List[OutgoingEmail]) -> List[SendResult]:
+        # For demo, just log
+        for email in emails:
+            logger.info(f"Would send {email.kind} email to {email.to_email}:\n{email.body}")
+        return [(None, None) for _ in emails]
+
+    def close(self) -> None:
+        pass
+
+
+class SMTPTransport(EmailTransport):
+    """SMTP with one persistent connection, reconnecting when dropped"""
+
+    name = "smtp"
+
+    def __init__(self, from_email: str, host: str, port: int, username: str = "",
+                 password: str = "", starttls: bool = False, timeout: float = 30.0):
+        super().__init__(from_email)
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.starttls = starttls
+        self.timeout = timeout
+        self._smtp: Optional[smtplib.SMTP] = None
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=self.timeout)
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            self._smtp = smtp
+        return self._smtp
+
+    def _send(self, message: EmailMessage) -> None:
+        try:
+            self._connection().send_message(message)
+        except smtplib.SMTPServerDisconnected:
+            # Idle connection closed by the server; reconnect once
+            self._smtp = None
+            self._connection().send_message(message)
+
+    def send_batch(self, emails):
+        results = []
+        for email in emails:
+            message = self._message(email)
+            try:
+                self._send(message)
+                results.append((message["Message-ID"], None))
+            except (smtplib.SMTPException, OSError) as e:
+                if not isinstance(e, smtplib.SMTPRecipientsRefused):
+                    self.close()
+                results.append((None, str(e)))
+        return results
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+
+class SendGridTransport(EmailTransport):
+    """SendGrid v3 API over a keep-alive HTTP connection pool"""
+
+    name = "sendgrid"
+    url = "https://api.sendgrid.com/v3/mail/send"
+
+    def __init__(self, from_email: str, api_key: str, timeout: float = 30.0):
+        super().__init__(from_email)
+        import httpx
+
+        self._http_error = httpx.HTTPError
+        self._client = httpx.Client(
+            headers={"Authorization": f"Bearer {api_key}"}, timeout=timeout
+        )
+
+    def send_batch(self, emails):
+        results = []
+        for email in emails:
+            try:
+                response = self._client.post(
+                    self.url,
+                    json={
+                        "personalizations": [{"to": [{"email": email.to_email}]}],
+                        "from": {"email": self.from_email},
+                        "subject": email.subject,
+                        "content": [{"type": "text/plain", "value": email.body}],
+                    },
+                )
+                response.raise_for_status()
+                results.append((response.headers.get("X-Message-Id"), None))
+            except self._http_error as e:
+                results.append((None, str(e)))
+        return results
+
+    def close(self):
+        self._client.close()
+
 
 class EmailService:
-    """Service for sending emails via SendGrid"""
+    """Service for queueing and delivering lead emails"""
 
     def __init__(self):
-        # For demo purposes, email is optional
-        # In production, this would use SendGrid API
-        pass
+        self.settings = get_settings()
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._workers: List[asyncio.Task] = []
+        self.queued = 0
+        self.sent = 0
+        self.failed = 0
+        self.skipped = 0
+        self.dropped = 0
+
+    def _transport(self) -> EmailTransport:
+        from_email = self.settings.rejection_email_from
+        if self.settings.email_transport == "smtp":
+            return SMTPTransport(
+                from_email,
+                self.settings.email_smtp_host,
+                self.settings.email_smtp_port,
+                self.settings.email_smtp_username,
+                self.settings.email_smtp_password,
+                self.settings.email_smtp_starttls,
+            )
+        if self.settings.email_transport == "sendgrid":
+            return SendGridTransport(from_email, self.settings.sendgrid_api_key)
+        return EmailTransport(from_email)
+
+    # Lifecycle
+
+    def start(self) -> None:
+        """Start the delivery workers on the running event loop"""
+        if self._workers:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue(maxsize=self.settings.email_queue_size)
+        for delivery_id in self._recover_pending():
+            if not self._put(delivery_id):
+                break  # The rest stay pending until the next start
+        self._workers = [
+            self._loop.create_task(self._worker(), name=f"email-{n}")
+            for n in range(self.settings.email_concurrency)
+        ]
 
-    def send_rejection_email(
-        self,
-        to_email: str,
-        name: str,
-        reason: Optional[str] = None
-    ) -> bool:
+    def _recover_pending(self) -> List[int]:
+        """Release stale claims and return the ids of emails not yet sent"""
+        db = SessionLocal()
+        try:
+            stale = datetime.now(timezone.utc) - timedelta(
+                seconds=self.settings.email_claim_timeout_seconds
+            )
+            released = db.execute(
+                update(EmailDelivery)
+                .where(EmailDelivery.status == "sending", EmailDelivery.claimed_at <= stale)
+                .values(status="pending", claimed_at=None)
+            )
+            db.commit()
+            if released.rowcount:
+                logger.warning(f"Requeued {released.rowcount} interrupted rejection emails")
+            pending = list(
+                db.execute(
+                    select(EmailDelivery.id)
+                    .where(EmailDelivery.status == "pending")
+                    .order_by(EmailDelivery.id)
+                    .limit(self.settings.email_queue_size)
+                ).scalars()
+            )
+            if pending:
+                logger.info(f"Queued {len(pending)} rejection emails left unsent")
+            return pending
+        finally:
+            db.close()
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Send what is queued (up to `timeout` seconds), then stop"""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Stopping with {self._queue.qsize()} rejection emails unsent")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    # Queueing
+
+    def queue_rejection_email(self, conversation_id: int) -> bool:
         """
-        Send polite rejection email with alternative resources
+        Queue a rejection email for a lead; returns immediately
 
-        For demo: Just logs the email that would be sent
-        Production: Would send actual email via SendGrid
+        The email is stored as pending, then rendered and sent in the
+        background. Leads without an email address are skipped.
 
         Args:
-            to_email: Recipient email address
-            name: Recipient name
-            reason: Optional reason for rejection
+            conversation_id: Conversation of the rejected lead
 
         Returns:
-            True if sent successfully
+            True if queued
         """
-        email_content = f"""
-        Dear {name},
+        delivery_id = self._persist(conversation_id)
+        if delivery_id is None:
+            return False
+        if self._queue is None:
+            logger.warning(
+                f"Email workers not running; rejection email for {conversation_id} "
+                "is sent when they start"
+            )
+            return True
 
-        Thank you for your interest in personal training with us.
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is not self._loop:
+            self._loop.call_soon_threadsafe(self._put, delivery_id)
+            return True
+        return self._put(delivery_id)
 
-        After reviewing your requirements, we think there might be better options
-        that align more closely with your current goals and budget.
+    def _persist(self, conversation_id: int) -> Optional[int]:
+        """Write the pending row; returns its id, or None without an address"""
+        db = SessionLocal()
+        try:
+            to_email = db.execute(
+                select(LeadData.email).where(LeadData.conversation_id == conversation_id)
+            ).scalar()
+            if not to_email:
+                self.skipped += 1
+                logger.info(f"No email address for conversation {conversation_id}")
+                return None
+            delivery = EmailDelivery(
+                conversation_id=conversation_id,
+                kind="rejection",
+                to_email=to_email,
+                subject="",
+                transport=self.settings.email_transport,
+                status="pending",
+            )
+            db.add(delivery)
+            db.commit()
+            return delivery.id
+        finally:
+            db.close()
 
-        We recommend:
-        - Local gym memberships with group classes
-        - Online fitness programs
-        - Community fitness groups in your area
+    def _put(self, delivery_id: int) -> bool:
+        try:
+            self._queue.put_nowait(delivery_id)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.error(
+                f"Email queue full; rejection email {delivery_id} stays pending until restart"
+            )
+            return False
+        self.queued += 1
+        return True
 
-        We wish you all the best on your fitness journey!
+    # Delivery
 
-        Best regards,
-        The PT Team
-        """
+    async def _worker(self):
+        transport = self._transport()
+        try:
+            while True:
+                batch = [await self._queue.get()]
+                while len(batch) < self.settings.email_batch_size and not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                try:
+                    claimed = await asyncio.to_thread(self._claim, batch)
+                    emails = await asyncio.to_thread(self._render, claimed) if claimed else []
+                    if emails:
+                        results = await asyncio.to_thread(transport.send_batch, emails)
+                        await asyncio.to_thread(self._record, transport.name, emails, results)
+                except Exception as e:
+                    # Left claimed, so sent again once the claim goes stale
+                    self.failed += len(batch)
+                    logger.error(f"Rejection email batch failed: {e}")
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+        finally:
+            await asyncio.to_thread(transport.close)
 
-        # For demo, just log
-        logger.info(f"Would send rejection email to {to_email}:\n{email_content}")
+    def _claim(self, delivery_ids: List[int]) -> List[int]:
+        """Claim pending rows; another process may have got there first"""
+        now = datetime.now(timezone.utc)
+        db = SessionLocal()
+        try:
+            claimed = []
+            for delivery_id in delivery_ids:
+                result = db.execute(
+                    update(EmailDelivery)
+                    .where(EmailDelivery.id == delivery_id, EmailDelivery.status == "pending")
+                    .values(status="sending", claimed_at=now)
+                )
+                if result.rowcount == 1:
+                    claimed.append(delivery_id)
+            db.commit()
+            return claimed
+        finally:
+            db.close()
 
-        # In production, send actual email via SendGrid
-        return True
+    def _render(self, delivery_ids: List[int]) -> List[OutgoingEmail]:
+        db = SessionLocal()
+        try:
+            rows = db.query(EmailDelivery, LeadData, PTPreferences).join(
+                LeadData, LeadData.conversation_id == EmailDelivery.conversation_id
+            ).join(
+                Conversation, Conversation.id == LeadData.conversation_id
+            ).join(
+                PTPreferences, PTPreferences.id == Conversation.pt_id
+            ).filter(EmailDelivery.id.in_(delivery_ids)).all()
+
+            emails = []
+            for delivery, lead, pt in rows:
+                text = PromptManager(pt).get_rejection_email(lead_name=lead.name or "there")
+                subject = f"Thank you for your interest - {pt.name}"
+                if text.startswith("Subject:"):
+                    first_line, _, text = text.partition("\n")
+                    subject = first_line[len("Subject:"):].strip()
+                emails.append(
+                    OutgoingEmail(
+                        conversation_id=lead.conversation_id,
+                        to_email=delivery.to_email,
+                        subject=subject,
+                        body=text.strip(),
+                        kind=delivery.kind,
+                        delivery_id=delivery.id,
+                    )
+                )
+
+            # The lead was cleared since the email was queued
+            rendered = {email.delivery_id for email in emails}
+            gone = [delivery_id for delivery_id in delivery_ids if delivery_id not in rendered]
+            if gone:
+                db.execute(
+                    update(EmailDelivery)
+                    .where(EmailDelivery.id.in_(gone))
+                    .values(status="skipped", error="Lead no longer exists")
+                )
+                db.commit()
+                self.skipped += len(gone)
+            return emails
+        finally:
+            db.close()
+
+    def _record(self, transport: str, emails: List[OutgoingEmail], results: List[SendResult]):
+        now = datetime.now(timezone.utc)
+        db = SessionLocal()
+        try:
+            for email, (message_id, error) in zip(emails, results):
+                db.execute(
+                    update(EmailDelivery)
+                    .where(EmailDelivery.id == email.delivery_id)
+                    .values(
+                        subject=email.subject,
+                        transport=transport,
+                        status="failed" if error else "sent",
+                        error=error,
+                        provider_message_id=message_id,
+                        sent_at=None if error else now,
+                    )
+                )
+                if error:
+                    self.failed += 1
+                    logger.error(f"Rejection email to {email.to_email} failed: {error}")
+                else:
+                    self.sent += 1
+            db.commit()
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        """Email pipeline counters for /health"""
+        return {
+            "transport": self.settings.email_transport,
+            "running": bool(self._workers),
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "queued": self.queued,
+            "sent": self.sent,
+            "failed": self.failed,
+            "skipped": self.skipped,
+            "dropped": self.dropped,
+        }
 
 
-# Singleton instance
-email_service = EmailService()
+# Singleton instance, created on first use
+email_service = LazyObject(EmailService)
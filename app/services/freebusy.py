@@ -0,0 +1,288 @@
+"""
+Free/busy caching and batched event writes for calendar providers.
+
+FreeBusyCache keeps each PT's busy times as slot indexes on the
+availability grid. Within the TTL they are served from memory; after it, the
+entry is brought up to date with the provider's sync token (only changes
+are fetched) and falls back to a full read if the token has expired.
+invalidate() forces a full read, e.g. after a booking conflicts.
+
+CalendarWriteQueue buffers confirmed bookings and writes them to the
+provider in batches from a background thread, so booking a lead never waits
+on the provider.
+"""
+
+import logging
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app.services.availability import WorkingHours
+from app.services.calendar_provider import (
+    BusyEvent,
+    CalendarProvider,
+    NewEvent,
+    SyncTokenExpired,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class _CacheEntry:
+    window_start: datetime
+    window_end: datetime
+    events: Dict[str, BusyEvent]
+    blocked: List[int]
+    sync_token: str
+    synced_at: float
+
+
+class FreeBusyCache:
+    """Per-PT free/busy cache with TTL and incremental sync"""
+
+    def __init__(
+        self,
+        provider: CalendarProvider,
+        hours: WorkingHours,
+        ttl_seconds: float = 300.0,
+        min_window_days: int = 14,
+    ):
+        self.provider = provider
+        self.hours = hours
+        self.ttl_seconds = ttl_seconds
+        self.min_window_days = min_window_days
+        # _lock guards the entries and counters; a PT's own lock is held
+        # while its provider calls run, so a slow calendar only delays
+        # lookups for that PT
+        self._lock = threading.Lock()
+        self._pt_locks: Dict[int, threading.Lock] = {}
+        self._entries: Dict[int, _CacheEntry] = {}
+        self.hits = 0
+        self.incremental_syncs = 0
+        self.full_refreshes = 0
+        self.forced_refreshes = 0
+
+    def _blocked(self, events) -> List[int]:
+        """Slot indexes overlapping any busy event"""
+        slot = timedelta(minutes=self.hours.slot_minutes)
+        blocked = set()
+        for event in events:
+            # First slot ending after the event starts, up to the first
+            # slot starting at or after it ends
+            first = self.hours.slot_index(event.start - slot + timedelta(microseconds=1))
+            blocked.update(range(first, self.hours.slot_index(event.end)))
+        return sorted(blocked)
+
+    def _full_read(self, pt_id: int, start: datetime, end: datetime) -> _CacheEntry:
+        window_end = max(end, start + timedelta(days=self.min_window_days))
+        free_busy = self.provider.free_busy(pt_id, start, window_end)
+        events = {event.id: event for event in free_busy.events}
+        return _CacheEntry(
+            window_start=start,
+            window_end=window_end,
+            events=events,
+            blocked=self._blocked(events.values()),
+            sync_token=free_busy.sync_token,
+            synced_at=time.monotonic(),
+        )
+
+    def _sync(self, pt_id: int, entry: _CacheEntry) -> None:
+        changes = self.provider.changes(pt_id, entry.sync_token)
+        for event_id in changes.removed:
+            entry.events.pop(event_id, None)
+        for event in changes.added:
+            if event.start < entry.window_end and event.end > entry.window_start:
+                entry.events[event.id] = event
+        if changes.added or changes.removed:
+            entry.blocked = self._blocked(entry.events.values())
+        entry.sync_token = changes.sync_token
+        entry.synced_at = time.monotonic()
+
+    def _pt_lock(self, pt_id: int) -> threading.Lock:
+        with self._lock:
+            lock = self._pt_locks.get(pt_id)
+            if lock is None:
+                lock = self._pt_locks[pt_id] = threading.Lock()
+            return lock
+
+    def busy_slots(self, pt_id: int, start: datetime, end: datetime) -> List[int]:
+        """Sorted slot indexes the PT is busy for in [start, end)"""
+        # Concurrent lookups for one PT wait for a single provider call;
+        # other PTs are not held up by it
+        with self._pt_lock(pt_id):
+            with self._lock:
+                entry = self._entries.get(pt_id)
+                covered = (
+                    entry is not None
+                    and entry.window_start <= start
+                    and end <= entry.window_end
+                )
+                if covered and time.monotonic() - entry.synced_at <= self.ttl_seconds:
+                    self.hits += 1
+                    return entry.blocked
+
+            if covered:
+                try:
+                    self._sync(pt_id, entry)
+                    with self._lock:
+                        self.incremental_syncs += 1
+                    return entry.blocked
+                except SyncTokenExpired:
+                    logger.info(f"Sync token for PT {pt_id} expired, re-reading free/busy")
+
+            entry = self._full_read(pt_id, start, end)
+            with self._lock:
+                self._entries[pt_id] = entry
+                self.full_refreshes += 1
+            return entry.blocked
+
+    def cached_slots(self, pt_id: int) -> List[int]:
+        """Last known busy slots, however stale, without calling the provider"""
+        with self._lock:
+            entry = self._entries.get(pt_id)
+            return entry.blocked if entry is not None else []
+
+    def invalidate(self, pt_id: int) -> None:
+        """Drop a PT's entry so the next lookup re-reads the provider"""
+        with self._lock:
+            if self._entries.pop(pt_id, None) is not None:
+                self.forced_refreshes += 1
+
+    def stats(self) -> dict:
+        """Hit rate and per-PT staleness (seconds since last sync)"""
+        now = time.monotonic()
+        with self._lock:
+            lookups = self.hits + self.incremental_syncs + self.full_refreshes
+            staleness = {
+                str(pt_id): round(now - entry.synced_at, 1)
+                for pt_id, entry in self._entries.items()
+            }
+        return {
+            "lookups": lookups,
+            "hits": self.hits,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            "incremental_syncs": self.incremental_syncs,
+            "full_refreshes": self.full_refreshes,
+            "forced_refreshes": self.forced_refreshes,
+            "staleness_seconds": staleness,
+            "max_staleness_seconds": max(staleness.values(), default=None),
+        }
+
+
+class CalendarWriteQueue:
+    """
+    Buffer new events and insert them into the provider in batches.
+
+    A batch is written once `batch_size` events are queued or every
+    `flush_seconds`, whichever comes first. `on_conflict(pt_id, event)` is
+    called for events the provider rejected because the time was taken.
+    Failed batches are re-queued.
+    """
+
+    def __init__(
+        self,
+        provider: CalendarProvider,
+        batch_size: int = 20,
+        flush_seconds: float = 5.0,
+        on_conflict: Optional[Callable[[int, NewEvent], None]] = None,
+    ):
+        self.provider = provider
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.on_conflict = on_conflict
+        self._lock = threading.Lock()
+        self._pending: List[Tuple[int, NewEvent]] = []
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self.batches = 0
+        self.written = 0
+        self.conflicts = 0
+        self.failures = 0
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="calendar-writes", daemon=True
+            )
+            self._thread.start()
+
+    def put(self, pt_id: int, event: NewEvent) -> None:
+        with self._lock:
+            self._pending.append((pt_id, event))
+            full = len(self._pending) >= self.batch_size
+            self._ensure_thread()
+        if full:
+            self._wake.set()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.flush_seconds)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """Write everything queued so far"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        by_pt: Dict[int, List[NewEvent]] = defaultdict(list)
+        for pt_id, event in pending:
+            by_pt[pt_id].append(event)
+
+        for pt_id, events in by_pt.items():
+            for offset in range(0, len(events), self.batch_size):
+                batch = events[offset : offset + self.batch_size]
+                try:
+                    results = self.provider.insert_events(pt_id, batch)
+                except Exception as e:
+                    self.failures += 1
+                    logger.error(f"Calendar batch write for PT {pt_id} failed: {e}")
+                    with self._lock:
+                        self._pending[:0] = [(pt_id, event) for event in batch]
+                    continue
+
+                self.batches += 1
+                for result in results:
+                    if result.conflict:
+                        self.conflicts += 1
+                        logger.warning(
+                            f"Calendar conflict for PT {pt_id} at {result.event.start}: "
+                            f"{result.event.summary}"
+                        )
+                        if self.on_conflict:
+                            try:
+                                self.on_conflict(pt_id, result.event)
+                            except Exception as e:
+                                logger.error(
+                                    f"Handling the calendar conflict for PT {pt_id} failed: {e}"
+                                )
+                    else:
+                        self.written += 1
+
+    def stop(self) -> None:
+        """Stop the background thread and write what is left"""
+        self._stopped.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.flush_seconds + 5)
+            self._thread = None
+        self.flush()
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "batches": self.batches,
+            "written": self.written,
+            "conflicts": self.conflicts,
+            "failures": self.failures,
+        }
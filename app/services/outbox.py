@@ -0,0 +1,415 @@
+"""
+Outbound WhatsApp scheduler.
+
+Every outbound message is written to the outbound_messages table (the
+outbox) and sent by a background task started with the app, so pending
+sends survive restarts. The scheduler:
+
+- paces sends with token buckets per sender number and per recipient
+- sends one message at a time per recipient, oldest first, so replies in a
+  conversation arrive in order (a message waiting on a retry holds back the
+  ones behind it)
+- retries 429s, 5xx responses and network errors with exponential backoff
+  and full jitter; other errors fail the message straight away
+- holds everything, without using up attempts, while the Twilio circuit
+  breaker is open
+
+Each message is claimed with a conditional UPDATE before it is sent, so
+several processes can share one outbox without sending a message twice.
+Delivery is at-least-once: a claim left by a process that crashed mid-send
+is released once it is OUTBOX_CLAIM_TIMEOUT_SECONDS old, on start and then
+periodically by every running scheduler, and the message is sent again.
+"""
+
+import asyncio
+import logging
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import func, select, update
+from twilio.base.exceptions import TwilioRestException
+
+from app.config import get_settings
+from app.database import SessionLocal
+from app.lazy import LazyObject
+from app.metrics import reply_latency_seconds
+from app.models import OutboundMessage
+from app.resilience import CircuitOpen
+from app.services.whatsapp import is_transient_error, whatsapp_breaker, whatsapp_service
+from app.tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+# Replies whose origin (arrival time, trace) is remembered until they are sent
+MAX_TRACKED_ORIGINS = 10_000
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, up to `capacity`"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        self._refill(time.monotonic())
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self._refill(time.monotonic())
+        self.tokens -= 1
+
+    def drain(self) -> None:
+        """Empty the bucket, e.g. after the provider says we are too fast"""
+        self._refill(time.monotonic())
+        self.tokens = min(self.tokens, 0)
+
+    @property
+    def full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class OutboxService:
+    """Queue outbound messages and deliver them at a safe pace"""
+
+    def __init__(self):
+        self.settings = get_settings()
+        self._sender_buckets: Dict[str, TokenBucket] = {}
+        self._recipient_buckets: Dict[str, TokenBucket] = {}
+        self._in_flight: Set[str] = set()
+        self._tasks: Set[asyncio.Task] = set()
+        self._runner: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wake: Optional[asyncio.Event] = None
+        # Outbox id -> (when the message being replied to arrived, trace context)
+        self._origins: Dict[int, Tuple[Optional[float], Optional[str]]] = {}
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    # Queueing
+
+    def enqueue(
+        self,
+        to_phone: str,
+        body: str,
+        conversation_id: Optional[int] = None,
+        from_number: Optional[str] = None,
+        received_at: Optional[float] = None,
+    ) -> int:
+        """
+        Persist a message for sending and return its outbox id
+
+        Args:
+            to_phone: Phone number in format +447123456789
+            body: Message content to send
+            conversation_id: Conversation the message belongs to
+            from_number: Sender (whatsapp:+...); defaults to TWILIO_WHATSAPP_NUMBER
+            received_at: Epoch time the lead's message arrived, if this is the
+                reply to it; observed as reply latency once sent
+        """
+        db = SessionLocal()
+        try:
+            message = OutboundMessage(
+                conversation_id=conversation_id,
+                from_number=from_number or whatsapp_service.from_number,
+                to_phone=to_phone,
+                body=body,
+                status="pending",
+                next_attempt_at=datetime.now(timezone.utc),
+                received_at=received_at,
+            )
+            db.add(message)
+            db.commit()
+            message_id = message.id
+        finally:
+            db.close()
+
+        traceparent = tracer.current_traceparent()
+        if received_at is not None or traceparent is not None:
+            if len(self._origins) >= MAX_TRACKED_ORIGINS:
+                # Forget the oldest: sent by another process, or queued here
+                # without a scheduler running
+                try:
+                    self._origins.pop(next(iter(self._origins)), None)
+                except (RuntimeError, StopIteration):
+                    pass  # Changed by a send meanwhile
+            self._origins[message_id] = (received_at, traceparent)
+
+        logger.info(f"Queued outbound message {message_id} to {to_phone}")
+        self._notify()
+        return message_id
+
+    def _notify(self):
+        if self._loop is None or self._wake is None:
+            return
+        try:
+            running = asyncio.get_running_loop()
+        except RuntimeError:
+            running = None
+        if running is self._loop:
+            self._wake.set()
+        else:
+            self._loop.call_soon_threadsafe(self._wake.set)
+
+    # Lifecycle
+
+    def start(self) -> None:
+        """Start the delivery loop on the running event loop"""
+        if self._runner is not None and not self._runner.done():
+            return
+        self._loop = asyncio.get_running_loop()
+        self._wake = asyncio.Event()
+        self._runner = self._loop.create_task(self._run(), name="outbox")
+
+    async def stop(self) -> None:
+        """Stop the delivery loop; in-flight sends are allowed to finish"""
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run(self):
+        swept_at = None
+        while True:
+            try:
+                # Another process may have died mid-send since the last sweep
+                now = time.monotonic()
+                if swept_at is None or now - swept_at >= self.settings.outbox_claim_timeout_seconds:
+                    await asyncio.to_thread(self._recover_interrupted)
+                    swept_at = now
+                wait = await self._dispatch()
+            except Exception as e:
+                logger.error(f"Outbox dispatch failed: {e}")
+                wait = self.settings.outbox_poll_seconds
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    # Scheduling
+
+    def _bucket(self, buckets: Dict[str, TokenBucket], key: str, rate: float, burst: int) -> TokenBucket:
+        bucket = buckets.get(key)
+        if bucket is None:
+            if len(buckets) > 10_000:
+                # Forget idle recipients; a full bucket carries no state
+                for idle in [k for k, b in buckets.items() if b.full]:
+                    del buckets[idle]
+            bucket = buckets[key] = TokenBucket(rate, burst)
+        return bucket
+
+    def _recover_interrupted(self):
+        """Requeue messages left claimed by a process that stopped mid-send"""
+        db = SessionLocal()
+        try:
+            stale = datetime.now(timezone.utc) - timedelta(
+                seconds=self.settings.outbox_claim_timeout_seconds
+            )
+            result = db.execute(
+                update(OutboundMessage)
+                .where(
+                    OutboundMessage.status == "sending",
+                    OutboundMessage.next_attempt_at <= stale,
+                )
+                .values(status="pending")
+            )
+            db.commit()
+            if result.rowcount:
+                logger.warning(f"Requeued {result.rowcount} interrupted outbound messages")
+        finally:
+            db.close()
+
+    def _due_heads(self, limit: int, exclude: Set[str]) -> List[OutboundMessage]:
+        """The oldest unsent message per recipient, if it is due"""
+        db = SessionLocal()
+        try:
+            heads = (
+                select(func.min(OutboundMessage.id))
+                .where(OutboundMessage.status.in_(("pending", "sending")))
+                .group_by(OutboundMessage.to_phone)
+            )
+            stmt = (
+                select(OutboundMessage)
+                .where(
+                    OutboundMessage.id.in_(heads),
+                    OutboundMessage.status == "pending",
+                    OutboundMessage.next_attempt_at <= datetime.now(timezone.utc),
+                )
+                .order_by(OutboundMessage.id)
+                .limit(limit + len(exclude))
+            )
+            rows = [row for row in db.execute(stmt).scalars() if row.to_phone not in exclude]
+            db.expunge_all()
+            return rows[:limit]
+        finally:
+            db.close()
+
+    async def _dispatch(self) -> float:
+        """Start sends that are due and allowed; return seconds to wait"""
+        wait = self.settings.outbox_poll_seconds
+        capacity = self.settings.outbox_max_in_flight - len(self._in_flight)
+        if capacity <= 0:
+            return wait
+        blocked = whatsapp_breaker.retry_after()
+        if blocked:
+            # Twilio's circuit is open; leave messages queued until it probes again
+            return min(wait, blocked)
+
+        for message in await asyncio.to_thread(self._due_heads, capacity, set(self._in_flight)):
+            sender = self._bucket(
+                self._sender_buckets,
+                message.from_number,
+                self.settings.outbox_sender_rate,
+                self.settings.outbox_sender_burst,
+            )
+            recipient = self._bucket(
+                self._recipient_buckets,
+                message.to_phone,
+                self.settings.outbox_recipient_rate,
+                self.settings.outbox_recipient_burst,
+            )
+            delay = max(sender.delay(), recipient.delay())
+            if delay > 0:
+                wait = min(wait, delay)
+                continue
+
+            sender.take()
+            recipient.take()
+            self._in_flight.add(message.to_phone)
+            task = asyncio.get_running_loop().create_task(self._send(message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+        return wait
+
+    # Delivery
+
+    async def _send(self, message: OutboundMessage):
+        try:
+            await asyncio.to_thread(self._deliver, message.id)
+        except Exception as e:
+            logger.error(f"Outbound message {message.id} delivery crashed: {e}")
+        finally:
+            self._in_flight.discard(message.to_phone)
+            self._wake.set()
+
+    def _backoff(self, attempts: int) -> float:
+        ceiling = min(
+            self.settings.outbox_retry_max_seconds,
+            self.settings.outbox_retry_base_seconds * 2 ** (attempts - 1),
+        )
+        return random.uniform(0, ceiling)
+
+    def _deliver(self, message_id: int):
+        db = SessionLocal()
+        try:
+            # Claim it; another process may have got there first
+            claimed = db.execute(
+                update(OutboundMessage)
+                .where(OutboundMessage.id == message_id, OutboundMessage.status == "pending")
+                .values(
+                    status="sending",
+                    attempts=OutboundMessage.attempts + 1,
+                    next_attempt_at=datetime.now(timezone.utc),
+                )
+            )
+            db.commit()
+            if claimed.rowcount != 1:
+                return
+
+            message = db.get(OutboundMessage, message_id)
+            received_at, traceparent = self._origins.get(message_id, (None, None))
+            if received_at is None:
+                # Queued by another process (e.g. a pool worker)
+                received_at = message.received_at
+            try:
+                with tracer.span(
+                    "twilio.send", parent=traceparent, outbox_id=message_id, attempt=message.attempts
+                ):
+                    sid = whatsapp_service.send_message(
+                        message.to_phone, message.body, from_number=message.from_number
+                    )
+            except CircuitOpen as e:
+                # Twilio is failing: hold the message without spending an attempt
+                message.status = "pending"
+                message.attempts -= 1
+                message.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=e.retry_after)
+                db.commit()
+                return
+            except Exception as e:
+                message.last_error = str(e)
+                if is_transient_error(e) and message.attempts < self.settings.outbox_max_attempts:
+                    if isinstance(e, TwilioRestException) and e.status == 429:
+                        self._sender_buckets[message.from_number].drain()
+                    delay = self._backoff(message.attempts)
+                    message.status = "pending"
+                    message.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+                    self.retried += 1
+                    logger.warning(
+                        f"Outbound message {message_id} to {message.to_phone} failed "
+                        f"(attempt {message.attempts}), retrying in {delay:.1f}s: {e}"
+                    )
+                else:
+                    message.status = "failed"
+                    self._origins.pop(message_id, None)
+                    self.failed += 1
+                    logger.error(f"Outbound message {message_id} to {message.to_phone} failed: {e}")
+                db.commit()
+                return
+
+            message.status = "sent"
+            message.twilio_message_sid = sid
+            message.sent_at = datetime.now(timezone.utc)
+            db.commit()
+            self.sent += 1
+            self._origins.pop(message_id, None)
+            if received_at is not None:
+                reply_latency_seconds.observe(time.time() - received_at)
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        """Outbox counters for /health"""
+        db = SessionLocal()
+        try:
+            counts = dict(
+                db.execute(
+                    select(OutboundMessage.status, func.count())
+                    .where(OutboundMessage.status.in_(("pending", "sending")))
+                    .group_by(OutboundMessage.status)
+                ).all()
+            )
+        finally:
+            db.close()
+        return {
+            "running": self._runner is not None and not self._runner.done(),
+            "pending": counts.get("pending", 0),
+            "sending": counts.get("sending", 0),
+            "in_flight": len(self._in_flight),
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+        }
+
+
+# Singleton instance, created on first use
+outbox_service = LazyObject(OutboxService)
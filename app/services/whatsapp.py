@@ -1,50 +1,88 @@
 """Twilio WhatsApp integration service"""
-from twilio.rest import Client
 from app.config import get_settings
+from app.lazy import LazyObject
+from app.metrics import twilio_send_seconds, twilio_sends_in_flight
+from app.resilience import CircuitOpen, circuit_breaker
 import logging
+import time
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
 
+def is_transient_error(error: Exception) -> bool:
+    """Twilio throttling, Twilio server errors and network failures"""
+    status = getattr(error, "status", None)  # TwilioRestException
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    # Timeouts and connection errors never reached Twilio's API logic
+    return isinstance(error, OSError)
+
+
+whatsapp_breaker = circuit_breaker("twilio", slow_call_seconds=5.0, is_failure=is_transient_error)
+
+
 class WhatsAppService:
     """Service for sending WhatsApp messages via Twilio"""
 
     def __init__(self):
         self.settings = get_settings()
-        self.client = Client(
-            self.settings.twilio_account_sid,
-            self.settings.twilio_auth_token
-        )
+        self._client = None
         self.from_number = f"whatsapp:{self.settings.twilio_whatsapp_number}"
 
-    def send_message(self, to_phone: str, message: str) -> str:
+    @property
+    def client(self):
+        """Twilio REST client, created (and twilio.rest imported) on first send"""
+        if self._client is None:
+            from twilio.rest import Client
+
+            self._client = Client(
+                self.settings.twilio_account_sid,
+                self.settings.twilio_auth_token
+            )
+        return self._client
+
+    def send_message(self, to_phone: str, message: str, from_number: Optional[str] = None) -> str:
         """
         Send WhatsApp message to a phone number
 
+        Prefer outbox_service.enqueue(), which paces and retries sends.
+
         Args:
             to_phone: Phone number in format +447123456789
             message: Message content to send
+            from_number: Sender (whatsapp:+...); defaults to TWILIO_WHATSAPP_NUMBER
 
         Returns:
             Message SID from Twilio
         """
+        started = time.perf_counter()
+        outcome = "error"
         try:
             # Ensure phone number has whatsapp: prefix
             to_whatsapp = f"whatsapp:{to_phone}" if not to_phone.startswith("whatsapp:") else to_phone
 
-            message_obj = self.client.messages.create(
-                from_=self.from_number,
-                body=message,
-                to=to_whatsapp
-            )
+            # Raises CircuitOpen without calling Twilio while it is failing
+            with whatsapp_breaker.guard(), twilio_sends_in_flight.track():
+                message_obj = self.client.messages.create(
+                    from_=from_number or self.from_number,
+                    body=message,
+                    to=to_whatsapp
+                )
 
+            outcome = "sent"
             logger.info(f"Sent WhatsApp message to {to_phone}: {message_obj.sid}")
             return message_obj.sid
 
+        except CircuitOpen:
+            outcome = "circuit_open"
+            raise
         except Exception as e:
             logger.error(f"Failed to send WhatsApp message to {to_phone}: {e}")
             raise
+        finally:
+            twilio_send_seconds.observe(time.perf_counter() - started, outcome)
 
 
-# Singleton instance
-whatsapp_service = WhatsAppService()
+# Singleton instance, created on first use
+whatsapp_service = LazyObject(WhatsAppService)
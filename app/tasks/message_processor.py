@@ -2,18 +2,37 @@
 
 import logging
 import re
+import time
 from datetime import datetime, timezone
+from typing import Dict, List, Optional
 
 from sqlalchemy.orm import Session
 
-from app.agents import DiscoveryAgent, ExtractionAgent, ScoringAgent
+from app.agents import DiscoveryAgent, ExtractionAgent, LLMOverloaded, ScoringAgent
+from app.analytics import record_score, record_status_change
+from app.config import get_settings
 from app.database import SessionLocal
+from app.leases import Lease, LeaseLost, LeaseUnavailable, lease_manager
+from app.metrics import (
+    fallback_messages,
+    lead_outcomes,
+    messages_in_flight,
+    queue_wait_seconds,
+    track_db_time,
+)
 from app.models import Conversation, LeadData, Message, PTPreferences
-from app.schemas.lead import ExtractedLeadData
-from app.services import calendar_service, whatsapp_service
+from app.pt_cache import pt_cache
+from app.schemas.lead import ExtractedLeadData, QualificationScore
+from app.services import calendar_service, email_service, outbox_service
+from app.services.calendar import SlotUnavailable
+from app.tenants import tenant_router
+from app.tracing import tracer
 
 logger = logging.getLogger(__name__)
 
+# Holds to try when booking a qualified lead, in case one expires unconfirmed
+SLOT_ATTEMPTS = 2
+
 
 def _filter_hallucinated_responses(response: str) -> str:
     """
@@ -51,12 +70,75 @@ def _filter_hallucinated_responses(response: str) -> str:
     return cleaned
 
 
+def _conversation_history(db: Session, conversation_id: int) -> List[Dict[str, str]]:
+    """The conversation's messages, oldest first, as agent history"""
+    messages = (
+        db.query(Message)
+        .filter_by(conversation_id=conversation_id)
+        .order_by(Message.timestamp)
+        .all()
+    )
+    return [{"role": msg.role, "content": msg.content} for msg in messages]
+
+
+def _update_lead_data(
+    db: Session, conversation_id: int, extracted_data: ExtractedLeadData
+) -> LeadData:
+    """Copy extracted fields onto the conversation's LeadData (created if missing)"""
+    lead_data = (
+        db.query(LeadData).filter_by(conversation_id=conversation_id).first()
+    )
+    if not lead_data:
+        lead_data = LeadData(conversation_id=conversation_id)
+        db.add(lead_data)
+
+    lead_data.goals = extracted_data.goals
+    lead_data.age = extracted_data.age
+    lead_data.location = extracted_data.location
+    lead_data.budget_range = extracted_data.budget_range
+    lead_data.commitment_level = extracted_data.commitment_level
+    lead_data.availability = extracted_data.availability
+    lead_data.name = extracted_data.name
+    lead_data.email = extracted_data.email
+    return lead_data
+
+
+def _save_unprocessed_message(
+    db: Session, conversation_id: int, user_message: str, message_sid: str
+) -> None:
+    """
+    Keep a message that could not be processed in the history, so the next
+    turn's agents see it. Saved at most once per MessageSid, like a
+    processed message (a Twilio redelivery is then skipped).
+    """
+    if db.query(Message.id).filter_by(twilio_message_sid=message_sid).first():
+        return
+    db.add(
+        Message(
+            conversation_id=conversation_id,
+            role="user",
+            content=user_message,
+            twilio_message_sid=message_sid,
+            timestamp=datetime.now(timezone.utc),
+        )
+    )
+    db.commit()
+
+
 async def process_message(
-    conversation_id: int, phone: str, user_message: str, message_sid: str
+    conversation_id: int,
+    phone: str,
+    user_message: str,
+    message_sid: str,
+    received_at: Optional[float] = None,
+    traceparent: Optional[str] = None,
 ):
     """
     Process incoming WhatsApp message with LLM agents
 
+    Runs while holding the conversation's lease (app.leases), so messages
+    for one conversation are processed one at a time across all workers.
+
     Steps:
     1. Check if MessageSid already processed (idempotency)
     2. Load conversation and message history
@@ -72,8 +154,67 @@ async def process_message(
         phone: Phone number (without whatsapp: prefix)
         user_message: Message content from user
         message_sid: Twilio MessageSid for idempotency
+        received_at: Epoch time the webhook received the message, for the
+            queue wait and reply latency metrics
+        traceparent: Trace context of the webhook request, if it is traced
     """
+    span = tracer.start_span(
+        "process_message",
+        parent=traceparent,
+        conversation_id=conversation_id,
+        message_sid=message_sid,
+    )
+    if received_at is not None:
+        queue_wait = time.time() - received_at
+        queue_wait_seconds.observe(queue_wait)
+        span.set_attribute("queue_wait_ms", round(queue_wait * 1000, 3))
+    try:
+        with messages_in_flight.track():
+            waiting = time.perf_counter()
+            async with lease_manager.hold(conversation_id) as lease:
+                span.set_attribute("lease_wait_ms", round((time.perf_counter() - waiting) * 1000, 3))
+                with track_db_time():
+                    await _process_message(
+                        conversation_id, phone, user_message, message_sid, lease, received_at
+                    )
+    except LeaseUnavailable as e:
+        logger.error(f"Message {message_sid} not processed: {e}")
+        span.record_exception(e)
+        fallback_messages.inc("lease_unavailable")
+        db = SessionLocal()
+        try:
+            conversation = db.get(Conversation, conversation_id)
+            try:
+                _save_unprocessed_message(db, conversation_id, user_message, message_sid)
+            except Exception as save_error:
+                logger.error(f"Failed to save message {message_sid}: {save_error}")
+                db.rollback()
+            outbox_service.enqueue(
+                phone,
+                "Sorry, I'm a little behind. I've got your message and will pick it up "
+                "with your next one.",
+                conversation_id=conversation_id,
+                from_number=tenant_router.sender_for(conversation.pt_id) if conversation else None,
+            )
+        except Exception as send_error:
+            logger.error(f"Failed to send fallback message: {send_error}")
+        finally:
+            db.close()
+    finally:
+        span.end()
+
+
+async def _process_message(
+    conversation_id: int,
+    phone: str,
+    user_message: str,
+    message_sid: str,
+    lease: Lease,
+    received_at: Optional[float],
+):
     db = SessionLocal()
+    db.info["lease"] = lease
+    conversation = None
 
     try:
         # 1. Check idempotency - if MessageSid exists, skip processing
@@ -91,34 +232,37 @@ async def process_message(
             return
 
         # Get message history
-        messages = (
-            db.query(Message)
-            .filter_by(conversation_id=conversation_id)
-            .order_by(Message.timestamp)
-            .all()
-        )
-        conversation_history = [
-            {"role": msg.role, "content": msg.content} for msg in messages
-        ]
+        conversation_history = _conversation_history(db, conversation_id)
 
         # Add current user message to history
         conversation_history.append({"role": "user", "content": user_message})
 
         # 3. Load PT preferences
-        pt = db.query(PTPreferences).filter_by(id=conversation.pt_id).first()
+        pt = pt_cache.get(conversation.pt_id)
         if not pt:
             logger.error(f"PT preferences not found for conversation {conversation_id}")
             return
 
+        # Don't hold a pooled connection while waiting for the LLM
+        pt_id = conversation.pt_id
+        db.rollback()
+
         # 4. Call Discovery Agent
         logger.info(f"Calling Discovery Agent for conversation {conversation_id}")
         discovery_agent = DiscoveryAgent()
-        assistant_response = await discovery_agent.get_response(
-            pt, conversation_history
-        )
-
-        # 4.5. Safety filter: Remove any hallucinated user responses
-        assistant_response = _filter_hallucinated_responses(assistant_response)
+        degraded = False
+        try:
+            assistant_response = await discovery_agent.get_response(
+                pt, conversation_history
+            )
+            # 4.5. Safety filter: Remove any hallucinated user responses
+            assistant_response = _filter_hallucinated_responses(assistant_response)
+        except LLMOverloaded as e:
+            # Shedding load: reply at once; the next message picks the conversation up
+            logger.warning(f"Degraded reply for conversation {conversation_id}: {e}")
+            assistant_response = get_settings().llm_degraded_reply
+            degraded = True
+            fallback_messages.inc("llm_overloaded")
 
         # 5. Save both messages to database
         user_msg = Message(
@@ -139,9 +283,18 @@ async def process_message(
         db.add(assistant_msg)
         db.commit()
 
-        # 6. Send response via WhatsApp
-        logger.info(f"Sending WhatsApp response to {phone}")
-        whatsapp_service.send_message(phone, assistant_response)
+        # 6. Queue response for sending via WhatsApp
+        logger.info(f"Queueing WhatsApp response to {phone}")
+        outbox_service.enqueue(
+            phone,
+            assistant_response,
+            conversation_id=conversation_id,
+            from_number=tenant_router.sender_for(pt_id),
+            received_at=received_at,
+        )
+
+        if degraded:
+            return
 
         # 7. Call Extraction Agent to get structured data
         logger.info(f"Calling Extraction Agent for conversation {conversation_id}")
@@ -151,37 +304,41 @@ async def process_message(
         conversation_history.append(
             {"role": "assistant", "content": assistant_response}
         )
-        extracted_data = await extraction_agent.extract_data(conversation_history)
+        try:
+            extracted_data = await extraction_agent.extract_data(
+                conversation_history, pt_id=pt_id
+            )
+        except LLMOverloaded as e:
+            # The whole history is extracted again on the next message
+            logger.warning(f"Skipped extraction for conversation {conversation_id}: {e}")
+            return
 
         # 8. Update or create LeadData
-        lead_data = (
-            db.query(LeadData).filter_by(conversation_id=conversation_id).first()
-        )
-        if not lead_data:
-            lead_data = LeadData(conversation_id=conversation_id)
-            db.add(lead_data)
-
-        # Update fields
-        lead_data.goals = extracted_data.goals
-        lead_data.age = extracted_data.age
-        lead_data.location = extracted_data.location
-        lead_data.budget_range = extracted_data.budget_range
-        lead_data.commitment_level = extracted_data.commitment_level
-        lead_data.availability = extracted_data.availability
-
+        lead_data = _update_lead_data(db, conversation_id, extracted_data)
         db.commit()
 
         # 9. If we have all info and haven't scored yet, score and take action
-        if extracted_data.has_all_info and lead_data.is_qualified is None:
+        unscored = lead_data.is_qualified is None
+        db.rollback()  # Release the connection during the scoring call
+        if extracted_data.has_all_info and unscored:
             logger.info(
                 f"Lead has all info, proceeding to score for conversation {conversation_id}"
             )
-            await score_and_take_action(conversation_id, phone, pt, extracted_data, db)
+            try:
+                await score_and_take_action(conversation_id, phone, pt, extracted_data, db)
+            except LLMOverloaded as e:
+                # Still unscored, so scoring is retried on the next message
+                logger.warning(f"Skipped scoring for conversation {conversation_id}: {e}")
 
         # Update conversation timestamp
         conversation.updated_at = datetime.now(timezone.utc)
         db.commit()
 
+    except LeaseLost as e:
+        # Another worker owns the conversation now and will answer
+        logger.warning(f"Abandoning message {message_sid}: {e}")
+        db.rollback()
+
     except Exception as e:
         import traceback
 
@@ -189,12 +346,17 @@ async def process_message(
             f"Error processing message for conversation {conversation_id}: {e}"
         )
         logger.error(f"Traceback: {traceback.format_exc()}")
+        tracer.record_exception(e)
         db.rollback()
 
         # Send fallback message to user
+        fallback_messages.inc("error")
         try:
-            whatsapp_service.send_message(
-                phone, "I'm having trouble processing that. Can you try again?"
+            outbox_service.enqueue(
+                phone,
+                "I'm having trouble processing that. Can you try again?",
+                conversation_id=conversation_id,
+                from_number=tenant_router.sender_for(conversation.pt_id) if conversation else None,
             )
         except Exception as send_error:
             logger.error(f"Failed to send fallback message: {send_error}")
@@ -203,6 +365,7 @@ async def process_message(
         db.close()
 
 
+@tracer.traced("score_and_take_action")
 async def score_and_take_action(
     conversation_id: int,
     phone: str,
@@ -213,6 +376,10 @@ async def score_and_take_action(
     """
     Score lead and take appropriate action (book call or send rejection)
 
+    The score is committed together with the action's own writes, so a
+    worker that loses the lease leaves the lead unscored and the new lease
+    holder scores it again.
+
     Args:
         conversation_id: ID of the conversation
         phone: Phone number
@@ -226,23 +393,17 @@ async def score_and_take_action(
         scoring_agent = ScoringAgent()
         score_result = await scoring_agent.score_lead(pt, extracted_data)
 
-        # 2. Update LeadData with scores
-        lead_data = (
-            db.query(LeadData).filter_by(conversation_id=conversation_id).first()
-        )
-        lead_data.qualification_score = score_result.overall_score
-        lead_data.is_qualified = score_result.is_qualified
-        lead_data.reasoning = score_result.reasoning
-        db.commit()
-
-        # 3. Take action based on recommendation
+        # 2. Take action based on recommendation
         if score_result.recommended_action == "book_call" and score_result.is_qualified:
-            await _handle_qualified_lead(conversation_id, phone, extracted_data, db)
+            lead_outcomes.inc("qualified")
+            await _handle_qualified_lead(conversation_id, phone, extracted_data, score_result, db)
         elif score_result.recommended_action == "send_rejection":
-            await _handle_rejected_lead(
-                conversation_id, phone, score_result.reasoning, db
-            )
+            lead_outcomes.inc("rejected")
+            await _handle_rejected_lead(conversation_id, phone, score_result, db)
         else:
+            lead_outcomes.inc("needs_more_info")
+            _save_score(db, conversation_id, score_result)
+            db.commit()
             logger.info(
                 f"Needs more info for conversation {conversation_id}, continuing conversation"
             )
@@ -254,33 +415,71 @@ async def score_and_take_action(
         raise
 
 
+def _save_score(db: Session, conversation_id: int, score_result: QualificationScore) -> None:
+    """Stage the score on the lead's LeadData (committed by the caller)"""
+    lead_data = (
+        db.query(LeadData).filter_by(conversation_id=conversation_id).first()
+    )
+    lead_data.qualification_score = score_result.overall_score
+    lead_data.is_qualified = score_result.is_qualified
+    lead_data.reasoning = score_result.reasoning
+    record_score(db, lead_data.conversation, score_result.overall_score)
+
+
+@tracer.traced("handle_qualified_lead")
 async def _handle_qualified_lead(
-    conversation_id: int, phone: str, extracted_data: ExtractedLeadData, db: Session
+    conversation_id: int,
+    phone: str,
+    extracted_data: ExtractedLeadData,
+    score_result: QualificationScore,
+    db: Session,
 ):
     """Handle qualified lead by booking calendar slot"""
+    available_slot = None
     try:
-        # Find available slot
-        available_slot = calendar_service.find_next_available_slot()
-
-        # Book calendar event
-        meeting_link = calendar_service.book_calendar_event(
-            slot_time=available_slot,
-            lead_name="Prospect",  # Could extract name if we added that field
-            lead_phone=phone,
-            lead_goals=extracted_data.goals,
-        )
+        conversation = db.query(Conversation).filter_by(id=conversation_id).first()
+        pt_id = conversation.pt_id
+
+        # A held slot is outside the fenced commit: don't take one for a
+        # conversation another worker has already taken over
+        lease = db.info.get("lease")
+        if lease is not None:
+            lease_manager.check(lease)
+
+        # Hold the next free slot so concurrent leads can't get the same one
+        for _ in range(SLOT_ATTEMPTS):
+            available_slot = calendar_service.reserve_next_available_slot(
+                pt_id=pt_id,
+                lead_phone=phone,
+                conversation_id=conversation_id,
+            )
+            if available_slot is None:
+                break
+            try:
+                meeting_link = calendar_service.confirm_slot(
+                    available_slot, pt_id=pt_id, conversation_id=conversation_id
+                )
+                break
+            except SlotUnavailable as e:
+                # The hold expired before we confirmed it; hold another slot
+                logger.warning(f"{e}; re-reserving for conversation {conversation_id}")
+                available_slot = None
+
+        if available_slot is None:
+            booking_message = """Great news! Based on what you've shared, I think you'd be a great fit for our program. Your goals align perfectly with our specialty.
+
+The calendar is fully booked for the next few days, so I'll reach out personally to find a time for your free intro call.
 
-        # Format booking message
-        slot_formatted = available_slot.strftime("%A, %B %d at %I:%M %p")
-        booking_message = f"""Great news! Based on what you've shared, I think you'd be a great fit for our program. Your goals align perfectly with our specialty.
+Looking forward to helping you reach your goals!"""
+        else:
+            # Format booking message
+            slot_formatted = available_slot.strftime("%A, %B %d at %I:%M %p")
+            booking_message = f"""Great news! Based on what you've shared, I think you'd be a great fit for our program. Your goals align perfectly with our specialty.
 
 I've found an available slot for {slot_formatted}. This will be a free intro call to discuss your personalized program.
 
 Looking forward to helping you reach your goals!"""
 
-        # Send booking confirmation via WhatsApp
-        whatsapp_service.send_message(phone, booking_message)
-
         # Save booking message to conversation
         booking_msg = Message(
             conversation_id=conversation_id,
@@ -290,23 +489,50 @@ Looking forward to helping you reach your goals!"""
         )
         db.add(booking_msg)
 
-        # Update conversation status
-        conversation = db.query(Conversation).filter_by(id=conversation_id).first()
-        conversation.status = "qualified"
+        # Score, message and status in one fenced commit
+        _save_score(db, conversation_id, score_result)
+        record_status_change(db, conversation, "qualified")
         db.commit()
-
-        logger.info(f"Booked call for qualified lead in conversation {conversation_id}")
-
     except Exception as e:
         logger.error(f"Error handling qualified lead: {e}")
+        if available_slot is not None:
+            # Nothing was committed: give the slot back (a new lease holder
+            # books its own)
+            db.rollback()
+            calendar_service.release_slot(
+                available_slot, pt_id=pt_id, conversation_id=conversation_id
+            )
         raise
 
+    # Only now write the event to the PT's calendar and send the booking
+    # confirmation via WhatsApp, so a worker that lost the lease does neither
+    if available_slot is not None:
+        calendar_service.write_calendar_event(
+            available_slot,
+            meeting_link,
+            lead_name=extracted_data.name or "Prospect",
+            lead_phone=phone,
+            lead_goals=extracted_data.goals,
+            pt_id=pt_id,
+        )
+    outbox_service.enqueue(
+        phone,
+        booking_message,
+        conversation_id=conversation_id,
+        from_number=tenant_router.sender_for(pt_id),
+    )
+
+    logger.info(f"Booked call for qualified lead in conversation {conversation_id}")
+
 
+@tracer.traced("handle_rejected_lead")
 async def _handle_rejected_lead(
-    conversation_id: int, phone: str, reasoning: str, db: Session
+    conversation_id: int, phone: str, score_result: QualificationScore, db: Session
 ):
     """Handle rejected lead by sending polite rejection"""
     try:
+        conversation = db.query(Conversation).filter_by(id=conversation_id).first()
+
         rejection_message = """Thank you so much for your interest in personal training with us!
 
 After reviewing your requirements, I think there might be other options that could be a better fit for your current goals and situation.
@@ -318,9 +544,6 @@ I'd recommend exploring:
 
 We wish you all the best on your fitness journey!"""
 
-        # Send rejection via WhatsApp
-        whatsapp_service.send_message(phone, rejection_message)
-
         # Save rejection message to conversation
         rejection_msg = Message(
             conversation_id=conversation_id,
@@ -330,11 +553,22 @@ We wish you all the best on your fitness journey!"""
         )
         db.add(rejection_msg)
 
-        # Update conversation status
-        conversation = db.query(Conversation).filter_by(id=conversation_id).first()
-        conversation.status = "rejected"
+        # Score, message and status in one fenced commit
+        _save_score(db, conversation_id, score_result)
+        record_status_change(db, conversation, "rejected")
         db.commit()
 
+        # Send rejection via WhatsApp
+        outbox_service.enqueue(
+            phone,
+            rejection_message,
+            conversation_id=conversation_id,
+            from_number=tenant_router.sender_for(conversation.pt_id),
+        )
+
+        # Rendered and sent in the background, if we have an address
+        email_service.queue_rejection_email(conversation_id)
+
         logger.info(f"Sent rejection for conversation {conversation_id}")
 
     except Exception as e:
@@ -0,0 +1,110 @@
+"""
+Multi-PT routing by WhatsApp number.
+
+Each PT can have their own Twilio WhatsApp number
+(PTPreferences.whatsapp_number). Incoming messages are routed to a PT by
+the webhook's `To` number through an in-memory map, so routing costs a dict
+lookup rather than a query. The map is rebuilt on next use whenever the PT
+preferences cache (app.pt_cache) sees a PT change, whether committed in
+this process or, within PT_CACHE_POLL_SECONDS, in another one.
+Messages to a number no PT claims go to DEFAULT_PT_ID (single-PT
+deployments need no configuration).
+"""
+
+import logging
+import threading
+from typing import Dict, Optional
+
+from sqlalchemy import select
+
+from app.config import get_settings
+from app.database import SessionLocal
+from app.models import PTPreferences
+from app.pt_cache import pt_cache
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_number(number: Optional[str]) -> str:
+    """'whatsapp:+44 7700 900123' -> '+447700900123'"""
+    if not number:
+        return ""
+    number = number.strip()
+    if number.startswith("whatsapp:"):
+        number = number[len("whatsapp:"):]
+    return "".join(ch for ch in number if ch.isdigit() or ch == "+")
+
+
+class TenantRouter:
+    """Maps WhatsApp numbers to PTs and back"""
+
+    def __init__(self, session_factory=SessionLocal):
+        self.settings = get_settings()
+        self._session_factory = session_factory
+        self._lock = threading.Lock()
+        self._by_number: Optional[Dict[str, int]] = None
+        self._numbers: Dict[int, str] = {}
+        self.loads = 0
+
+    def _load(self) -> Dict[str, int]:
+        db = self._session_factory()
+        try:
+            rows = db.execute(
+                select(PTPreferences.id, PTPreferences.whatsapp_number).where(
+                    PTPreferences.whatsapp_number.is_not(None)
+                )
+            ).all()
+        finally:
+            db.close()
+
+        by_number = {}
+        numbers = {}
+        for pt_id, number in rows:
+            number = normalize_number(number)
+            if number:
+                by_number[number] = pt_id
+                numbers[pt_id] = number
+        self._numbers = numbers
+        self.loads += 1
+        logger.info(f"Loaded tenant map: {len(by_number)} PT numbers")
+        return by_number
+
+    def _map(self) -> Dict[str, int]:
+        pt_cache.check()
+        by_number = self._by_number
+        if by_number is None:
+            with self._lock:
+                if self._by_number is None:
+                    self._by_number = self._load()
+                by_number = self._by_number
+        return by_number
+
+    def invalidate(self) -> None:
+        """Rebuild the map on next use"""
+        self._by_number = None
+
+    def pt_for_number(self, to_number: Optional[str]) -> int:
+        """PT that owns the number a message was sent to"""
+        pt_id = self._map().get(normalize_number(to_number))
+        if pt_id is None:
+            return self.settings.default_pt_id
+        return pt_id
+
+    def sender_for(self, pt_id: int) -> Optional[str]:
+        """The PT's own sender (whatsapp:+...), or None for the default number"""
+        self._map()
+        number = self._numbers.get(pt_id)
+        return f"whatsapp:{number}" if number else None
+
+    def stats(self) -> dict:
+        by_number = self._by_number
+        return {
+            "loaded": by_number is not None,
+            "numbers": len(by_number) if by_number is not None else None,
+            "loads": self.loads,
+        }
+
+
+tenant_router = TenantRouter()
+
+pt_cache.on_change(tenant_router.invalidate)
@@ -0,0 +1,351 @@
+"""
+End-to-end tracing of a lead's message, from webhook to reply.
+
+With TRACING_ENABLED, TRACING_SAMPLE_RATE of webhook messages start a
+trace. Its context travels with the message into process_message (as a
+W3C traceparent, so it survives the hop to a worker process) and with the
+reply into the outbox, and spans are recorded for:
+
+- whatsapp_webhook, process_message (with queue and lease wait times),
+  score_and_take_action and the qualified/rejected handlers
+- each agent call and each LLM attempt under it (two attempts = a hedge)
+- each statement on the primary database
+- each Twilio send of the reply
+
+Messages that are not sampled create no spans: a span is only started
+under a recorded parent, so the cost is a context variable lookup.
+
+Finished spans are queued and written by a background thread every
+EXPORT_INTERVAL_SECONDS, as JSON lines to TRACING_FILE and, if
+TRACING_OTLP_ENDPOINT is set, to an OpenTelemetry collector over OTLP/HTTP
+(JSON encoding). If the queue fills up, spans are dropped rather than
+slowing requests down. Export counts are under `tracing` on /health.
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Deque, Dict, Optional
+
+from app.config import get_settings
+
+logger = logging.getLogger(__name__)
+
+EXPORT_INTERVAL_SECONDS = 1.0
+MAX_QUEUED_SPANS = 20_000
+MAX_STATEMENT_LENGTH = 200
+
+
+class Span:
+    """A timed operation in a trace"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "start_ns", "end_ns",
+                 "attributes", "error", "_token")
+
+    recording = True
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self._token = None
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-01"
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, error: BaseException) -> None:
+        self.error = f"{type(error).__name__}: {error}"
+
+    def end(self) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self._token is not None:
+            try:
+                _current.reset(self._token)
+            except ValueError:
+                pass  # Ended in another context, which never saw it as current
+            self._token = None
+        tracer.export(self)
+
+    def __enter__(self) -> "Span":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc is not None:
+            self.record_exception(exc)
+        self.end()
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start_time": self.start_ns / 1e9,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NoopSpan:
+    """Stands in for a span when the message is not being traced"""
+
+    recording = False
+    traceparent = None
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        pass
+
+    def record_exception(self, error: BaseException) -> None:
+        pass
+
+    def end(self) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def _parse_traceparent(traceparent: str):
+    """(trace id, parent span id) of a sampled W3C traceparent, else None"""
+    parts = traceparent.split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    if not int(parts[3], 16) & 1:
+        return None
+    return parts[1], parts[2]
+
+
+def _otlp_value(value: Any) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class Tracer:
+    """Starts spans and exports the finished ones in the background"""
+
+    def __init__(self):
+        self.settings = get_settings()
+        self._queue: Deque[Span] = deque()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._http = None
+        self.started = 0
+        self.exported = 0
+        self.dropped = 0
+        self.export_errors = 0
+
+    # Spans
+
+    def start_span(
+        self,
+        name: str,
+        parent: Optional[str] = None,
+        root: bool = False,
+        activate: bool = True,
+        **attributes: Any,
+    ):
+        """
+        Start a span; call .end() on it, or use it as a context manager
+
+        Args:
+            name: Operation name
+            parent: traceparent to continue (e.g. passed from the webhook);
+                defaults to the current span
+            root: Start a new, sampled trace if there is no parent
+            activate: Make it the current span until it ends, so spans
+                started meanwhile in this context are its children
+            attributes: Span attributes
+        """
+        if not self.settings.tracing_enabled:
+            return NOOP_SPAN
+        if parent is not None:
+            parsed = _parse_traceparent(parent)
+            if parsed is None:
+                return NOOP_SPAN
+            trace_id, parent_id = parsed
+        else:
+            current = _current.get()
+            if current is not None:
+                trace_id, parent_id = current.trace_id, current.span_id
+            elif root and random.random() < self.settings.tracing_sample_rate:
+                trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+            else:
+                return NOOP_SPAN
+
+        span = Span(name, trace_id, parent_id, attributes)
+        self.started += 1
+        if activate:
+            span._token = _current.set(span)
+        return span
+
+    def span(self, name: str, parent: Optional[str] = None, **attributes: Any):
+        """A child span of the current one (or of `parent`), as a context manager"""
+        return self.start_span(name, parent=parent, **attributes)
+
+    def traced(self, name: str):
+        """Decorator running an async function in a child span"""
+
+        def decorator(function):
+            @wraps(function)
+            async def wrapper(*args, **kwargs):
+                with self.start_span(name):
+                    return await function(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def record_exception(self, error: BaseException) -> None:
+        """Mark the current span as failed"""
+        current = _current.get()
+        if current is not None:
+            current.record_exception(error)
+
+    def current_traceparent(self) -> Optional[str]:
+        current = _current.get()
+        return current.traceparent if current is not None else None
+
+    def statement_span(self, statement: str):
+        """A span for one database statement, or None if not tracing"""
+        if _current.get() is None:
+            return None
+        span = self.start_span(
+            f"db.{statement.split(None, 1)[0].lower() if statement else 'statement'}",
+            activate=False,
+            statement=statement[:MAX_STATEMENT_LENGTH],
+        )
+        return span if span.recording else None
+
+    # Export
+
+    def export(self, span: Span) -> None:
+        if len(self._queue) >= MAX_QUEUED_SPANS:
+            self.dropped += 1
+            return
+        self._queue.append(span)
+        if self._thread is None:
+            self._start_thread()
+
+    def _start_thread(self) -> None:
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="tracing", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            time.sleep(EXPORT_INTERVAL_SECONDS)
+            self.flush()
+
+    def flush(self) -> None:
+        """Export every queued span now"""
+        spans = []
+        while self._queue:
+            spans.append(self._queue.popleft())
+        if not spans:
+            return
+        try:
+            if self.settings.tracing_file:
+                self._write_file(spans)
+            if self.settings.tracing_otlp_endpoint:
+                self._post_otlp(spans)
+            self.exported += len(spans)
+        except Exception as e:
+            self.export_errors += 1
+            logger.warning(f"Failed to export {len(spans)} spans: {e}")
+
+    def shutdown(self) -> None:
+        """Export what is left, e.g. when the app stops"""
+        self.flush()
+        if self._http is not None:
+            self._http.close()
+            self._http = None
+
+    def _write_file(self, spans) -> None:
+        lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+        # One append per batch, so processes sharing the file don't interleave lines
+        with open(self.settings.tracing_file, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def _post_otlp(self, spans) -> None:
+        if self._http is None:
+            import httpx
+
+            self._http = httpx.Client(timeout=5.0)
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    {"key": "service.name", "value": {"stringValue": self.settings.tracing_service_name}},
+                    {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": __name__},
+                    "spans": [
+                        {
+                            "traceId": span.trace_id,
+                            "spanId": span.span_id,
+                            "parentSpanId": span.parent_id or "",
+                            "name": span.name,
+                            "kind": 1,
+                            "startTimeUnixNano": str(span.start_ns),
+                            "endTimeUnixNano": str(span.end_ns),
+                            "attributes": [
+                                {"key": key, "value": _otlp_value(value)}
+                                for key, value in span.attributes.items()
+                            ],
+                            "status": (
+                                {"code": 2, "message": span.error} if span.error else {"code": 1}
+                            ),
+                        }
+                        for span in spans
+                    ],
+                }],
+            }]
+        }
+        response = self._http.post(self.settings.tracing_otlp_endpoint, json=payload)
+        response.raise_for_status()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.settings.tracing_enabled,
+            "sample_rate": self.settings.tracing_sample_rate,
+            "spans_started": self.started,
+            "spans_exported": self.exported,
+            "spans_dropped": self.dropped,
+            "queued": len(self._queue),
+            "export_errors": self.export_errors,
+        }
+
+
+tracer = Tracer()
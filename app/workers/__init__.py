@@ -0,0 +1,4 @@
+from app.workers.pool import WorkerPool, worker_pool
+from app.workers.ring import HashRing
+
+__all__ = ["HashRing", "WorkerPool", "worker_pool"]
@@ -0,0 +1,504 @@
+"""
+Phone-sharded worker processes for message processing.
+
+With WORKER_PROCESSES > 0 the webhook hands messages to a pool of worker
+processes instead of running them as background tasks in the web process:
+
+- each lead's phone number is assigned to a shard with a consistent hash
+  ring, so all of a lead's messages go to the same process and run there
+  in arrival order; different leads run concurrently (up to
+  WORKER_CONCURRENCY per process), so throughput scales with cores
+- a phone with messages still in flight stays on its shard until they are
+  done, so resizing the pool never reorders a lead's messages; once idle,
+  the lead follows the new ring
+- a worker that dies is restarted and the messages it had not finished are
+  replayed in order (process_message skips a MessageSid it already saved)
+- per-shard queue depth, in-flight count and queueing lag are reported for
+  /health, and each worker's Prometheus metrics are sent to this process
+  every METRICS_INTERVAL_SECONDS to be included in /metrics
+- LLM_MAX_CONCURRENCY is split evenly between the workers, so the pool as a
+  whole keeps to it; the split is sent to each worker as a Command on its
+  job queue and again whenever the pool is resized
+- call() runs a Command on every worker and collects their replies from
+  the results queue (e.g. /debug/profile starting a CPU profile in each)
+
+Workers run the existing process_message pipeline. Outbound messages they
+queue are sent by the web process's outbox scheduler.
+"""
+
+import asyncio
+import importlib
+import itertools
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from app import metrics
+from app.config import get_settings
+from app.workers.ring import HashRing
+
+logger = logging.getLogger(__name__)
+
+RESTART_BACKOFF_SECONDS = 1.0
+METRICS_INTERVAL_SECONDS = 1.0
+
+
+@dataclass
+class Job:
+    id: int
+    conversation_id: int
+    phone: str
+    user_message: str
+    message_sid: str
+    enqueued_at: float
+    traceparent: Optional[str] = None
+    received_at: Optional[float] = None  # When the webhook got the message
+
+
+@dataclass
+class Command:
+    """A control message for a worker, sent on its job queue"""
+
+    name: str
+    args: dict = field(default_factory=dict)
+    reply_to: Optional[int] = None  # Request id, if the caller waits for a reply
+
+
+# Commands answered from the profilers in app.profiling
+PROFILE_COMMANDS = (
+    "profile_status",
+    "profile_cpu_start",
+    "profile_cpu_stop",
+    "profile_memory_snapshot",
+    "profile_memory_stop",
+)
+
+
+def _profile(command: Command) -> dict:
+    from app.profiling import memory_profiler, profiler
+
+    if command.name == "profile_cpu_start":
+        return profiler.start(
+            seconds=command.args.get("seconds"), interval=command.args["interval"]
+        )
+    if command.name == "profile_cpu_stop":
+        return profiler.stop() or {"error": "No CPU profile has run", "pid": os.getpid()}
+    if command.name == "profile_memory_snapshot":
+        return memory_profiler.snapshot()
+    if command.name == "profile_memory_stop":
+        memory_profiler.stop()
+    return {"cpu": profiler.status(), "memory": memory_profiler.status()}
+
+
+def _run_command(shard: int, command: Command, results) -> None:
+    reply = None
+    if command.name == "llm_max_concurrency":
+        from app.agents.limiter import llm_limiter
+
+        llm_limiter.max_concurrency = command.args["max_concurrency"]
+    elif command.name in PROFILE_COMMANDS:
+        try:
+            reply = _profile(command)
+        except Exception as e:
+            reply = {"error": str(e), "pid": os.getpid()}
+    else:
+        logger.warning(f"Unknown worker command {command.name}")
+    if command.reply_to is not None:
+        results.put(("reply", shard, command.reply_to, reply))
+
+
+def _resolve(target: str):
+    module_name, _, attribute = target.partition(":")
+    return getattr(importlib.import_module(module_name), attribute)
+
+
+def _worker_main(shard: int, jobs, results, handler: str, concurrency: int) -> None:
+    """Entry point of a worker process"""
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s - shard {shard} - %(name)s - %(levelname)s - %(message)s",
+    )
+    try:
+        asyncio.run(_serve(shard, jobs, results, handler, concurrency))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _serve(shard: int, jobs, results, handler: str, concurrency: int) -> None:
+    from app.services import calendar_service, email_service
+    from app.tracing import tracer
+
+    process = _resolve(handler)
+    email_service.start()
+    loop = asyncio.get_running_loop()
+    slots = asyncio.Semaphore(concurrency)
+    # Latest task per phone; each job waits for the one before it
+    chains: Dict[str, asyncio.Task] = {}
+
+    async def run(job: Job, previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            await asyncio.wait([previous])
+        async with slots:
+            started = time.time()
+            results.put(("started", shard, job.id, started - job.enqueued_at))
+            ok = True
+            try:
+                await process(
+                    conversation_id=job.conversation_id,
+                    phone=job.phone,
+                    user_message=job.user_message,
+                    message_sid=job.message_sid,
+                    received_at=job.received_at or job.enqueued_at,
+                    traceparent=job.traceparent,
+                )
+            except Exception:
+                ok = False
+                logger.exception(f"Job {job.id} for {job.phone} failed")
+            results.put(("done", shard, job.id, time.time() - started, ok))
+
+    def forget(phone: str, task: asyncio.Task) -> None:
+        if chains.get(phone) is task:
+            del chains[phone]
+
+    def report_metrics() -> None:
+        results.put(("metrics", shard, os.getpid(), metrics.snapshot()))
+
+    async def keep_reporting() -> None:
+        while True:
+            await asyncio.sleep(METRICS_INTERVAL_SECONDS)
+            report_metrics()
+
+    reporter = asyncio.create_task(keep_reporting())
+    while True:
+        job = await loop.run_in_executor(None, jobs.get)
+        if job is None:
+            break
+        if isinstance(job, Command):
+            if job.name in PROFILE_COMMANDS:
+                # A memory snapshot of a large heap takes a while; keep
+                # taking jobs meanwhile
+                loop.run_in_executor(None, _run_command, shard, job, results)
+            else:
+                _run_command(shard, job, results)
+            continue
+        task = asyncio.create_task(run(job, chains.get(job.phone)))
+        chains[job.phone] = task
+        task.add_done_callback(lambda task, phone=job.phone: forget(phone, task))
+
+    if chains:
+        await asyncio.wait(list(chains.values()))
+    reporter.cancel()
+    report_metrics()
+    await email_service.stop()
+    calendar_service.shutdown()
+    tracer.shutdown()
+
+
+class Shard:
+    """Parent-side state for one worker process"""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.jobs = None
+        self.unacked: "OrderedDict[int, Job]" = OrderedDict()  # Sent, not finished
+        self.in_flight = 0
+        self.processed = 0
+        self.failed = 0
+        self.restarts = 0
+        self.spawned_at = 0.0
+        self.lag_last: Optional[float] = None
+        self.lag_max = 0.0
+        self.retiring = False
+
+    def stats(self) -> dict:
+        oldest = next(iter(self.unacked.values()), None)
+        return {
+            "pid": self.process.pid if self.process else None,
+            "alive": bool(self.process and self.process.is_alive()),
+            "retiring": self.retiring,
+            "depth": len(self.unacked),
+            "in_flight": self.in_flight,
+            "processed": self.processed,
+            "failed": self.failed,
+            "restarts": self.restarts,
+            "lag_seconds": round(self.lag_last, 3) if self.lag_last is not None else None,
+            "max_lag_seconds": round(self.lag_max, 3),
+            "oldest_pending_seconds": (
+                round(time.time() - oldest.enqueued_at, 3) if oldest else None
+            ),
+        }
+
+
+class WorkerPool:
+    """Routes messages to worker processes by lead phone number"""
+
+    def __init__(self, handler: str = "app.tasks:process_message"):
+        self.settings = get_settings()
+        self.handler = handler
+        self._ctx = multiprocessing.get_context("spawn")
+        self._lock = threading.RLock()
+        self._replied = threading.Condition(self._lock)
+        self._replies: Dict[int, Dict[int, object]] = {}  # Request id -> shard -> reply
+        self._shards: Dict[int, Shard] = {}
+        self._ring: Optional[HashRing] = None
+        self._sticky: Dict[str, int] = {}  # phone -> shard while it has unacked jobs
+        self._pending: Dict[str, int] = {}  # phone -> unacked job count
+        self._results = None
+        self._supervisor: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._ids = itertools.count(1)
+        self._processes = 0
+
+    @property
+    def running(self) -> bool:
+        return self._supervisor is not None and self._supervisor.is_alive()
+
+    # Lifecycle
+
+    def start(self, processes: Optional[int] = None) -> None:
+        """Start `processes` workers (default WORKER_PROCESSES)"""
+        if self.running:
+            return
+        processes = processes or self.settings.worker_processes
+        self._stopping.clear()
+        self._results = self._ctx.Queue()
+        with self._lock:
+            self._processes = processes
+            for index in range(processes):
+                shard = self._shards[index] = Shard(index)
+                self._spawn(shard)
+            self._ring = HashRing(range(processes))
+        self._supervisor = threading.Thread(target=self._supervise, name="worker-pool", daemon=True)
+        self._supervisor.start()
+        logger.info(f"Started {processes} worker processes")
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Let workers finish their queued messages, then stop them"""
+        if self._supervisor is None:
+            return
+        self._stopping.set()
+        self._supervisor.join()
+        self._supervisor = None
+        with self._lock:
+            shards = list(self._shards.values())
+        for shard in shards:
+            shard.jobs.put(None)
+        deadline = time.monotonic() + timeout
+        for shard in shards:
+            shard.process.join(max(0.0, deadline - time.monotonic()))
+            if shard.process.is_alive():
+                logger.warning(f"Worker {shard.index} did not stop in time, terminating")
+                shard.process.terminate()
+                shard.process.join()
+        self._drain_results()
+        for shard in shards:
+            metrics.retire(f"worker-{shard.process.pid}")
+        with self._lock:
+            self._shards = {}
+            self._ring = None
+            self._sticky = {}
+            self._pending = {}
+            self._processes = 0
+
+    def resize(self, processes: int) -> None:
+        """
+        Change the number of workers.
+
+        New leads are assigned by the new ring straight away; a lead with
+        messages still queued on its old shard moves once they are done.
+        Removed shards stop after draining.
+        """
+        if processes < 1:
+            raise ValueError("A worker pool needs at least one process")
+        with self._lock:
+            self._processes = processes
+            active = sorted(index for index, shard in self._shards.items() if not shard.retiring)
+            for index in active[processes:]:
+                self._shards[index].retiring = True
+            for index in range(processes):
+                shard = self._shards.get(index)
+                if shard is None:
+                    shard = self._shards[index] = Shard(index)
+                    self._spawn(shard)
+                else:
+                    shard.jobs.put(self._llm_share())
+                shard.retiring = False
+            self._ring = HashRing(range(processes))
+        logger.info(f"Resized worker pool from {len(active)} to {processes} processes")
+
+    # Routing
+
+    def submit(
+        self,
+        conversation_id: int,
+        phone: str,
+        user_message: str,
+        message_sid: str,
+        traceparent: Optional[str] = None,
+        received_at: Optional[float] = None,
+    ) -> int:
+        """Queue a message for processing; returns the shard it went to"""
+        job = Job(
+            next(self._ids),
+            conversation_id,
+            phone,
+            user_message,
+            message_sid,
+            time.time(),
+            traceparent,
+            received_at,
+        )
+        with self._lock:
+            index = self._sticky.get(phone)
+            if index is None:
+                index = self._ring.node_for(phone)
+                self._sticky[phone] = index
+            self._pending[phone] = self._pending.get(phone, 0) + 1
+            shard = self._shards[index]
+            shard.unacked[job.id] = job
+            shard.jobs.put(job)
+        return index
+
+    def call(self, name: str, args: Optional[dict] = None, timeout: float = 10.0) -> Dict[int, object]:
+        """
+        Run a command on every worker and wait for their replies.
+
+        Returns each shard's reply; a worker that does not answer within
+        `timeout` seconds (e.g. restarting) is left out.
+        """
+        request_id = next(self._ids)
+        command = Command(name, dict(args or {}), reply_to=request_id)
+        deadline = time.monotonic() + timeout
+        with self._replied:
+            shards: List[Shard] = [shard for shard in self._shards.values() if not shard.retiring]
+            self._replies[request_id] = {}
+            for shard in shards:
+                shard.jobs.put(command)
+            try:
+                while len(self._replies[request_id]) < len(shards):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        logger.warning(
+                            f"Worker command {name}: {len(self._replies[request_id])} of "
+                            f"{len(shards)} workers replied in {timeout}s"
+                        )
+                        break
+                    self._replied.wait(remaining)
+            finally:
+                replies = self._replies.pop(request_id)
+        return replies
+
+    # Supervision
+
+    def _llm_share(self) -> Command:
+        """Each worker's part of LLM_MAX_CONCURRENCY (at least one call)"""
+        share = max(1, self.settings.llm_max_concurrency // max(1, self._processes))
+        return Command("llm_max_concurrency", {"max_concurrency": share})
+
+    def _spawn(self, shard: Shard) -> None:
+        """(Re)start a shard's process on a fresh queue holding its unfinished jobs"""
+        shard.jobs = self._ctx.Queue()
+        shard.jobs.put(self._llm_share())
+        for job in shard.unacked.values():
+            shard.jobs.put(job)
+        shard.in_flight = 0
+        shard.process = self._ctx.Process(
+            target=_worker_main,
+            args=(
+                shard.index,
+                shard.jobs,
+                self._results,
+                self.handler,
+                self.settings.worker_concurrency,
+            ),
+            name=f"worker-{shard.index}",
+            daemon=True,
+        )
+        shard.process.start()
+        shard.spawned_at = time.monotonic()
+
+    def _supervise(self) -> None:
+        while not self._stopping.is_set():
+            self._drain_results(timeout=0.5)
+            with self._lock:
+                for index, shard in list(self._shards.items()):
+                    if shard.retiring and not shard.unacked:
+                        shard.jobs.put(None)
+                        metrics.retire(f"worker-{shard.process.pid}")
+                        del self._shards[index]
+                        logger.info(f"Retired worker {index}")
+                    elif not shard.process.is_alive():
+                        if time.monotonic() - shard.spawned_at < RESTART_BACKOFF_SECONDS:
+                            continue
+                        shard.restarts += 1
+                        metrics.retire(f"worker-{shard.process.pid}")
+                        logger.error(
+                            f"Worker {index} exited (code {shard.process.exitcode}), restarting "
+                            f"with {len(shard.unacked)} unfinished messages"
+                        )
+                        self._spawn(shard)
+
+    def _drain_results(self, timeout: float = 0.0) -> None:
+        try:
+            event = self._results.get(timeout=timeout) if timeout else self._results.get_nowait()
+            while True:
+                self._apply(event)
+                event = self._results.get_nowait()
+        except queue.Empty:
+            pass
+
+    def _apply(self, event: tuple) -> None:
+        kind, index, job_id = event[:3]
+        if kind == "metrics":
+            metrics.merge(f"worker-{job_id}", event[3])  # job_id is the worker's pid here
+            return
+        if kind == "reply":
+            with self._replied:
+                replies = self._replies.get(job_id)
+                if replies is not None:
+                    replies[index] = event[3]
+                    self._replied.notify_all()
+            return
+        with self._lock:
+            shard = self._shards.get(index)
+            if shard is None or job_id not in shard.unacked:
+                return
+            if kind == "started":
+                lag = event[3]
+                shard.in_flight += 1
+                shard.lag_last = lag
+                shard.lag_max = max(shard.lag_max, lag)
+                return
+
+            ok = event[4]
+            job = shard.unacked.pop(job_id)
+            shard.in_flight = max(0, shard.in_flight - 1)
+            shard.processed += 1
+            if not ok:
+                shard.failed += 1
+            remaining = self._pending.get(job.phone, 1) - 1
+            if remaining:
+                self._pending[job.phone] = remaining
+            else:
+                self._pending.pop(job.phone, None)
+                self._sticky.pop(job.phone, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            shards = {index: shard.stats() for index, shard in sorted(self._shards.items())}
+        return {
+            "running": self.running,
+            "processes": sum(1 for shard in shards.values() if not shard["retiring"]),
+            "depth": sum(shard["depth"] for shard in shards.values()),
+            "shards": shards,
+        }
+
+
+worker_pool = WorkerPool()
@@ -0,0 +1,31 @@
+"""Consistent hash ring for assigning leads to worker shards"""
+
+import bisect
+import hashlib
+from typing import Hashable, Iterable, List
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """
+    Maps keys (phone numbers) to nodes (shard indexes).
+
+    Each node is placed at `replicas` points on the ring, so keys spread
+    evenly and adding or removing a node moves only about 1/n of the keys.
+    """
+
+    def __init__(self, nodes: Iterable[Hashable], replicas: int = 64):
+        points = sorted(
+            (_hash(f"{node}#{replica}"), node) for node in nodes for replica in range(replicas)
+        )
+        if not points:
+            raise ValueError("HashRing needs at least one node")
+        self._points: List[int] = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str) -> Hashable:
+        index = bisect.bisect(self._points, _hash(key)) % len(self._points)
+        return self._nodes[index]
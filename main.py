@@ -1,16 +1,30 @@
 """FastAPI application entry point for PT Lead Qualification Chatbot"""
 
+import asyncio
 import logging
 from contextlib import asynccontextmanager
 from datetime import datetime, timezone
 
 from fastapi import FastAPI
+from fastapi.responses import Response
 
-from app.admin import setup_admin
+from app import metrics
+from app.agents.hedging import hedging_stats
+from app.agents.limiter import llm_limiter
+from app.api.debug import router as debug_router
+from app.api.exports import router as exports_router
 from app.api.webhooks.whatsapp import router as whatsapp_router
-from app.database import init_db
-
-# from app.middleware import RateLimitMiddleware
+from app.config import get_settings
+from app.database import init_db, pool_metrics
+from app.lazy import LazyASGIApp
+from app.leases import lease_manager
+from app.middleware import RateLimitMiddleware, rate_limiter
+from app.pt_cache import pt_cache
+from app.resilience import breaker_stats
+from app.services import calendar_service, email_service, outbox_service
+from app.tenants import tenant_router
+from app.tracing import tracer
+from app.workers import worker_pool
 
 # Configure logging
 logging.basicConfig(
@@ -27,9 +41,17 @@ async def lifespan(app: FastAPI):
     logger.info("Starting Chat-GPT: Chat Gateway for Personal Trainers...")
     init_db()
     logger.info("Database initialized")
+    outbox_service.start()
+    email_service.start()
+    if get_settings().worker_processes:
+        worker_pool.start()
     yield
-    # # Shutdown (if needed in the future)
-    # logger.info("Shutting down...")
+    # Shutdown
+    await asyncio.to_thread(worker_pool.stop)
+    await email_service.stop()
+    await outbox_service.stop()
+    calendar_service.shutdown()
+    await asyncio.to_thread(tracer.shutdown)
 
 
 # Create FastAPI app
@@ -40,11 +62,11 @@ app = FastAPI(
     lifespan=lifespan,
 )
 
-# Add middleware (disabled for now due to form data consumption issue)
-# app.add_middleware(RateLimitMiddleware, rate_limit_seconds=3)
+# Reject message floods before they reach the webhook
+app.add_middleware(RateLimitMiddleware)
 
-# Setup SQLAdmin
-setup_admin(app)
+# Setup SQLAdmin (imported and built on the first /admin request)
+app.mount("/admin", LazyASGIApp("app.admin:create_admin_app"), name="admin")
 
 
 @app.get("/health")
@@ -53,21 +75,47 @@ async def health_check():
     return {
         "status": "healthy",
         "timestamp": datetime.now(timezone.utc).isoformat() + "Z",
+        "database": pool_metrics(),
+        "calendar": calendar_service.stats(),
+        "outbox": outbox_service.stats(),
+        "email": email_service.stats(),
+        "tenants": tenant_router.stats(),
+        "pt_cache": pt_cache.stats(),
+        "leases": lease_manager.stats(),
+        "workers": worker_pool.stats(),
+        "llm": {**llm_limiter.stats(), "hedging": hedging_stats()},
+        "breakers": breaker_stats(),
+        "rate_limit": rate_limiter.stats(),
+        "tracing": tracer.stats(),
     }
 
 
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Pipeline metrics in the Prometheus text format"""
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/")
 async def root():
     """Root endpoint"""
     return {
         "message": "PT Lead Qualification Chatbot API",
         "version": "0.0.1",
-        "endpoints": {"health": "/health", "whatsapp_webhook": "/webhook/whatsapp"},
+        "endpoints": {
+            "health": "/health",
+            "metrics": "/metrics",
+            "whatsapp_webhook": "/webhook/whatsapp",
+            "export": "/export/{conversations,messages,leads,deletions}.ndjson",
+            "profiling": "/debug/profile/{cpu,memory}",
+        },
     }
 
 
 # Include routers
 app.include_router(whatsapp_router, prefix="/webhook", tags=["webhooks"])
+app.include_router(exports_router, prefix="/export", tags=["exports"])
+app.include_router(debug_router, prefix="/debug", tags=["debug"])
 
 
 if __name__ == "__main__":
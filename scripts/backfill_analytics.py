@@ -0,0 +1,43 @@
+"""Rebuild the lead analytics aggregates from raw conversations and lead data"""
+import argparse
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.analytics import rebuild_aggregates
+from app.database import init_db, SessionLocal
+
+
+def backfill(batch_size: int):
+    """Stream raw rows in batches and replace the aggregate tables"""
+    db = SessionLocal()
+
+    try:
+        processed = rebuild_aggregates(db, batch_size=batch_size)
+        print(f"Rebuilt aggregates from {processed} conversations")
+    except Exception as e:
+        print(f"Error rebuilding aggregates: {e}")
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1000,
+        help="Rows fetched per round trip from the database (default: 1000)",
+    )
+    args = parser.parse_args()
+
+    print("Ensuring analytics tables exist...")
+    init_db()
+
+    print("\nBackfilling lead aggregates...")
+    backfill(args.batch_size)
+    print("\nBackfill complete!")
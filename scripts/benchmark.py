@@ -0,0 +1,337 @@
+"""
+Micro-benchmarks for the message hot paths, with a regression check.
+
+Times, per call:
+
+- filter: _filter_hallucinated_responses on long discovery replies
+- prompts: every PromptManager getter, with file templates and with
+  database overrides
+- history: building conversation_history from N stored messages
+- webhook: POST /webhook/whatsapp through the test client (middleware,
+  form parsing, conversation lookup; processing itself is stubbed out)
+- lead_data: the LeadData update and commit in process_message
+
+Each benchmark is calibrated to run for at least --min-round-seconds per
+round; the median per-call time over --rounds rounds is the result. Logging
+is switched off so the numbers measure the code rather than log handlers.
+
+Results are saved as JSON (--output) with the git commit they were measured
+on. With --baseline, any benchmark slower than the baseline by more than
+--threshold (e.g. 0.25 = 25%) is reported and the script exits with status 1.
+
+With --profile DIR, each benchmark's rounds are also CPU-profiled with the
+sampling profiler behind /debug/profile, into DIR/<benchmark>-<pid>.folded for a
+flame graph; the sampler adds some overhead, so don't compare those timings.
+
+Usage:
+    python scripts/benchmark.py --output bench-main.json
+    python scripts/benchmark.py --baseline bench-main.json --threshold 0.25
+    python scripts/benchmark.py --filter prompts
+    python scripts/benchmark.py --filter history --profile profiles/
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from itertools import count
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+ROOT = Path(__file__).parent.parent
+
+# Add parent directory to path
+sys.path.insert(0, str(ROOT))
+
+HISTORY_SIZES = (20, 200, 1000)
+
+Benchmark = Tuple[str, Callable[[], object]]
+
+
+def long_response(lines: int) -> str:
+    """A discovery reply with a hallucinated "User:" line every 25 lines"""
+    return "\n".join(
+        f"User: I'm {20 + i % 40}" if i % 25 == 24
+        else f"That sounds great, line {i}: how many sessions a week could you commit to?"
+        for i in range(lines)
+    )
+
+
+def filter_benchmarks() -> List[Benchmark]:
+    from app.tasks.message_processor import _filter_hallucinated_responses
+
+    return [
+        (f"filter/{lines}_lines", lambda text=long_response(lines): _filter_hallucinated_responses(text))
+        for lines in (10, 200, 2000)
+    ]
+
+
+def prompt_benchmarks(pt) -> List[Benchmark]:
+    from app.prompts import PromptManager
+
+    overrides = {
+        "bio": "{pt_name} has coached for {years_experience} years.",
+        "discovery_prompt_override": "You are {pt_name}'s assistant. {pt_bio} Ask about {target_goals}.",
+        "qualification_prompt_override": "Score leads for {pt_name} in {location}, min £{min_budget}.",
+        "rejection_email_override": "Hi {lead_name}, {pt_name} focuses on {pt_specialty}; try {alternative_specialty}.",
+        "booking_confirmation_override": "Booked with {pt_name}: {availability_info}",
+        "intro_message_override": "Hi! I'm {pt_name}'s assistant.",
+    }
+    customised = type(pt)(**{
+        column.name: getattr(pt, column.name) for column in pt.__table__.columns
+    })
+    for field, value in overrides.items():
+        setattr(customised, field, value)
+
+    benchmarks = []
+    for source, preferences in (("file", pt), ("database", customised)):
+        manager = PromptManager(preferences)
+        benchmarks += [
+            (f"prompts/{source}/bio", manager.get_bio),
+            (f"prompts/{source}/discovery", manager.get_discovery_prompt),
+            (f"prompts/{source}/qualification", manager.get_qualification_prompt),
+            (f"prompts/{source}/rejection_email", lambda m=manager: m.get_rejection_email("Sam")),
+            (f"prompts/{source}/booking", lambda m=manager: m.get_booking_confirmation("Tue 9:00")),
+            (f"prompts/{source}/intro_message", manager.get_intro_message),
+        ]
+    return benchmarks
+
+
+def history_benchmarks(session_factory, conversations: Dict[int, int]) -> List[Benchmark]:
+    from app.tasks.message_processor import _conversation_history
+
+    def build(conversation_id: int):
+        db = session_factory()
+        try:
+            return _conversation_history(db, conversation_id)
+        finally:
+            db.close()
+
+    return [
+        (f"history/{size}_messages", lambda cid=conversation_id: build(cid))
+        for size, conversation_id in conversations.items()
+    ]
+
+
+def webhook_benchmark(phone: str) -> Benchmark:
+    from fastapi.testclient import TestClient
+
+    import app.api.webhooks.whatsapp as webhook
+    from main import app
+
+    async def skip_processing(**kwargs):
+        pass
+
+    webhook.process_message = skip_processing
+    client = TestClient(app)
+    sids = count()
+
+    def post():
+        response = client.post(
+            "/webhook/whatsapp",
+            data={
+                "From": f"whatsapp:{phone}",
+                "To": "whatsapp:+14155238886",
+                "Body": "I can train three times a week",
+                "MessageSid": f"SMBENCH{next(sids):024d}",
+            },
+        )
+        response.raise_for_status()
+
+    return "webhook/existing_conversation", post
+
+
+def lead_data_benchmark(session_factory, conversation_id: int) -> Benchmark:
+    from app.schemas.lead import ExtractedLeadData
+    from app.tasks.message_processor import _update_lead_data
+
+    versions = [
+        ExtractedLeadData(
+            goals="weight loss", age=30 + i, location="London", budget_range=f"£{200 + i}/month",
+            commitment_level=3, availability="mornings", has_all_info=False,
+        )
+        for i in range(2)
+    ]
+    turns = count()
+
+    def update():
+        db = session_factory()
+        try:
+            _update_lead_data(db, conversation_id, versions[next(turns) % 2])
+            db.commit()
+        finally:
+            db.close()
+
+    return "lead_data/update_commit", update
+
+
+def seed() -> Tuple[object, Dict[int, int], int, str]:
+    """A PT, one conversation per history size and a lead with LeadData"""
+    from app.database import SessionLocal, init_db
+    from app.models import Conversation, LeadData, Message, PTPreferences
+    from scripts.init_db import seed_pt_preferences
+
+    init_db()
+    seed_pt_preferences()
+    db = SessionLocal()
+    try:
+        pt = db.get(PTPreferences, 1)
+        db.expunge(pt)
+
+        conversations = {}
+        for size in HISTORY_SIZES:
+            conversation = Conversation(phone_number=f"+4470000{size:05d}", status="archived", pt_id=1)
+            db.add(conversation)
+            db.flush()
+            db.add_all(
+                Message(
+                    conversation_id=conversation.id,
+                    role="user" if i % 2 == 0 else "assistant",
+                    content=f"Message {i} about goals, budget and availability",
+                    timestamp=datetime(2025, 1, 1, tzinfo=timezone.utc).replace(
+                        minute=i // 60 % 60, second=i % 60, hour=i // 3600
+                    ),
+                )
+                for i in range(size)
+            )
+            conversations[size] = conversation.id
+
+        phone = "+447000099999"
+        lead = Conversation(phone_number=phone, status="active", pt_id=1)
+        db.add(lead)
+        db.flush()
+        db.add(LeadData(conversation_id=lead.id))
+        db.commit()
+        return pt, conversations, lead.id, phone
+    finally:
+        db.close()
+
+
+def measure(fn: Callable[[], object], rounds: int, min_round_seconds: float) -> Dict[str, float]:
+    """Median and best per-call microseconds over `rounds` calibrated rounds"""
+    fn()  # Warm up
+    number = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_round_seconds:
+            break
+        number *= 2 if elapsed == 0 else max(2, int(min_round_seconds / elapsed) + 1)
+
+    per_call = [elapsed / number]
+    for _ in range(rounds - 1):
+        started = time.perf_counter()
+        for _ in range(number):
+            fn()
+        per_call.append((time.perf_counter() - started) / number)
+    return {
+        "median_us": round(statistics.median(per_call) * 1e6, 3),
+        "min_us": round(min(per_call) * 1e6, 3),
+        "rounds": rounds,
+        "calls_per_round": number,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def regressions(results: dict, baseline: dict, threshold: float) -> List[str]:
+    found = []
+    for name, result in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if previous is None:
+            continue
+        change = result["median_us"] / previous["median_us"] - 1
+        if change > threshold:
+            found.append(
+                f"{name}: {previous['median_us']:.1f}us -> {result['median_us']:.1f}us ({change:+.0%})"
+            )
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=7)
+    parser.add_argument("--min-round-seconds", type=float, default=0.1)
+    parser.add_argument("--filter", default="", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.25, help="Allowed slowdown vs the baseline")
+    parser.add_argument("--profile", help="Write a CPU profile per benchmark to this directory")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = f"sqlite:///{Path(tempfile.mkdtemp()) / 'benchmark.db'}"
+    # Every webhook post comes from the same lead; keep the limiter in the
+    # path without it rejecting them
+    os.environ["RATE_LIMIT_PHONE_MAX"] = "1000000000"
+    os.environ["RATE_LIMIT_GLOBAL_MAX"] = "0"
+
+    from app.database import SessionLocal
+    from app.profiling import profiler
+
+    pt, conversations, lead_id, phone = seed()
+    logging.disable(logging.CRITICAL)
+
+    benchmarks: List[Benchmark] = [
+        *filter_benchmarks(),
+        *prompt_benchmarks(pt),
+        *history_benchmarks(SessionLocal, conversations),
+        webhook_benchmark(phone),
+        lead_data_benchmark(SessionLocal, lead_id),
+    ]
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else {}
+
+    results = {}
+    print(f"{'benchmark':<36}{'median us':>12}{'min us':>12}" + ("  vs baseline" if baseline else ""))
+    for name, fn in benchmarks:
+        if args.filter not in name:
+            continue
+        if args.profile:
+            path = Path(args.profile) / f"{name.replace('/', '-')}-{os.getpid()}.folded"
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with profiler.profile(path):
+                result = results[name] = measure(fn, args.rounds, args.min_round_seconds)
+        else:
+            result = results[name] = measure(fn, args.rounds, args.min_round_seconds)
+        line = f"{name:<36}{result['median_us']:>12.1f}{result['min_us']:>12.1f}"
+        previous = baseline.get("results", {}).get(name)
+        if previous:
+            line += f"  {result['median_us'] / previous['median_us'] - 1:+.0%}"
+        print(line)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            "commit": git_commit(),
+            "measured_at": datetime.now(timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }, indent=2))
+        print(f"\nWrote {args.output}")
+
+    if baseline:
+        slower = regressions(results, baseline, args.threshold)
+        if slower:
+            print(f"\n{len(slower)} regression(s) over {args.threshold:.0%} against {baseline.get('commit')}:")
+            for line in slower:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\nNo regressions over {args.threshold:.0%} against {baseline.get('commit')}")
+
+
+if __name__ == "__main__":
+    main()
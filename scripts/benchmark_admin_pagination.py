@@ -0,0 +1,146 @@
+"""
+Benchmark admin list pagination on a large messages table.
+
+Loads page 1 and page 10,000 of the Messages admin list with
+- OFFSET pagination and COUNT(*) on every page (SQLAdmin's default, used
+  whenever the list is sorted explicitly), and
+- the default listing (cached row count), reached the two ways a user can:
+  by jumping to the page number (a page link, typed page or "last page"),
+  which still uses OFFSET, and by clicking "next" on the page before it,
+  which follows the keyset cursor that page's link carries.
+
+Usage:
+    python scripts/benchmark_admin_pagination.py --rows 1000000
+"""
+import argparse
+import html
+import os
+import re
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+
+def seed_messages(engine, rows: int, batch_size: int = 50_000):
+    """Bulk insert synthetic conversations and messages"""
+    from app.models import Conversation, Message
+
+    start = datetime(2024, 1, 1)
+    conversations = max(rows // 20, 1)
+    with engine.begin() as conn:
+        conn.execute(
+            Conversation.__table__.insert(),
+            [
+                {"id": i, "phone_number": f"+44700{i:07d}", "status": "active", "pt_id": 1}
+                for i in range(1, conversations + 1)
+            ],
+        )
+
+    for offset in range(0, rows, batch_size):
+        batch = [
+            {
+                "conversation_id": (i % conversations) + 1,
+                "role": "user" if i % 2 else "assistant",
+                "content": f"Benchmark message {i} about weight loss and strength",
+                "timestamp": start + timedelta(seconds=i),
+            }
+            for i in range(offset, min(offset + batch_size, rows))
+        ]
+        with engine.begin() as conn:
+            conn.execute(Message.__table__.insert(), batch)
+        print(f"  inserted {offset + len(batch):,} / {rows:,}", end="\r")
+    print()
+
+
+def next_page_url(client, url: str) -> str:
+    """The "next" link of a list page, with the cursor the app put in it"""
+    response = client.get(url)
+    response.raise_for_status()
+    match = re.search(r'href="([^"]*\bafter=[^"]*)"', response.text)
+    if match is None:
+        raise SystemExit(f"No next-page link on {url}")
+    return html.unescape(match.group(1))
+
+
+def time_request(client, url: str, repeat: int) -> float:
+    """Median latency in milliseconds"""
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        response = client.get(url)
+        timings.append((time.perf_counter() - started) * 1000)
+        response.raise_for_status()
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--page", type=int, default=10_000)
+    parser.add_argument("--page-size", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--database-url",
+        help="Existing database to benchmark (default: a fresh temporary SQLite file)",
+    )
+    args = parser.parse_args()
+
+    seed = args.database_url is None
+    if seed:
+        db_path = Path(tempfile.mkdtemp()) / "benchmark.db"
+        os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    else:
+        os.environ["DATABASE_URL"] = args.database_url
+
+    # Import after DATABASE_URL is set so the app binds to the benchmark database
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+
+    from app.admin import setup_admin
+    from app.database import Base, engine
+
+    if seed:
+        Base.metadata.create_all(bind=engine)
+        print(f"Seeding {args.rows:,} messages into {db_path}...")
+        seed_messages(engine, args.rows)
+
+    app = FastAPI()
+    setup_admin(app)
+    client = TestClient(app)
+
+    base = f"/admin/message/list?pageSize={args.page_size}"
+    offset_sort = "&sortBy=timestamp&sort=desc"
+
+    # Warm up (fills the row count cache and the OS page cache)
+    client.get(f"{base}&page=1")
+
+    # "Next" as a user clicks it on the page before: that page is reached by
+    # its number (untimed), and its link carries the cursor
+    next_url = next_page_url(client, f"{base}&page={args.page - 1}")
+
+    cases = [
+        ("sorted: OFFSET + COUNT(*)", "page 1", f"{base}{offset_sort}&page=1"),
+        (
+            "sorted: OFFSET + COUNT(*)",
+            f"page {args.page:,}",
+            f"{base}{offset_sort}&page={args.page}",
+        ),
+        ("default: first page", "page 1", f"{base}&page=1"),
+        ("default: jump (OFFSET)", f"page {args.page:,}", f"{base}&page={args.page}"),
+        ("default: next (keyset)", f"page {args.page:,}", next_url),
+    ]
+
+    print(f"\nMessages admin list, {args.page_size} rows/page, median of {args.repeat} runs")
+    print(f"{'how the page is reached':<28}{'page':<14}{'ms':>10}")
+    for mode, page, url in cases:
+        print(f"{mode:<28}{page:<14}{time_request(client, url, args.repeat):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
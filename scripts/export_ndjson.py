@@ -0,0 +1,89 @@
+"""
+Export conversations, messages, leads and deletions as NDJSON with
+incremental sync.
+
+The last exported cursor per entity is kept in a state file, so running the
+command again only exports rows created or updated since.
+
+Usage:
+    python scripts/export_ndjson.py leads --output leads.ndjson
+    python scripts/export_ndjson.py messages --output - | gzip > messages.ndjson.gz
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from app.database import ReadSessionLocal
+from app.exports import EXPORT_ENTITIES
+from app.exports.ndjson import json_default, iter_rows
+
+
+def load_state(path: Path) -> dict:
+    if path.exists():
+        return json.loads(path.read_text())
+    return {}
+
+
+def save_state(path: Path, state: dict):
+    # Write then rename so an interrupted run never corrupts the state
+    tmp_path = path.with_suffix(path.suffix + ".tmp")
+    tmp_path.write_text(json.dumps(state, indent=2))
+    tmp_path.replace(path)
+
+
+def export(entity: str, output, after, limit, batch_size) -> tuple[int, str]:
+    """Write rows as NDJSON and return (row count, last cursor)"""
+    db = ReadSessionLocal()
+    count = 0
+    last_cursor = after
+
+    try:
+        for record in iter_rows(db, entity, after, limit, batch_size):
+            output.write(json.dumps(record, default=json_default))
+            output.write("\n")
+            count += 1
+            last_cursor = record["_cursor"]
+    finally:
+        db.close()
+
+    return count, last_cursor
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("entity", choices=sorted(EXPORT_ENTITIES))
+    parser.add_argument(
+        "--output", default="-", help="Output file, appended to (default: stdout)"
+    )
+    parser.add_argument(
+        "--state-file",
+        default=".export_state.json",
+        help="Where the last cursor per entity is kept (default: .export_state.json)",
+    )
+    parser.add_argument("--after", help="Start after this cursor (overrides the state file)")
+    parser.add_argument("--full", action="store_true", help="Ignore the state file and export everything")
+    parser.add_argument("--limit", type=int, help="Maximum rows to export in this run")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    state_path = Path(args.state_file)
+    state = load_state(state_path)
+    after = args.after or (None if args.full else state.get(args.entity))
+
+    if args.output == "-":
+        count, last_cursor = export(args.entity, sys.stdout, after, args.limit, args.batch_size)
+    else:
+        with open(args.output, "a", encoding="utf-8") as output:
+            count, last_cursor = export(args.entity, output, after, args.limit, args.batch_size)
+
+    if last_cursor:
+        state[args.entity] = last_cursor
+        save_state(state_path, state)
+
+    print(f"Exported {count} {args.entity} rows (cursor: {last_cursor})", file=sys.stderr)
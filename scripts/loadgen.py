@@ -0,0 +1,532 @@
+"""
+Load generator: thousands of simulated WhatsApp leads against the webhook.
+
+Serves the app in-process (uvicorn on a local port) with offline fakes in
+place of the LLM (pydantic_ai.Agent) and Twilio (the WhatsApp client), then
+has each lead follow a scripted persona over real HTTP:
+
+- think time between messages, waiting for the bot's reply first
+- bursts of several messages in quick succession
+- Twilio redeliveries of a message already sent (same MessageSid)
+- new_chat and clear_chat part way through a conversation
+
+Reported as p50 / p95 / p99 / max:
+
+- ack: webhook response time (what Twilio waits for)
+- reply: from a lead's message to the next message the bot sends them
+- queue depth: messages accepted but not yet processed, LLM calls queued
+  and outbound messages pending, sampled every --sample-seconds
+- db connections in use (pool saturation), also sampled
+- db lock wait: time spent in INSERT/UPDATE/DELETE statements, which under
+  SQLite write contention is mostly waiting for the database lock
+
+Save a run with --output and compare the next release against it with
+--baseline.
+
+--profile DIR samples the CPU of the whole run (server and simulated
+leads, one flame-graph root per thread) into DIR/loadgen-cpu-<pid>.folded.
+--profile-memory DIR snapshots allocations once the app is up and again
+after the leads have drained; the diff file shows what the run left
+allocated. Both use app.profiling, like the /debug/profile endpoints.
+tracemalloc makes the run an order of magnitude slower, so use a small
+--leads and don't compare its latencies.
+
+Usage:
+    python scripts/loadgen.py --leads 2000 --ramp-seconds 30
+    python scripts/loadgen.py --leads 500 --llm-latency 2 --output run.json
+    python scripts/loadgen.py --leads 500 --baseline run.json
+    python scripts/loadgen.py --leads 500 --profile profiles/
+    python scripts/loadgen.py --leads 20 --profile-memory profiles/
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict, deque
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+PT_NUMBER = "+14155238886"
+
+# Each step is a message; a list is a burst sent without waiting for a reply
+PERSONAS = {
+    "qualified": [
+        "Hi, I'm interested in personal training",
+        "I want to lose about 10kg and get stronger",
+        "I'm 32",
+        "I live in Shoreditch, London",
+        "3 times a week, mornings before work",
+        "I can do £250 a month",
+        "Weekday mornings work best",
+    ],
+    "low_budget": [
+        "Hey how much do you charge?",
+        "Just want to tone up a bit",
+        "I'm 24, in Croydon",
+        "Maybe once a week",
+        "My budget is about £60 a month",
+    ],
+    "burster": [
+        ["hi", "saw your ad", "interested in training"],
+        ["I want to build muscle", "and fix my back pain"],
+        "I'm 41, based in Camden",
+        ["twice a week", "evenings", "£200 a month is fine"],
+        "Tuesday or Thursday evenings",
+    ],
+    "restarter": [
+        "Hello! Looking for a PT",
+        "Weight loss mainly",
+        "new_chat",
+        "Hi again, actually I'm asking for my partner",
+        "She's 35 and wants to get fit for a wedding",
+        "We're in Islington, £300 a month, 3x a week",
+    ],
+    "clearer": [
+        "hi",
+        "general fitness",
+        "clear_chat",
+        "Hi, I'd like to start training",
+        "Strength and mobility, I'm 50, in Hackney",
+        "twice a week, £220 a month",
+    ],
+}
+PERSONA_WEIGHTS = {"qualified": 4, "low_budget": 2, "burster": 2, "restarter": 1, "clearer": 1}
+
+
+def percentiles(values: List[float]) -> dict:
+    if not values:
+        return {"count": 0, "p50": None, "p95": None, "p99": None, "max": None}
+    ordered = sorted(values)
+
+    def at(percentile: float) -> float:
+        return round(ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))], 4)
+
+    return {
+        "count": len(ordered),
+        "p50": at(50),
+        "p95": at(95),
+        "p99": at(99),
+        "max": round(ordered[-1], 4),
+    }
+
+
+class Recorder:
+    """Latency samples and reply tracking shared by the leads and the fakes"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.ack: List[float] = []
+        self.reply: List[float] = []
+        self.processing_depth: List[int] = []
+        self.llm_queued: List[int] = []
+        self.outbox_pending: List[int] = []
+        self.db_checked_out: List[int] = []
+        self.db_lock_wait: List[float] = []
+        self.db_locked_errors = 0
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.in_processing = 0
+        self._unanswered: Dict[str, deque] = defaultdict(deque)  # phone -> sent_at
+        self._replied: Dict[str, asyncio.Event] = defaultdict(asyncio.Event)
+        self._db_lock = threading.Lock()
+
+    def sent(self, phone: str) -> None:
+        self._unanswered[phone].append(time.monotonic())
+        self._replied[phone].clear()
+
+    def replied(self, phone: str) -> None:
+        """Called on the event loop when the bot sends `phone` a message"""
+        now = time.monotonic()
+        self.counts["outbound"] += 1
+        pending = self._unanswered[phone]
+        while pending:
+            self.reply.append(now - pending.popleft())
+        self._replied[phone].set()
+
+    async def wait_for_reply(self, phone: str, timeout: float) -> bool:
+        try:
+            await asyncio.wait_for(self._replied[phone].wait(), timeout)
+            return True
+        except asyncio.TimeoutError:
+            self.counts["reply_timeouts"] += 1
+            return False
+
+    def db_write(self, seconds: float) -> None:
+        with self._db_lock:
+            self.db_lock_wait.append(seconds)
+
+
+# Offline fakes
+
+
+class FakeLLM:
+    """Stands in for pydantic_ai.Agent: sleeps a sampled latency, returns canned output"""
+
+    latency = 1.0
+    error_rate = 0.0
+
+    def __init__(self, model=None, system_prompt: str = "", output_type=str, **kwargs):
+        self.output_type = output_type
+
+    async def run(self, prompt: str):
+        await asyncio.sleep(random.lognormvariate(0, 0.5) * self.latency)
+        if random.random() < self.error_rate:
+            raise RuntimeError("Fake LLM error")
+        return SimpleNamespace(output=self._output(prompt))
+
+    def _output(self, prompt: str):
+        from app.schemas.lead import ExtractedLeadData, QualificationScore
+
+        if self.output_type is ExtractedLeadData:
+            budget = re.findall(r"£(\d+)", prompt)
+            return ExtractedLeadData(
+                goals="weight loss",
+                age=30,
+                location="London",
+                budget_range=f"£{budget[-1]}/month" if budget else None,
+                commitment_level=6,
+                availability="weekday mornings",
+                has_all_info=bool(budget) and len(re.findall(r"(?im)^user:", prompt)) >= 4,
+            )
+        if self.output_type is QualificationScore:
+            budget = re.findall(r"£(\d+)", prompt)
+            qualified = bool(budget) and int(budget[-1]) >= 150
+            return QualificationScore(
+                overall_score=80 if qualified else 30,
+                is_qualified=qualified,
+                reasoning="Load test",
+                recommended_action="book_call" if qualified else "send_rejection",
+            )
+        return "Thanks! Could you tell me a bit more about that?"
+
+
+class FakeTwilio:
+    """Stands in for twilio.rest.Client; reports each send to the recorder"""
+
+    def __init__(self, recorder: Recorder, latency: float):
+        self.recorder = recorder
+        self.latency = latency
+        self.messages = self
+        self._sids = iter(range(1, 10**12))
+
+    def create(self, from_: str, body: str, to: str):
+        time.sleep(random.lognormvariate(0, 0.3) * self.latency)
+        phone = to.replace("whatsapp:", "")
+        self.recorder.loop.call_soon_threadsafe(self.recorder.replied, phone)
+        return SimpleNamespace(sid=f"SMFAKE{next(self._sids):020d}")
+
+
+def install_fakes(recorder: Recorder, args) -> None:
+    import pydantic_ai
+    from sqlalchemy import event
+
+    import app.api.webhooks.whatsapp as webhook
+    from app.database import engine
+    from app.services import whatsapp_service
+
+    FakeLLM.latency = args.llm_latency
+    FakeLLM.error_rate = args.llm_error_rate
+    pydantic_ai.Agent = FakeLLM  # The agents import it per call
+    whatsapp_service._client = FakeTwilio(recorder, args.twilio_latency)
+
+    # Count messages handed to processing but not finished
+    process_message = webhook.process_message
+
+    async def counted(*a, **kw):
+        recorder.in_processing += 1
+        try:
+            await process_message(*a, **kw)
+        finally:
+            recorder.in_processing -= 1
+
+    webhook.process_message = counted
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["loadgen_started"] = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip()[:6].upper() in ("INSERT", "UPDATE", "DELETE"):
+            recorder.db_write(time.perf_counter() - conn.info.pop("loadgen_started"))
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        if "locked" in str(context.original_exception):
+            recorder.db_locked_errors += 1
+
+
+# Leads
+
+
+async def post(client, recorder: Recorder, phone: str, body: str, sid: str) -> None:
+    data = {
+        "From": f"whatsapp:{phone}",
+        "To": f"whatsapp:{PT_NUMBER}",
+        "Body": body,
+        "MessageSid": sid,
+        "NumMedia": "0",
+        "ProfileName": "Load Test",
+    }
+    started = time.monotonic()
+    try:
+        response = await client.post("/webhook/whatsapp", data=data)
+        response.raise_for_status()
+    except Exception:
+        recorder.counts["post_errors"] += 1
+        return
+    recorder.ack.append(time.monotonic() - started)
+
+
+async def run_lead(index: int, client, recorder: Recorder, args, rng: random.Random) -> None:
+    persona = rng.choices(list(PERSONA_WEIGHTS), weights=list(PERSONA_WEIGHTS.values()))[0]
+    phone = f"+44770{index:07d}"
+    await asyncio.sleep(rng.uniform(0, args.ramp_seconds))
+    recorder.counts[f"persona_{persona}"] += 1
+
+    for step, messages in enumerate(PERSONAS[persona]):
+        burst = messages if isinstance(messages, list) else [messages]
+        for position, body in enumerate(burst):
+            if position:
+                await asyncio.sleep(rng.uniform(0.2, 1.0))
+            sid = f"SM{index:08d}{step:03d}{position:02d}"
+            command = body in ("new_chat", "clear_chat")
+            if not command:
+                recorder.sent(phone)
+            await post(client, recorder, phone, body, sid)
+            recorder.counts["commands" if command else "inbound"] += 1
+            if rng.random() < args.retry_rate:
+                # Twilio redelivers when it thinks the webhook failed
+                await asyncio.sleep(rng.uniform(0.1, 1.0))
+                await post(client, recorder, phone, body, sid)
+                recorder.counts["redeliveries"] += 1
+        if burst[-1] not in ("new_chat", "clear_chat"):
+            await recorder.wait_for_reply(phone, args.reply_timeout)
+        await asyncio.sleep(rng.expovariate(1 / args.think_seconds) if args.think_seconds else 0)
+
+
+async def sample(recorder: Recorder, every: float, stop: asyncio.Event) -> None:
+    from app.agents.limiter import llm_limiter
+    from app.database import engine
+    from app.services import outbox_service
+
+    while not stop.is_set():
+        recorder.processing_depth.append(recorder.in_processing)
+        recorder.llm_queued.append(llm_limiter.stats()["queued"])
+        recorder.db_checked_out.append(engine.pool.checkedout())
+        outbox = await asyncio.to_thread(outbox_service.stats)
+        recorder.outbox_pending.append(outbox["pending"] + outbox["sending"])
+        try:
+            await asyncio.wait_for(stop.wait(), every)
+        except asyncio.TimeoutError:
+            pass
+
+
+async def drain(recorder: Recorder, timeout: float) -> None:
+    """Wait for processing and the outbox to empty"""
+    from app.services import outbox_service
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        outbox = await asyncio.to_thread(outbox_service.stats)
+        if not recorder.in_processing and not outbox["pending"] and not outbox["sending"]:
+            return
+        await asyncio.sleep(0.5)
+    print(f"Still busy after {timeout:.0f}s drain, reporting anyway")
+
+
+async def memory_snapshot(directory: str, when: str) -> None:
+    """Snapshot allocations while the app is up; the second one is diffed"""
+    from app.profiling import memory_profiler
+
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    snapshot = await asyncio.to_thread(
+        memory_profiler.snapshot, Path(directory) / f"loadgen-memory-{when}-{os.getpid()}.folded"
+    )
+    if "growth" not in snapshot:
+        return
+    memory_profiler.stop()
+    print(f"Memory growth during the run: {snapshot['diff_file']}")
+    for growth in snapshot["growth"][:5]:
+        print(f"  {growth['size_diff_kb']:+10.1f} KiB  {growth['where']}")
+
+
+async def run(args) -> dict:
+    import httpx
+    import uvicorn
+
+    from main import app
+
+    logging.getLogger().setLevel(args.log_level)
+    recorder = Recorder(asyncio.get_running_loop())
+    install_fakes(recorder, args)
+
+    # The app gets its own thread and event loop, so a stalled app shows up
+    # in the client's timings instead of pausing the client too
+    server = uvicorn.Server(
+        uvicorn.Config(app, host="127.0.0.1", port=args.port, log_level="warning", lifespan="on")
+    )
+    serving = threading.Thread(target=server.run, name="app", daemon=True)
+    serving.start()
+    while not server.started:
+        if not serving.is_alive():
+            raise RuntimeError(f"Could not start the app on port {args.port}")
+        await asyncio.sleep(0.05)
+    port = server.servers[0].sockets[0].getsockname()[1]
+    seed_pt()
+    if args.profile_memory:
+        await memory_snapshot(args.profile_memory, "before")
+
+    stop = asyncio.Event()
+    sampler = asyncio.create_task(sample(recorder, args.sample_seconds, stop))
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    started = time.monotonic()
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60
+    ) as client:
+        print(f"Running {args.leads} leads (ramp {args.ramp_seconds}s)...")
+        await asyncio.gather(
+            *(
+                run_lead(index, client, recorder, args, random.Random(rng.random()))
+                for index in range(args.leads)
+            )
+        )
+    await drain(recorder, args.drain_seconds)
+    elapsed = time.monotonic() - started
+    stop.set()
+    await sampler
+    if args.profile_memory:
+        await memory_snapshot(args.profile_memory, "after")
+
+    from app.middleware import rate_limiter
+
+    server.should_exit = True
+    await asyncio.to_thread(serving.join)
+
+    return {
+        "config": {
+            key: getattr(args, key)
+            for key in (
+                "leads", "ramp_seconds", "think_seconds", "retry_rate", "llm_latency",
+                "llm_error_rate", "twilio_latency", "seed",
+            )
+        },
+        "elapsed_seconds": round(elapsed, 1),
+        "throughput_per_second": round(recorder.counts["inbound"] / elapsed, 1),
+        "metrics": {
+            "ack_seconds": percentiles(recorder.ack),
+            "reply_seconds": percentiles(recorder.reply),
+            "processing_depth": percentiles(recorder.processing_depth),
+            "llm_queued": percentiles(recorder.llm_queued),
+            "outbox_pending": percentiles(recorder.outbox_pending),
+            "db_connections_in_use": percentiles(recorder.db_checked_out),
+            "db_lock_wait_seconds": percentiles(recorder.db_lock_wait),
+        },
+        "counts": {
+            **dict(sorted(recorder.counts.items())),
+            "db_locked_errors": recorder.db_locked_errors,
+            "rate_limited": sum(rate_limiter.stats()["rejected"].values()),
+        },
+    }
+
+
+def seed_pt() -> None:
+    from app.database import SessionLocal
+    from app.models import PTPreferences
+    from scripts.init_db import seed_pt_preferences
+
+    with SessionLocal() as db:
+        if db.get(PTPreferences, 1) is not None:
+            return
+    seed_pt_preferences()
+
+
+def report(result: dict, baseline: Optional[dict]) -> None:
+    print(
+        f"\n{result['counts'].get('inbound', 0)} messages in {result['elapsed_seconds']}s "
+        f"({result['throughput_per_second']}/s)"
+    )
+    header = f"{'metric':<24}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}"
+    print(header + ("    p99 vs baseline" if baseline else ""))
+    for name, values in result["metrics"].items():
+        cells = "".join(
+            f"{values[key]:>10.3f}" if values[key] is not None else f"{'-':>10}"
+            for key in ("p50", "p95", "p99", "max")
+        )
+        line = f"{name:<24}{cells}"
+        previous = (baseline or {}).get("metrics", {}).get(name, {}).get("p99")
+        if previous and values["p99"] is not None:
+            line += f"    {(values['p99'] - previous) / previous:+.0%}"
+        print(line)
+    print("\n" + ", ".join(f"{key}={value}" for key, value in result["counts"].items()))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--leads", type=int, default=1000)
+    parser.add_argument("--ramp-seconds", type=float, default=10.0, help="Spread lead start times over this long")
+    parser.add_argument("--think-seconds", type=float, default=2.0, help="Mean pause after a reply")
+    parser.add_argument("--reply-timeout", type=float, default=30.0, help="Give up waiting for a reply after")
+    parser.add_argument("--retry-rate", type=float, default=0.02, help="Share of messages Twilio redelivers")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Median fake LLM call seconds")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0)
+    parser.add_argument("--twilio-latency", type=float, default=0.1, help="Median fake Twilio send seconds")
+    parser.add_argument("--connections", type=int, default=200, help="Concurrent HTTP connections")
+    parser.add_argument("--sample-seconds", type=float, default=0.5)
+    parser.add_argument("--drain-seconds", type=float, default=120.0)
+    parser.add_argument("--port", type=int, default=0, help="Port to serve the app on (default: any free one)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--database-url", help="Database to use (default: a fresh temporary SQLite file)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--profile", help="Write a CPU profile of the run to this directory")
+    parser.add_argument("--profile-memory", help="Write memory snapshots from before and after the run here")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url or (
+        f"sqlite:///{Path(tempfile.mkdtemp()) / 'loadgen.db'}"
+    )
+    os.environ.setdefault("TWILIO_WHATSAPP_NUMBER", PT_NUMBER)
+    # Process in this process, where the fakes are installed
+    os.environ["WORKER_PROCESSES"] = "0"
+    # Measure the pipeline, not Twilio's pacing or the global flood limit;
+    # set these explicitly to load test with them
+    os.environ.setdefault("OUTBOX_SENDER_RATE", "1000")
+    os.environ.setdefault("OUTBOX_SENDER_BURST", "1000")
+    os.environ.setdefault("OUTBOX_RECIPIENT_BURST", "10")
+    os.environ.setdefault("OUTBOX_MAX_IN_FLIGHT", "64")
+    os.environ.setdefault("OUTBOX_POLL_SECONDS", "0.1")
+    os.environ.setdefault("RATE_LIMIT_GLOBAL_MAX", "0")
+
+    from app.profiling import profiler
+
+    if args.profile:
+        Path(args.profile).mkdir(parents=True, exist_ok=True)
+        profiler.start(path=Path(args.profile) / f"loadgen-cpu-{os.getpid()}.folded")
+
+    result = asyncio.run(run(args))
+
+    if args.profile:
+        summary = profiler.stop()
+        print(f"CPU profile: {summary['file']} ({summary['samples']} samples)")
+    baseline = json.loads(Path(args.baseline).read_text()) if args.baseline else None
+    report(result, baseline)
+    if args.output:
+        Path(args.output).write_text(json.dumps(result, indent=2))
+        print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Local SMTP sink for offline email tests.
+
+Accepts every message and throws it away (or appends it to an mbox file),
+printing throughput as it goes. Point the app at it with:
+
+    EMAIL_TRANSPORT=smtp EMAIL_SMTP_HOST=localhost EMAIL_SMTP_PORT=1025
+
+Usage:
+    python scripts/smtp_sink.py --port 1025
+    python scripts/smtp_sink.py --mbox sent.mbox --latency-ms 20
+"""
+import argparse
+import asyncio
+import mailbox
+import time
+from email import message_from_bytes
+from typing import Optional
+
+
+class Sink:
+    def __init__(self, mbox_path: Optional[str], latency: float, report_every: float):
+        self.mbox = mailbox.mbox(mbox_path) if mbox_path else None
+        self.latency = latency
+        self.report_every = report_every
+        self.messages = 0
+        self.connections = 0
+        self.started = None
+        self._reported = 0
+
+    def delivered(self, data: bytes):
+        if self.started is None:
+            self.started = time.monotonic()
+        self.messages += 1
+        if self.mbox is not None:
+            self.mbox.add(message_from_bytes(data))
+            self.mbox.flush()
+
+    async def report(self):
+        while True:
+            await asyncio.sleep(self.report_every)
+            if self.messages == self._reported:
+                continue
+            elapsed = time.monotonic() - self.started
+            print(
+                f"{self.messages} messages over {self.connections} connections, "
+                f"{self.messages / elapsed:.1f} msg/s",
+                flush=True,
+            )
+            self._reported = self.messages
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self.connections += 1
+
+        async def reply(line: str):
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 smtp-sink ready")
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                command = line.decode(errors="replace").strip()
+                verb = command[:4].upper()
+
+                if verb == "EHLO":
+                    writer.write(b"250-smtp-sink\r\n250-8BITMIME\r\n250 SMTPUTF8\r\n")
+                    await writer.drain()
+                elif verb == "HELO":
+                    await reply("250 smtp-sink")
+                elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                    await reply("250 OK")
+                elif verb == "DATA":
+                    await reply("354 End data with <CR><LF>.<CR><LF>")
+                    data = bytearray()
+                    while True:
+                        chunk = await reader.readline()
+                        if chunk in (b".\r\n", b".\n", b""):
+                            break
+                        # Undo dot-stuffing
+                        data += chunk[1:] if chunk.startswith(b"..") else chunk
+                    if self.latency:
+                        await asyncio.sleep(self.latency)
+                    self.delivered(bytes(data))
+                    await reply("250 OK queued")
+                elif verb == "QUIT":
+                    await reply("221 Bye")
+                    break
+                else:
+                    await reply("502 Command not implemented")
+        finally:
+            writer.close()
+
+
+async def main(args):
+    sink = Sink(args.mbox, args.latency_ms / 1000, args.report_every)
+    server = await asyncio.start_server(sink.handle, args.host, args.port)
+    print(f"SMTP sink listening on {args.host}:{args.port}", flush=True)
+    async with server:
+        await asyncio.gather(server.serve_forever(), sink.report())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--mbox", help="Append received messages to this mbox file")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Delay before accepting each message")
+    parser.add_argument("--report-every", type=float, default=2.0, help="Seconds between throughput lines")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(main(args))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,91 @@
+"""
+Report where cold-start time goes when importing the app.
+
+Runs `python -X importtime -c "import main"` in a fresh interpreter and
+prints the slowest imports (cumulative, including their own imports) and
+the total per top-level package.
+
+Usage:
+    python scripts/startup_report.py
+    python scripts/startup_report.py --module main --top 40 --json report.json
+"""
+import argparse
+import json
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+
+
+def import_times(module: str) -> tuple[list[dict], float]:
+    """Per-module import times (microseconds) and wall-clock seconds"""
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        sys.exit(result.stderr)
+
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append(
+            {
+                "module": name.strip(),
+                "depth": (len(name) - len(name.lstrip()) - 1) // 2,
+                "self_us": int(self_us),
+                "cumulative_us": int(cumulative_us),
+            }
+        )
+    return rows, wall
+
+
+def by_package(rows: list[dict]) -> dict:
+    """Self time summed per top-level package"""
+    totals = defaultdict(int)
+    for row in rows:
+        totals[row["module"].split(".")[0]] += row["self_us"]
+    return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--module", default="main", help="Module to import (default: main)")
+    parser.add_argument("--top", type=int, default=25, help="Rows per table")
+    parser.add_argument("--json", help="Also write the full report to this file")
+    args = parser.parse_args()
+
+    rows, wall = import_times(args.module)
+    root = next(row for row in rows if row["module"] == args.module)
+    packages = by_package(rows)
+
+    print(f"import {args.module}: {root['cumulative_us'] / 1000:.0f} ms "
+          f"({wall:.2f} s wall including interpreter start)\n")
+
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for row in sorted(rows, key=lambda r: r["cumulative_us"], reverse=True)[: args.top]:
+        print(f"{row['cumulative_us'] / 1000:>14.1f} {row['self_us'] / 1000:>9.1f}  "
+              f"{'  ' * row['depth']}{row['module']}")
+
+    print(f"\n{'self ms':>9}  package")
+    for package, self_us in list(packages.items())[: args.top]:
+        print(f"{self_us / 1000:>9.1f}  {package}")
+
+    if args.json:
+        Path(args.json).write_text(
+            json.dumps(
+                {"module": args.module, "wall_seconds": wall, "packages_us": packages, "imports": rows},
+                indent=2,
+            )
+        )
@@ -0,0 +1,55 @@
+"""Shared fixtures: every test session runs against a fresh SQLite file"""
+import os
+import sys
+import tempfile
+from itertools import count
+from pathlib import Path
+
+import pytest
+
+# Settings are read once, on first import of the app
+os.environ["DATABASE_URL"] = f"sqlite:///{Path(tempfile.mkdtemp()) / 'test.db'}"
+os.environ["CALENDAR_PROVIDER"] = ""
+os.environ["TRACING_ENABLED"] = "False"
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+_phones = count(1)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    from app.database import init_db
+    from scripts.init_db import seed_pt_preferences
+
+    init_db()
+    seed_pt_preferences()
+
+
+@pytest.fixture
+def db():
+    from app.database import SessionLocal
+
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def make_conversation(db):
+    """Creates a conversation (with empty LeadData) for PT 1"""
+    from app.models import Conversation, LeadData
+
+    def make(status: str = "active") -> Conversation:
+        conversation = Conversation(
+            phone_number=f"+4470000{next(_phones):05d}", status=status, pt_id=1
+        )
+        db.add(conversation)
+        db.flush()
+        db.add(LeadData(conversation_id=conversation.id))
+        db.commit()
+        return conversation
+
+    return make
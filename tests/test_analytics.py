@@ -0,0 +1,108 @@
+"""Lead aggregates: incremental updates (app and admin) agree with a rebuild"""
+import asyncio
+from datetime import date, datetime
+
+import pytest
+from starlette.applications import Starlette
+from starlette.requests import Request
+
+from app.admin import ConversationAdmin, LeadDataAdmin, setup_admin
+from app.analytics import (
+    forget_lead,
+    rebuild_aggregates,
+    record_new_lead,
+    record_score,
+    record_status_change,
+)
+from app.models import Conversation, LeadDailyStats, LeadData, LeadScoreBucket
+
+# A creation day no other test uses, so only these leads are compared
+DAY = date(2040, 2, 2)
+
+
+@pytest.fixture(scope="module")
+def views():
+    admin = setup_admin(Starlette())
+    return {type(view): view for view in admin.views}
+
+
+def _request():
+    return Request({"type": "http", "method": "POST", "path": "/", "headers": []})
+
+
+def _lead(db, status="active", pt_id=1, score=None):
+    conversation = Conversation(
+        phone_number="+447222000000",
+        status=status,
+        pt_id=pt_id,
+        created_at=datetime(2040, 2, 2, 9),
+    )
+    db.add(conversation)
+    record_new_lead(db, conversation)
+    db.flush()
+    lead_data = LeadData(conversation_id=conversation.id, qualification_score=score)
+    db.add(lead_data)
+    if score is not None:
+        record_score(db, conversation, score)
+    db.commit()
+    return conversation, lead_data
+
+
+def _aggregates(db):
+    statuses = {
+        (row.pt_id, row.status): row.lead_count
+        for row in db.query(LeadDailyStats).filter_by(day=DAY)
+        if row.lead_count
+    }
+    scores = {
+        (row.pt_id, row.bucket): (row.lead_count, row.score_sum)
+        for row in db.query(LeadScoreBucket).filter_by(day=DAY)
+        if row.lead_count
+    }
+    return statuses, scores
+
+
+def test_incremental_aggregates_match_rebuild(db, views):
+    # Through the app's own paths
+    qualified, _ = _lead(db, score=85)
+    record_status_change(db, qualified, "qualified")
+    rejected, _ = _lead(db, score=20)
+    record_status_change(db, rejected, "rejected")
+    cleared, cleared_lead = _lead(db, score=55)
+    forget_lead(db, cleared, cleared_lead)
+    db.delete(cleared)
+    db.commit()
+
+    # Through the admin
+    conversations, leads = views[ConversationAdmin], views[LeadDataAdmin]
+    edited, _ = _lead(db, score=40)
+    moved, _ = _lead(db, score=70)
+    deleted, _ = _lead(db, status="qualified", score=90)
+    _, rescored_lead = _lead(db, score=30)
+    _, unscored_lead = _lead(db, score=60)
+
+    async def edit():
+        await conversations.update_model(
+            _request(),
+            str(edited.id),
+            {"phone_number": edited.phone_number, "status": "rejected", "pt_id": 1},
+        )
+        await conversations.update_model(
+            _request(),
+            str(moved.id),
+            {"phone_number": moved.phone_number, "status": "qualified", "pt_id": 2},
+        )
+        await conversations.delete_model(_request(), str(deleted.id))
+        await leads.update_model(_request(), str(rescored_lead.id), {"qualification_score": 95})
+        await leads.delete_model(_request(), str(unscored_lead.id))
+
+    asyncio.run(edit())
+
+    db.expire_all()
+    incremental = _aggregates(db)
+    assert incremental[0][(2, "qualified")] == 1
+    assert incremental[1][(1, 8)] == (1, 85)  # The deleted 90 is gone
+    assert incremental[1][(1, 9)] == (1, 95)
+
+    rebuild_aggregates(db)
+    assert _aggregates(db) == incremental
@@ -0,0 +1,117 @@
+"""Slot holds: lookups, concurrent holds and hold/confirm races"""
+import random
+import threading
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import update
+
+from app.models import BookedSlot
+from app.services.availability import (
+    DatabaseAvailability,
+    InMemoryAvailability,
+    WorkingHours,
+    next_free_index,
+)
+
+HOURS = WorkingHours()
+
+
+def _window(week: int):
+    """A Monday-to-Monday window of its own for each test"""
+    earliest = datetime(2031, 1, 6) + timedelta(weeks=week)
+    return earliest, earliest + timedelta(weeks=1)
+
+
+def _expire_holds(db, pt_id: int) -> None:
+    db.execute(
+        update(BookedSlot)
+        .where(BookedSlot.pt_id == pt_id, BookedSlot.status == "held")
+        .values(hold_expires_at=datetime.now(timezone.utc) - timedelta(minutes=1))
+    )
+    db.commit()
+
+
+def test_next_free_index_matches_linear_scan():
+    rng = random.Random(7)
+    for _ in range(200):
+        booked = sorted(rng.sample(range(60), rng.randint(0, 50)))
+        start = rng.randrange(60)
+        expected = next(i for i in range(start, 200) if i not in booked)
+        assert next_free_index(booked, start) == expected
+
+
+@pytest.mark.parametrize("backend", [InMemoryAvailability, DatabaseAvailability])
+def test_confirm_and_release_only_touch_own_hold(backend):
+    availability = backend(HOURS)
+    earliest, latest = _window(0 if backend is InMemoryAvailability else 1)
+    slot = availability.hold(1, earliest, latest, hold_minutes=10, conversation_id=101)
+
+    assert not availability.confirm(1, slot, "link", conversation_id=202)
+    availability.release(1, slot, conversation_id=202)
+    assert availability.find_free_slot(1, earliest, latest) != slot
+
+    assert availability.confirm(1, slot, "link", conversation_id=101)
+    assert not availability.confirm(1, slot, "link", conversation_id=101)  # Already booked
+    availability.release(1, slot, conversation_id=101)
+    assert availability.find_free_slot(1, earliest, latest) == slot
+
+
+def test_expired_hold_cannot_confirm_another_leads_hold(db):
+    availability = DatabaseAvailability(HOURS)
+    earliest, latest = _window(2)
+    ours = availability.hold(1, earliest, latest, hold_minutes=10, conversation_id=301)
+    _expire_holds(db, 1)
+
+    # Our hold lapsed, so the next lead is given the same slot
+    theirs = availability.hold(1, earliest, latest, hold_minutes=10, conversation_id=302)
+    assert theirs == ours
+
+    assert not availability.confirm(1, ours, "link", conversation_id=301)
+    availability.release(1, ours, conversation_id=301)
+    row = db.query(BookedSlot).filter_by(pt_id=1, slot_index=HOURS.slot_index(ours)).one()
+    assert (row.conversation_id, row.status) == (302, "held")
+    assert availability.confirm(1, theirs, "link", conversation_id=302)
+
+
+@pytest.mark.parametrize("backend", [InMemoryAvailability, DatabaseAvailability])
+def test_lapsed_hold_gives_its_slot_back(backend):
+    availability = backend(HOURS)
+    earliest, latest = _window(5 if backend is InMemoryAvailability else 6)
+    lapsed = availability.hold(1, earliest, latest, hold_minutes=0, conversation_id=601)
+
+    # The abandoned hold blocks nothing and can no longer be confirmed
+    assert availability.find_free_slot(1, earliest, latest) == lapsed
+    assert availability.hold(1, earliest, latest, hold_minutes=10, conversation_id=602) == lapsed
+    assert not availability.confirm(1, lapsed, "link", conversation_id=601)
+    assert availability.confirm(1, lapsed, "link", conversation_id=602)
+
+
+def test_expired_hold_is_not_confirmed(db):
+    availability = DatabaseAvailability(HOURS)
+    earliest, latest = _window(3)
+    slot = availability.hold(1, earliest, latest, hold_minutes=10, conversation_id=401)
+    _expire_holds(db, 1)
+    assert not availability.confirm(1, slot, "link", conversation_id=401)
+
+
+def test_concurrent_holds_get_distinct_slots():
+    availability = DatabaseAvailability(HOURS)
+    earliest, latest = _window(4)
+    held = []
+    barrier = threading.Barrier(8)
+
+    def hold(conversation_id: int):
+        barrier.wait()
+        held.append(
+            availability.hold(1, earliest, latest, hold_minutes=10, conversation_id=conversation_id)
+        )
+
+    threads = [threading.Thread(target=hold, args=(500 + i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert None not in held
+    assert len(set(held)) == 8
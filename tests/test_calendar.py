@@ -0,0 +1,78 @@
+"""Free/busy cache locking and booking conflicts with the PT's calendar"""
+import threading
+from datetime import datetime, timedelta
+
+from app.models import Message, OutboundMessage
+from app.services.availability import InMemoryAvailability, WorkingHours
+from app.services.calendar import CalendarService
+from app.services.calendar_provider import LocalCalendarProvider
+from app.services.freebusy import FreeBusyCache
+
+HOURS = WorkingHours()
+
+
+class _BlockingProvider(LocalCalendarProvider):
+    """Stalls free/busy reads for one PT until released"""
+
+    def __init__(self, slow_pt: int):
+        super().__init__()
+        self.slow_pt = slow_pt
+        self.entered = threading.Event()
+        self.release = threading.Event()
+
+    def free_busy(self, pt_id, start, end):
+        if pt_id == self.slow_pt:
+            self.entered.set()
+            assert self.release.wait(5)
+        return super().free_busy(pt_id, start, end)
+
+
+def test_slow_calendar_does_not_block_other_pts():
+    provider = _BlockingProvider(slow_pt=1)
+    cache = FreeBusyCache(provider, HOURS)
+    start = datetime(2031, 3, 3)
+    slow = threading.Thread(target=cache.busy_slots, args=(1, start, start + timedelta(days=7)))
+    slow.start()
+    try:
+        assert provider.entered.wait(5)
+        # PT 1's read is still in flight
+        done = threading.Event()
+        threading.Thread(
+            target=lambda: (cache.busy_slots(2, start, start + timedelta(days=7)), done.set())
+        ).start()
+        assert done.wait(2)
+        assert cache.stats()["full_refreshes"] == 1
+    finally:
+        provider.release.set()
+        slow.join()
+    assert cache.stats()["full_refreshes"] == 2
+
+
+def test_conflicting_booking_is_moved_and_lead_told(db, make_conversation):
+    conversation = make_conversation("qualified")
+    provider = LocalCalendarProvider()
+    service = CalendarService(backend=InMemoryAvailability(HOURS), provider=provider)
+    try:
+        slot = service.reserve_next_available_slot(conversation_id=conversation.id)
+        link = service.confirm_slot(slot, conversation_id=conversation.id)
+        # The PT fills the slot in their own calendar before our write lands
+        provider.add_event(1, slot, slot + timedelta(hours=1))
+        service.write_calendar_event(slot, link, "Sam", conversation.phone_number, "Strength")
+        service.writes.flush()
+
+        assert service.writes.conflicts == 1
+        assert service.backend.booked_by(1, slot) is None
+
+        # The lead is re-booked at the next free slot, written to the PT's calendar
+        service.writes.flush()
+        assert service.writes.written == 1
+        events = provider.free_busy(1, slot, slot + timedelta(days=14)).events
+        (moved,) = [event.start for event in events if event.start != slot]
+        assert service.backend.booked_by(1, moved) == conversation.id
+
+        told = db.query(Message).filter_by(conversation_id=conversation.id).one()
+        assert "has just been taken" in told.content
+        outbound = db.query(OutboundMessage).filter_by(conversation_id=conversation.id).one()
+        assert outbound.body == told.content
+    finally:
+        service.shutdown()
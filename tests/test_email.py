@@ -0,0 +1,78 @@
+"""Rejection emails: persisted when queued, recovered on start, sent once"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.models import EmailDelivery, LeadData
+from app.services.email import EmailService
+
+
+def _rejected_lead(db, make_conversation, email="lead@example.com"):
+    conversation = make_conversation("rejected")
+    lead = db.query(LeadData).filter_by(conversation_id=conversation.id).one()
+    lead.email = email
+    lead.name = "Sam"
+    db.commit()
+    return conversation.id
+
+
+def _delivery(db, conversation_id):
+    db.expire_all()
+    return db.query(EmailDelivery).filter_by(conversation_id=conversation_id).one()
+
+
+async def _run(*services):
+    for service in services:
+        service.start()
+    for service in services:
+        await service.stop()
+
+
+def test_email_queued_without_workers_is_sent_on_start(db, make_conversation):
+    conversation_id = _rejected_lead(db, make_conversation)
+
+    # Queued while no workers run (or lost with the process that queued it)
+    assert EmailService().queue_rejection_email(conversation_id)
+    delivery = _delivery(db, conversation_id)
+    assert (delivery.status, delivery.to_email) == ("pending", "lead@example.com")
+
+    asyncio.run(_run(EmailService()))
+    delivery = _delivery(db, conversation_id)
+    assert delivery.status == "sent"
+    assert delivery.subject and delivery.sent_at is not None
+
+
+def test_lead_without_email_is_skipped(db, make_conversation):
+    conversation_id = _rejected_lead(db, make_conversation, email=None)
+    service = EmailService()
+    assert not service.queue_rejection_email(conversation_id)
+    assert service.skipped == 1
+    assert db.query(EmailDelivery).filter_by(conversation_id=conversation_id).count() == 0
+
+
+def test_stale_claim_is_sent_again_and_fresh_claim_is_left(db, make_conversation):
+    stale_id = _rejected_lead(db, make_conversation)
+    fresh_id = _rejected_lead(db, make_conversation)
+    EmailService().queue_rejection_email(stale_id)
+    EmailService().queue_rejection_email(fresh_id)
+    now = datetime.now(timezone.utc)
+    stale, fresh = _delivery(db, stale_id), _delivery(db, fresh_id)
+    stale.status, stale.claimed_at = "sending", now - timedelta(hours=1)
+    fresh.status, fresh.claimed_at = "sending", now
+    db.commit()
+
+    asyncio.run(_run(EmailService()))
+    assert _delivery(db, stale_id).status == "sent"
+    # Still being sent by another process
+    assert _delivery(db, fresh_id).status == "sending"
+
+
+def test_processes_sharing_pending_rows_send_each_once(db, make_conversation):
+    conversation_ids = [_rejected_lead(db, make_conversation) for _ in range(5)]
+    for conversation_id in conversation_ids:
+        EmailService().queue_rejection_email(conversation_id)
+
+    services = [EmailService(), EmailService()]
+    asyncio.run(_run(*services))
+    assert sum(service.sent for service in services) == 5
+    for conversation_id in conversation_ids:
+        assert _delivery(db, conversation_id).status == "sent"
@@ -0,0 +1,186 @@
+"""Incremental exports: cursor resume, the safety window and tombstones"""
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from fastapi.testclient import TestClient
+from starlette.applications import Starlette
+from starlette.requests import Request
+
+from app.exports import ndjson
+from app.exports.ndjson import iter_rows
+from app.models import Message
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Sets the export's idea of now; rows are timestamped hours ahead so
+    they sort after anything other tests wrote"""
+
+    class Clock(datetime):
+        at = _now()
+
+        @classmethod
+        def now(cls, tz=None):
+            return cls.at
+
+        @classmethod
+        def fromisoformat(cls, value):
+            return datetime.fromisoformat(value)
+
+    monkeypatch.setattr(ndjson, "datetime", Clock)
+    return Clock
+
+
+def _sync(db, entity, after=None, limit=None, window=0.0):
+    rows = list(iter_rows(db, entity, after=after, limit=limit, safety_window_seconds=window))
+    return rows, (rows[-1]["_cursor"] if rows else after)
+
+
+def _add_messages(db, conversation_id, timestamps):
+    messages = [
+        Message(conversation_id=conversation_id, role="user", content="hi", timestamp=timestamp)
+        for timestamp in timestamps
+    ]
+    db.add_all(messages)
+    db.commit()
+    return [message.id for message in messages]
+
+
+def test_resume_from_cursor_has_no_gaps_or_repeats(db, make_conversation, clock):
+    anchor = clock.at = _now() + timedelta(hours=1)
+    _, start = _sync(db, "messages")
+    conversation = make_conversation()
+    # Pairs of rows share a watermark, so resuming relies on the id tie-break
+    ids = _add_messages(db, conversation.id, [anchor + timedelta(seconds=n // 2) for n in range(9)])
+
+    clock.at = anchor + timedelta(minutes=1)
+    seen, cursor = [], start
+    while True:
+        rows, cursor = _sync(db, "messages", after=cursor, limit=2)
+        if not rows:
+            break
+        seen.extend(row["id"] for row in rows)
+    assert seen == ids
+
+
+def test_late_commit_inside_safety_window_is_not_skipped(db, make_conversation, clock):
+    anchor = clock.at = _now() + timedelta(hours=2)
+    _, cursor = _sync(db, "messages")
+    conversation = make_conversation()
+    early = _add_messages(db, conversation.id, [anchor])
+    recent = _add_messages(db, conversation.id, [anchor + timedelta(seconds=20)])
+
+    clock.at = anchor + timedelta(seconds=25)
+    rows, cursor = _sync(db, "messages", after=cursor, window=10)
+    assert [row["id"] for row in rows] == early  # The recent row has not settled
+
+    # A transaction that started earlier commits now, behind the recent row
+    late = _add_messages(db, conversation.id, [anchor + timedelta(seconds=10)])
+    clock.at = anchor + timedelta(minutes=1)
+    rows, _ = _sync(db, "messages", after=cursor, window=10)
+    assert [row["id"] for row in rows] == late + recent
+
+
+def test_clear_chat_exports_tombstones(db, make_conversation):
+    from main import app
+
+    _, cursor = _sync(db, "deletions")
+    conversation = make_conversation()
+    message_ids = _add_messages(db, conversation.id, [_now(), _now()])
+    lead_id = conversation.lead_data.id
+
+    response = TestClient(app).post(
+        "/webhook/whatsapp",
+        data={
+            "From": f"whatsapp:{conversation.phone_number}",
+            "To": "",
+            "Body": "clear_chat",
+            "MessageSid": "SM-clear-1",
+        },
+    )
+    assert response.status_code == 200
+
+    rows, _ = _sync(db, "deletions", after=cursor)
+    assert sorted((row["entity"], row["record_id"]) for row in rows) == sorted(
+        [("messages", message_id) for message_id in message_ids]
+        + [("leads", lead_id), ("conversations", conversation.id)]
+    )
+    # Held back while they might still be overtaken
+    assert list(iter_rows(db, "deletions", after=cursor)) == []
+
+
+def test_snapshot_appends_late_commits_and_tombstones(db, make_conversation, clock, tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    from main import app
+    from app.exports.ndjson import encode_cursor
+    from app.exports.snapshot import STATE_FILE, write_snapshot
+
+    def snapshot():
+        write_snapshot(db, tmp_path, safety_window_seconds=10)
+        return json.loads((tmp_path / STATE_FILE).read_text())
+
+    anchor = clock.at = _now() + timedelta(hours=3)
+    snapshot()
+    first, second = make_conversation(), make_conversation()
+    early = _add_messages(db, first.id, [anchor])
+    recent = _add_messages(db, first.id, [anchor + timedelta(seconds=20)])
+
+    clock.at = anchor + timedelta(seconds=25)
+    state = snapshot()
+    # The cursor stops at the last settled message, not the newest one
+    assert state["message_stats"] == encode_cursor(anchor.replace(tzinfo=None), early[0])
+
+    # Commits late, behind the newest message but after the settled cursor
+    _add_messages(db, second.id, [anchor + timedelta(seconds=10)])
+    clock.at = anchor + timedelta(minutes=1)
+    state = snapshot()
+    assert state["message_stats"] == encode_cursor(
+        (anchor + timedelta(seconds=20)).replace(tzinfo=None), recent[0]
+    )
+    stats = pq.read_table(tmp_path / "message_stats").to_pylist()
+    assert second.id in {row["conversation_id"] for row in stats}
+
+    lead_id = second.lead_data.id
+    TestClient(app).post(
+        "/webhook/whatsapp",
+        data={
+            "From": f"whatsapp:{second.phone_number}",
+            "To": "",
+            "Body": "clear_chat",
+            "MessageSid": "SM-clear-2",
+        },
+    )
+    clock.at = anchor + timedelta(minutes=2)
+    snapshot()
+    deletions = pq.read_table(tmp_path / "deletions").to_pylist()
+    tombstones = {(row["entity"], row["record_id"]) for row in deletions}
+    assert {("conversations", second.id), ("leads", lead_id)} <= tombstones
+
+
+def test_admin_deletes_export_tombstones(db, make_conversation):
+    from app.admin import ConversationAdmin, MessageAdmin, setup_admin
+
+    views = {type(view): view for view in setup_admin(Starlette()).views}
+    request = Request({"type": "http", "method": "POST", "path": "/", "headers": []})
+    _, cursor = _sync(db, "deletions")
+    conversation = make_conversation()
+    kept, removed = _add_messages(db, conversation.id, [_now(), _now()])
+    lead_id = conversation.lead_data.id
+
+    async def delete():
+        await views[MessageAdmin].delete_model(request, str(removed))
+        await views[ConversationAdmin].delete_model(request, str(conversation.id))
+
+    asyncio.run(delete())
+
+    rows, _ = _sync(db, "deletions", after=cursor)
+    assert sorted((row["entity"], row["record_id"]) for row in rows) == sorted(
+        [("messages", removed), ("messages", kept), ("leads", lead_id)]
+        + [("conversations", conversation.id)]
+    )
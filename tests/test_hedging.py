@@ -0,0 +1,96 @@
+"""Hedged agent calls: when a hedge fires, the budget cap and the losing attempt"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.agents import hedging
+from app.agents.hedging import Hedger
+
+
+@pytest.fixture
+def make_hedger(monkeypatch):
+    """A hedger with 20 fast samples (hedge delay 10ms) and a limiter with room"""
+    monkeypatch.setattr(hedging, "llm_limiter", SimpleNamespace(idle_slots=lambda: 1))
+
+    def make(budget: float = 1.0) -> Hedger:
+        hedger = Hedger("test")
+        hedger.settings = hedger.settings.model_copy(
+            update={
+                "llm_hedging_enabled": True,
+                "llm_hedge_percentile": 50.0,
+                "llm_hedge_min_samples": 20,
+                "llm_hedge_budget": budget,
+            }
+        )
+        for _ in range(20):
+            hedger.attempts.add(0.01)
+        return hedger
+
+    return make
+
+
+def _slow_then_fast(log: list):
+    """First attempt hangs until cancelled, later ones return straight away"""
+
+    async def attempt():
+        n = len(log)
+        log.append("started")
+        if n == 0:
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                log.append("cancelled")
+                raise
+            return "slow"
+        return "fast"
+
+    return attempt
+
+
+def test_hedge_wins_and_slow_attempt_is_cancelled_and_counted(make_hedger):
+    hedger = make_hedger()
+
+    async def call():
+        log = []
+        result = await hedger.run(_slow_then_fast(log))
+        await asyncio.sleep(0)  # Let the cancelled attempt unwind
+        return result, log
+
+    result, log = asyncio.run(call())
+    assert result == "fast"
+    assert log == ["started", "started", "cancelled"]
+    assert (hedger.hedged, hedger.hedge_wins) == (1, 1)
+    # The hedge's latency and a lower bound for the cancelled attempt, which
+    # had run for at least the hedge delay
+    assert len(hedger.attempts.recent) == 22
+    assert max(hedger.attempts.recent) >= 0.01
+
+
+def test_fast_call_is_not_hedged(make_hedger):
+    hedger = make_hedger()
+
+    async def attempt():
+        return "ok"
+
+    assert asyncio.run(hedger.run(attempt)) == "ok"
+    assert hedger.hedged == 0
+
+
+def test_hedges_are_capped_by_budget(make_hedger):
+    # Half a hedge of credit per call, starting from none
+    hedger = make_hedger(budget=0.5)
+    hedger._credit = 0
+
+    async def attempt():
+        await asyncio.sleep(0.05)  # Always past the hedge delay
+        return "ok"
+
+    async def calls():
+        hedged = []
+        for _ in range(4):
+            await hedger.run(attempt)
+            hedged.append(hedger.hedged)
+        return hedged
+
+    assert asyncio.run(calls()) == [0, 1, 1, 2]
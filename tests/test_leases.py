@@ -0,0 +1,157 @@
+"""Conversation leases: fencing tokens and stale-writer protection"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import update
+
+from app.leases import LeaseLost, lease_manager
+from app.models import BookedSlot, ConversationLease, LeadData, Message
+from app.schemas.lead import ExtractedLeadData, QualificationScore
+
+
+def _expire(db, conversation_id: int) -> None:
+    """Make the current lease look abandoned, as after a stalled worker"""
+    db.execute(
+        update(ConversationLease)
+        .where(ConversationLease.conversation_id == conversation_id)
+        .values(expires_at=datetime.now(timezone.utc) - timedelta(seconds=1))
+    )
+    db.commit()
+
+
+def test_token_increments_on_every_acquisition(make_conversation):
+    conversation = make_conversation()
+    first = lease_manager.try_acquire(conversation.id)
+    assert first.token == 1
+    assert lease_manager.try_acquire(conversation.id) is None  # Still held
+
+    lease_manager.release(first)
+    second = lease_manager.try_acquire(conversation.id)
+    assert second.token == 2
+    lease_manager.release(second)
+
+
+def test_stale_holder_cannot_commit(db, make_conversation):
+    conversation = make_conversation()
+    stale = lease_manager.try_acquire(conversation.id)
+    _expire(db, conversation.id)
+    current = lease_manager.try_acquire(conversation.id)
+    assert current.token == stale.token + 1
+
+    db.info["lease"] = stale
+    db.add(Message(conversation_id=conversation.id, role="assistant", content="stale reply"))
+    with pytest.raises(LeaseLost):
+        db.commit()
+    db.rollback()
+    assert stale.lost
+
+    db.info["lease"] = current
+    db.add(Message(conversation_id=conversation.id, role="assistant", content="current reply"))
+    db.commit()
+    lease_manager.release(current)
+
+
+def test_renew_and_check_detect_takeover(db, make_conversation):
+    conversation = make_conversation()
+    lease = lease_manager.try_acquire(conversation.id)
+    assert lease_manager.renew(lease)
+    lease_manager.check(lease)
+
+    _expire(db, conversation.id)
+    lease_manager.try_acquire(conversation.id)
+    with pytest.raises(LeaseLost):
+        lease_manager.check(lease)
+    assert not lease_manager.renew(lease)
+
+
+def test_lost_lease_leaves_no_booking_and_no_score(db, make_conversation, monkeypatch):
+    from app.services import calendar_service, outbox_service
+    from app.tasks.message_processor import _handle_qualified_lead
+
+    conversation = make_conversation()
+    stale = lease_manager.try_acquire(conversation.id)
+    db.info["lease"] = stale
+
+    # Taken over between the hold and the commit
+    reserve = calendar_service.reserve_next_available_slot
+
+    def reserve_then_lose(**kwargs):
+        slot = reserve(**kwargs)
+        _expire(db, conversation.id)
+        lease_manager.try_acquire(conversation.id)
+        return slot
+
+    monkeypatch.setattr(calendar_service, "reserve_next_available_slot", reserve_then_lose)
+    enqueued = []
+    monkeypatch.setattr(outbox_service, "enqueue", lambda *a, **kw: enqueued.append(a))
+
+    score = QualificationScore(
+        overall_score=80, is_qualified=True, reasoning="fit", recommended_action="book_call"
+    )
+    with pytest.raises(LeaseLost):
+        asyncio.run(
+            _handle_qualified_lead(
+                conversation.id, conversation.phone_number, ExtractedLeadData(has_all_info=True), score, db
+            )
+        )
+    db.rollback()
+    db.info.pop("lease")
+
+    assert db.query(BookedSlot).filter_by(conversation_id=conversation.id).count() == 0
+    assert db.query(LeadData).filter_by(conversation_id=conversation.id).one().is_qualified is None
+    assert enqueued == []
+
+
+def test_qualified_lead_commits_score_with_booking(db, make_conversation, monkeypatch):
+    from app.services import outbox_service
+    from app.tasks.message_processor import _handle_qualified_lead
+
+    from app.services import calendar_service
+
+    conversation = make_conversation()
+    lease = lease_manager.try_acquire(conversation.id)
+    db.info["lease"] = lease
+    enqueued = []
+    monkeypatch.setattr(outbox_service, "enqueue", lambda *a, **kw: enqueued.append(a))
+    events = []
+    monkeypatch.setattr(calendar_service, "write_calendar_event", lambda *a, **kw: events.append(kw))
+
+    score = QualificationScore(
+        overall_score=80, is_qualified=True, reasoning="fit", recommended_action="book_call"
+    )
+    lead = ExtractedLeadData(has_all_info=True, name="Alex", goals="Run a marathon")
+    asyncio.run(
+        _handle_qualified_lead(conversation.id, conversation.phone_number, lead, score, db)
+    )
+    db.info.pop("lease")
+    lease_manager.release(lease)
+
+    slot = db.query(BookedSlot).filter_by(conversation_id=conversation.id).one()
+    assert slot.status == "booked"
+    assert db.query(LeadData).filter_by(conversation_id=conversation.id).one().qualification_score == 80
+    assert len(enqueued) == 1
+    assert events[0]["lead_name"] == "Alex"
+
+
+def test_message_waiting_too_long_for_the_lease_is_kept(db, make_conversation, monkeypatch):
+    from app.services import outbox_service
+    from app.tasks.message_processor import process_message
+
+    conversation = make_conversation()
+    holder = lease_manager.try_acquire(conversation.id)
+    monkeypatch.setattr(
+        lease_manager,
+        "settings",
+        lease_manager.settings.model_copy(update={"conversation_lease_wait_seconds": 0.1}),
+    )
+    enqueued = []
+    monkeypatch.setattr(outbox_service, "enqueue", lambda *a, **kw: enqueued.append(a))
+
+    for _ in range(2):  # The second is Twilio redelivering it
+        asyncio.run(process_message(conversation.id, "+447000000000", "I'm 34", "SM-busy-1"))
+    lease_manager.release(holder)
+
+    saved = db.query(Message).filter_by(twilio_message_sid="SM-busy-1").all()
+    assert [(m.role, m.content) for m in saved] == [("user", "I'm 34")]
+    assert len(enqueued) == 2
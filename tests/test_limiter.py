@@ -0,0 +1,122 @@
+"""LLM limiter: weighted fair queueing, guarantees, eviction and shedding"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from app.agents.limiter import LLMLimiter, LLMOverloaded
+
+# pt_id -> (llm_weight, llm_min_share)
+PTS = {1: (2.0, 0.0), 2: (1.0, 0.0), 3: (10.0, 0.0), 4: (0.01, 0.5)}
+
+
+@pytest.fixture(autouse=True)
+def pts(monkeypatch):
+    monkeypatch.setattr(
+        "app.agents.limiter.pt_cache",
+        SimpleNamespace(get=lambda pt_id: SimpleNamespace(
+            llm_weight=PTS[pt_id][0], llm_min_share=PTS[pt_id][1]
+        )),
+    )
+
+
+def _limiter(max_concurrency: int, max_queue: int) -> LLMLimiter:
+    limiter = LLMLimiter()
+    limiter.max_concurrency = max_concurrency
+    limiter.max_queue = max_queue
+    return limiter
+
+
+async def _call(limiter, pt_id, started, hold=None, timeout=5.0):
+    async with limiter.slot(pt_id=pt_id, timeout=timeout):
+        started.append(pt_id)
+        if hold is not None:
+            await hold.wait()
+
+
+async def _queue(limiter, calls, started, blockers=1, blocker_pt=2):
+    """Occupy `blockers` slots, queue `calls` (pt ids) behind them, then free the slots"""
+    gate = asyncio.Event()
+    running = [
+        asyncio.create_task(_call(limiter, blocker_pt, [], gate)) for _ in range(blockers)
+    ]
+    await asyncio.sleep(0)
+    queued = [asyncio.create_task(_call(limiter, pt_id, started)) for pt_id in calls]
+    await asyncio.sleep(0)
+    gate.set()
+    return await asyncio.gather(*running, *queued, return_exceptions=True)
+
+
+def test_slots_are_shared_in_proportion_to_weight():
+    limiter = _limiter(max_concurrency=1, max_queue=100)
+    started = []
+    asyncio.run(_queue(limiter, [1] * 12 + [2] * 12, started))
+    first = started[:9]
+    assert first.count(1) == 6 and first.count(2) == 3
+    assert limiter.stats()["in_flight"] == 0 and limiter.stats()["queued"] == 0
+
+
+def test_guaranteed_share_beats_virtual_time():
+    limiter = _limiter(max_concurrency=2, max_queue=100)
+
+    async def scenario():
+        # PT 4 has a tiny weight, so after one call its virtual time is far
+        # ahead; its 50% guarantee still gets it the next free slot
+        await _call(limiter, 4, [])
+        started = []
+        await _queue(limiter, [3, 3, 3, 4], started, blockers=2, blocker_pt=3)
+        return started
+
+    assert asyncio.run(scenario())[0] == 4
+
+
+def test_full_queue_evicts_the_pt_most_over_its_share():
+    limiter = _limiter(max_concurrency=1, max_queue=2)
+
+    async def scenario():
+        gate = asyncio.Event()
+        blocker = asyncio.create_task(_call(limiter, 2, [], gate))
+        await asyncio.sleep(0)
+        started = []
+        first = [asyncio.create_task(_call(limiter, 2, started)) for _ in range(2)]
+        await asyncio.sleep(0)
+        newcomer = asyncio.create_task(_call(limiter, 1, started))
+        await asyncio.sleep(0)
+        # PT 2 has one waiter and PT 1 one: neither is over its share now
+        with pytest.raises(LLMOverloaded) as shed:
+            await _call(limiter, 2, started)
+        assert shed.value.reason == "queue_full"
+        gate.set()
+        results = await asyncio.gather(blocker, *first, newcomer, return_exceptions=True)
+        return results, started
+
+    results, started = asyncio.run(scenario())
+    evicted = [r for r in results if isinstance(r, LLMOverloaded)]
+    assert len(evicted) == 1 and evicted[0].reason == "queue_full"
+    assert sorted(started) == [1, 2]
+    assert limiter.shed["queue_full"] == 2
+
+
+def test_zero_queue_sheds_instead_of_failing():
+    limiter = _limiter(max_concurrency=1, max_queue=0)
+    results = asyncio.run(_queue(limiter, [1], []))
+    assert isinstance(results[1], LLMOverloaded)
+    assert results[1].reason == "queue_full"
+
+
+def test_waiter_times_out_and_leaves_the_queue():
+    limiter = _limiter(max_concurrency=1, max_queue=10)
+
+    async def scenario():
+        gate = asyncio.Event()
+        blocker = asyncio.create_task(_call(limiter, 2, [], gate))
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloaded) as shed:
+            await _call(limiter, 1, [], timeout=0.05)
+        queued = limiter.stats()["queued"]
+        gate.set()
+        await blocker
+        return shed.value.reason, queued
+
+    assert asyncio.run(scenario()) == ("timeout", 0)
+    assert limiter.stats()["in_flight"] == 0
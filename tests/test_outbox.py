@@ -0,0 +1,37 @@
+"""Outbox scheduler: claims left by a process that died are released"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.models import OutboundMessage
+from app.services.outbox import OutboxService
+
+
+def test_running_scheduler_releases_stale_claims(db, monkeypatch):
+    service = OutboxService()
+    service.settings = service.settings.model_copy(update={"outbox_claim_timeout_seconds": 1})
+
+    async def no_sends():
+        return 0.05
+
+    monkeypatch.setattr(service, "_dispatch", no_sends)
+
+    async def run():
+        service.start()
+        await asyncio.sleep(0.1)
+        # Claimed by another process, which then died mid-send
+        message = OutboundMessage(
+            from_number="whatsapp:+14155238886",
+            to_phone="+447000099999",
+            body="Hi",
+            status="sending",
+            next_attempt_at=datetime.now(timezone.utc) - timedelta(minutes=5),
+        )
+        db.add(message)
+        db.commit()
+        await asyncio.sleep(1.2)
+        await service.stop()
+        return message.id
+
+    message_id = asyncio.run(run())
+    db.expire_all()
+    assert db.get(OutboundMessage, message_id).status == "pending"
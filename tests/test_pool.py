@@ -0,0 +1,96 @@
+"""Worker pool: job arguments and commands answered over the results queue"""
+import json
+import os
+import time
+
+import pytest
+
+from app.workers.pool import WorkerPool
+
+
+@pytest.fixture
+def pool(tmp_path, monkeypatch):
+    # Read by the spawned workers' settings
+    monkeypatch.setenv("PROFILING_DIR", str(tmp_path))
+    pool = WorkerPool()
+    pool.start(2)
+    yield pool
+    pool.stop()
+
+
+def test_profile_commands_reach_every_worker(pool, tmp_path):
+    started = pool.call("profile_cpu_start", {"seconds": 30, "interval": 0.01}, timeout=60)
+    assert sorted(started) == [0, 1]
+    pids = {reply["pid"] for reply in started.values()}
+    assert len(pids) == 2 and os.getpid() not in pids
+    for reply in started.values():
+        assert reply["running"] and f"-{reply['pid']}-" in reply["file"]
+
+    stopped = pool.call("profile_cpu_stop", timeout=30)
+    assert {shard: reply["file"] for shard, reply in stopped.items()} == {
+        shard: reply["file"] for shard, reply in started.items()
+    }
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted(
+        os.path.basename(reply["file"]) for reply in stopped.values()
+    )
+
+
+def test_call_without_workers_returns_no_replies():
+    assert WorkerPool().call("profile_status", timeout=0.1) == {}
+
+
+async def record_call(**kwargs):
+    """Pool handler that writes its arguments to RECORD_CALLS_TO"""
+    with open(os.environ["RECORD_CALLS_TO"], "a") as f:
+        f.write(json.dumps(kwargs) + "\n")
+
+
+def test_job_passes_received_at_to_the_handler(tmp_path, monkeypatch):
+    calls = tmp_path / "calls.jsonl"
+    monkeypatch.setenv("RECORD_CALLS_TO", str(calls))
+    pool = WorkerPool(handler="tests.test_pool:record_call")
+    pool.start(1)
+    try:
+        pool.submit(1, "+447000000001", "hi", "SM-1", received_at=123.5)
+        before = time.time()
+        pool.submit(1, "+447000000001", "again", "SM-2")
+        deadline = time.monotonic() + 60
+        while pool.stats()["depth"] and time.monotonic() < deadline:
+            time.sleep(0.1)
+    finally:
+        pool.stop()
+
+    first, second = [json.loads(line) for line in calls.read_text().splitlines()]
+    assert first["received_at"] == 123.5
+    # Without one, the time it was queued
+    assert before <= second["received_at"] <= time.time()
+
+
+async def count_message(**kwargs):
+    """Pool handler that only records metrics"""
+    from app.metrics import fallback_messages, messages_in_flight
+
+    fallback_messages.inc("pool-test")
+    messages_in_flight.inc()  # Left in flight, as if the worker died mid-message
+
+
+def test_worker_metrics_are_scraped_by_the_web_process():
+    from app.metrics import fallback_messages, messages_in_flight, render
+
+    pool = WorkerPool(handler="tests.test_pool:count_message")
+    pool.start(2)
+    try:
+        for n in range(6):
+            pool.submit(n, f"+4470000099{n:02d}", "hi", f"SM-metrics-{n}")
+        deadline = time.monotonic() + 60
+        while fallback_messages.collect().get(("pool-test",), [0])[0] < 6:
+            assert time.monotonic() < deadline
+            time.sleep(0.2)
+        assert messages_in_flight.collect()[()][0] == 6
+        assert 'ptbot_fallback_messages_total{reason="pool-test"} 6' in render()
+    finally:
+        pool.stop()
+
+    # Counts survive the workers; what they had in flight does not
+    assert fallback_messages.collect()[("pool-test",)][0] == 6
+    assert messages_in_flight.collect().get((), [0])[0] == 0
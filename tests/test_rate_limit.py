@@ -0,0 +1,77 @@
+"""Sliding-window rate limits on the WhatsApp webhook"""
+import asyncio
+
+from app.middleware.rate_limit import GLOBAL_KEY, MemoryWindows, RateLimiter, sender_from_form
+
+
+def _limiter(phone_max, phone_window, global_max, global_window) -> RateLimiter:
+    limiter = RateLimiter()
+    limiter.settings = limiter.settings.model_copy(update={
+        "rate_limit_phone_max": phone_max,
+        "rate_limit_phone_window_seconds": phone_window,
+        "rate_limit_global_max": global_max,
+        "rate_limit_global_window_seconds": global_window,
+        "rate_limit_redis_url": "",
+    })
+    return limiter
+
+
+def _check_at(limiter: RateLimiter, phone: str, now: float, monkeypatch):
+    monkeypatch.setattr("app.middleware.rate_limit.time.time", lambda: now)
+    return asyncio.run(limiter.check(phone))
+
+
+def test_window_allows_limit_then_rejects():
+    windows = MemoryWindows()
+    results = [asyncio.run(windows.hit("a", 3, 60, 600.0 + i)) for i in range(5)]
+    assert results == [True, True, True, False, False]
+
+
+def test_previous_window_is_weighted():
+    windows = MemoryWindows()
+    for i in range(4):
+        assert asyncio.run(windows.hit("a", 4, 60, 600.0 + i))
+    # Halfway into the next window, half of the previous 4 hits still count
+    assert [asyncio.run(windows.hit("a", 4, 60, 690.0)) for _ in range(3)] == [True, True, False]
+    # Two windows later the history is gone
+    assert asyncio.run(windows.hit("a", 4, 60, 800.0))
+
+
+def test_short_global_window_does_not_prune_phone_counts(monkeypatch):
+    # Phone 10 per 60s, global window 1s. Messages without a sender only hit
+    # the global window, and pruning on its window used to forget every
+    # phone counter
+    limiter = _limiter(10, 60.0, 1000, 1.0)
+    allowed = 0
+    for i in range(50):
+        _check_at(limiter, None, 1020.0 + i * 0.5, monkeypatch)
+        allowed += _check_at(limiter, "+447000000001", 1020.0 + i * 0.5, monkeypatch) is None
+    assert allowed == 10
+
+
+def test_stale_keys_are_pruned_by_their_own_window():
+    windows = MemoryWindows()
+    asyncio.run(windows.hit("phone", 10, 60, 1000.0))
+    asyncio.run(windows.hit(GLOBAL_KEY, 10, 1, 1000.0))
+    asyncio.run(windows.hit(GLOBAL_KEY, 10, 1, 1010.0))  # Prunes
+    assert len(windows) == 2  # The phone key is still within its window
+    asyncio.run(windows.hit(GLOBAL_KEY, 10, 1, 1200.0))
+    assert len(windows) == 1
+
+
+def test_global_rejection_does_not_use_up_phone_quota(monkeypatch):
+    limiter = _limiter(2, 60.0, 1, 60.0)
+    assert _check_at(limiter, "+447000000002", 1000.0, monkeypatch) is None
+    for i in range(5):
+        assert _check_at(limiter, "+447000000003", 1001.0 + i, monkeypatch) == "global"
+
+    # The global window has passed; the second sender still has its quota
+    limiter.settings = limiter.settings.model_copy(update={"rate_limit_global_max": 0})
+    assert _check_at(limiter, "+447000000003", 1010.0, monkeypatch) is None
+    assert _check_at(limiter, "+447000000003", 1011.0, monkeypatch) is None
+    assert _check_at(limiter, "+447000000003", 1012.0, monkeypatch) == "phone"
+
+
+def test_sender_from_form():
+    assert sender_from_form(b"Body=hi&From=whatsapp%3A%2B447000000004") == "+447000000004"
+    assert sender_from_form(b"Body=hi") is None
@@ -0,0 +1,145 @@
+"""Circuit breaker: opening on errors and slow calls, half-open probes"""
+import pytest
+
+from app import resilience
+from app.resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpen
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(resilience.time, "monotonic", clock)
+    return clock
+
+
+def _breaker(**overrides) -> CircuitBreaker:
+    breaker = CircuitBreaker("test", slow_call_seconds=1.0, **overrides)
+    breaker.window_seconds = 10
+    breaker.min_calls = 4
+    breaker.failure_rate = 0.5
+    breaker.slow_call_rate = 0.5
+    breaker.open_seconds = 30
+    breaker.half_open_probes = 2
+    return breaker
+
+
+def _call(breaker, error=None, seconds=0.0, clock=None):
+    permit = breaker.acquire()
+    if clock is not None:
+        clock.now += seconds
+    permit.done(error)
+
+
+def _trip(breaker):
+    for _ in range(breaker.min_calls):
+        _call(breaker, RuntimeError("down"))
+    assert breaker.state == OPEN
+
+
+def test_opens_on_failure_rate_once_min_calls_reached(clock):
+    breaker = _breaker()
+    for _ in range(3):
+        _call(breaker, RuntimeError("down"))
+    assert breaker.state == CLOSED  # Too few calls to judge
+
+    _call(breaker)
+    assert breaker.state == OPEN
+    assert breaker.trips == 1
+
+
+def test_old_failures_leave_the_window(clock):
+    breaker = _breaker()
+    for _ in range(3):
+        _call(breaker, RuntimeError("down"))
+    clock.now += 11
+    for _ in range(3):
+        _call(breaker)
+    _call(breaker, RuntimeError("down"))
+    assert breaker.state == CLOSED  # 1/4 in the current window
+
+
+def test_slow_calls_open_the_breaker(clock):
+    breaker = _breaker()
+    for _ in range(2):
+        _call(breaker)
+    for _ in range(2):
+        _call(breaker, seconds=1.5, clock=clock)
+    assert breaker.state == OPEN
+
+
+def test_ignored_errors_and_cancellations_do_not_count(clock):
+    breaker = _breaker(is_failure=lambda error: not isinstance(error, ValueError))
+    for _ in range(4):
+        _call(breaker, ValueError("bad request"))
+    for _ in range(4):
+        breaker.acquire().cancel()
+    assert breaker.state == CLOSED
+    assert breaker.stats()["failure_rate"] == 0.0
+
+
+def test_open_rejects_until_half_open_then_probes_close_it(clock):
+    breaker = _breaker()
+    _trip(breaker)
+    with pytest.raises(CircuitOpen) as rejected:
+        breaker.acquire()
+    assert rejected.value.retry_after == pytest.approx(30)
+
+    clock.now += 30
+    first, second = breaker.acquire(), breaker.acquire()
+    assert breaker.state == HALF_OPEN
+    assert first.probe and second.probe
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()  # Only half_open_probes calls at a time
+
+    first.done()
+    assert breaker.state == HALF_OPEN
+    second.done()
+    assert breaker.state == CLOSED
+    assert breaker.stats()["calls"] == 0  # Window starts afresh
+
+
+@pytest.mark.parametrize("outcome", ["failure", "slow"])
+def test_bad_probe_reopens(clock, outcome):
+    breaker = _breaker()
+    _trip(breaker)
+    clock.now += 30
+    probe = breaker.acquire()
+    if outcome == "failure":
+        probe.done(RuntimeError("still down"))
+    else:
+        clock.now += 2
+        probe.done()
+    assert breaker.state == OPEN
+    assert breaker.trips == 2
+    with pytest.raises(CircuitOpen):
+        breaker.acquire()
+
+
+def test_cancelled_probe_frees_its_place(clock):
+    breaker = _breaker()
+    _trip(breaker)
+    clock.now += 30
+    probes = [breaker.acquire(), breaker.acquire()]
+    probes[0].cancel()
+    probes.append(breaker.acquire())
+    assert breaker.state == HALF_OPEN
+    for probe in probes[1:]:
+        probe.done()
+    assert breaker.state == CLOSED
+
+
+def test_guard_records_the_block(clock):
+    breaker = _breaker()
+    for _ in range(4):
+        with pytest.raises(RuntimeError):
+            with breaker.guard():
+                raise RuntimeError("down")
+    assert breaker.state == OPEN
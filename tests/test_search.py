@@ -0,0 +1,51 @@
+"""Full-text search: the FTS5 index follows writes; the Postgres query shape"""
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql
+
+from app.models import Message
+from app.search import FullTextIndex, message_search_index
+
+
+def _search(db, term):
+    hits = message_search_index.hits(term)
+    return [row_id for (row_id,) in db.execute(select(hits.c.id).order_by(hits.c.rank))]
+
+
+def test_fts5_index_follows_insert_update_and_delete(db, make_conversation):
+    assert message_search_index.dialect == "sqlite"
+    conversation = make_conversation()
+    message = Message(
+        conversation_id=conversation.id, role="user", content="I want to try kettlebells"
+    )
+    db.add(message)
+    db.commit()
+    assert _search(db, "kettlebells") == [message.id]
+    assert _search(db, "kettle") == [message.id]  # Last word matches as a prefix
+
+    message.content = "Actually, rowing machines"
+    db.commit()
+    assert _search(db, "kettlebells") == []
+    assert _search(db, "rowing") == [message.id]
+
+    snippets = message_search_index.snippets(db, "rowing", [message.id], "content")
+    assert "<mark>rowing</mark>" in snippets[message.id]
+
+    db.delete(message)
+    db.commit()
+    assert _search(db, "rowing") == []
+
+
+def test_search_term_cannot_inject_fts5_syntax(db):
+    # Operators and quotes are reduced to plain words
+    assert FullTextIndex._fts5_query('kettle" OR content:*') == '"kettle" "OR" "content"*'
+    assert _search(db, '") NEAR(') == []
+
+
+def test_postgres_hits_use_the_tsvector_column():
+    index = FullTextIndex("messages", ["content"])
+    index.dialect = "postgresql"
+    sql = str(
+        select(index.hits("weight loss").c.id).compile(dialect=postgresql.dialect())
+    )
+    assert "messages.search_vector @@ websearch_to_tsquery" in sql
+    assert "ts_rank_cd(messages.search_vector" in sql
@@ -0,0 +1,48 @@
+"""Cold-start budget for importing the ASGI app (main:app)"""
+import json
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Seconds spent importing main on top of the frameworks it is built on
+# (FastAPI, SQLAlchemy, pydantic), which the app cannot make faster
+IMPORT_BUDGET_SECONDS = float(os.getenv("IMPORT_BUDGET_SECONDS", "0.5"))
+
+# Only needed once a request uses them
+DEFERRED_MODULES = ["pydantic_ai", "sqladmin", "twilio.rest", "httpx", "pyarrow"]
+
+PROBE = """
+import json, sys, time
+import fastapi, pydantic, sqlalchemy, sqlalchemy.orm
+started = time.perf_counter()
+from main import app
+print(json.dumps({"seconds": time.perf_counter() - started, "modules": sorted(sys.modules)}))
+"""
+
+
+def _import_main() -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_main_within_budget():
+    # Best of three, to ride out a noisy machine
+    seconds = min(_import_main()["seconds"] for _ in range(3))
+    assert seconds < IMPORT_BUDGET_SECONDS, (
+        f"Importing main:app took {seconds:.2f}s (budget {IMPORT_BUDGET_SECONDS}s); "
+        "run scripts/startup_report.py to see which imports grew"
+    )
+
+
+def test_heavy_dependencies_are_deferred():
+    modules = set(_import_main()["modules"])
+    assert [name for name in DEFERRED_MODULES if name in modules] == []